@@ -0,0 +1,154 @@
+import argparse
+import csv
+import glob
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from courier_route_optimization.constants import EXACT_MAX_STOPS
+from courier_route_optimization.IO.reader import load_deliveries_streaming, load_depot
+from courier_route_optimization.parallel import default_workers, ordered_map
+from SMART_COURIER.main import multi_weights, optimize_route
+
+'''
+Batch runner: optimizes every delivery manifest in a directory (or matching a glob) in one process pool.
+specify CLI: batch.py Locations/couriers/ --mode car --out-dir routes/ --workers 0
+                batch.py "Locations/couriers/*_deliveries.csv" --depot Locations/depot.json --mode bicycle
+
+Each manifest uses the depot JSON with the same name next to it (north.csv -> north.json), else depot.json in its
+directory, else --depot. Writes <name>_route.csv and <name>_rejected.csv per manifest (and <name>_route.npz with
+--npz, a <name>_route.png map with --maps) and a summary csv with one row per manifest. A manifest that fails is reported in the summary with its error and does not stop the others.
+<name> is the file name without .csv, prefixed with its directory name when manifests from different directories
+share a name. The summary csv of --out-dir is never read as a manifest, so --out-dir may be the input directory.
+Workers import the optimizer once and take manifests one by one, only a few are in flight at a time. Maps are
+rendered headless in the workers, each worker draws the background of a map region once (shared through
+--map-cache when given).
+'''
+
+SUMMARY_FIELDS = ["manifest", "status", "deliveries", "rejected", "distance_km", "time_h", "cost_nok", "co2_g",
+                  "late_stops", "score", "t_actual", "seconds", "route", "error"]
+
+
+# csv manifests from a directory or a glob pattern, sorted so runs are repeatable. Files in exclude (the summary
+# csv) are left out
+def find_manifests(source: str, exclude=()) -> list[Path]:
+    path = Path(source)
+    skip = {Path(p).resolve() for p in exclude}
+    if path.is_dir():
+        found = (p for p in path.glob("*.csv") if not p.stem.endswith(("_route", "_rejected")))
+    else:
+        found = (Path(p) for p in glob.glob(source) if p.endswith(".csv"))
+    return sorted(p for p in found if p.resolve() not in skip)
+
+
+# output name of every manifest: its stem, or <directory>_<stem> for stems found in more than one directory
+def output_names(manifests) -> list[str]:
+    stems = Counter(m.stem for m in manifests)
+    names = [f"{m.parent.name}_{m.stem}" if stems[m.stem] > 1 else m.stem for m in manifests]
+    repeated = sorted(name for name, n in Counter(names).items() if n > 1)
+    if repeated:
+        raise ValueError(f"Manifests would write to the same output files: {', '.join(repeated)}")
+    return names
+
+
+def find_depot(manifest: Path, default_depot):
+    for candidate in (manifest.with_suffix(".json"), manifest.parent / "depot.json"):
+        if candidate.exists():
+            return candidate
+    if default_depot is None:
+        raise ValueError(f"No depot JSON for {manifest.name} (looked for {manifest.stem}.json and depot.json)")
+    return Path(default_depot)
+
+
+# one manifest, run in a worker: every error ends up in the summary row instead of the pool
+def optimize_manifest(task):
+    manifest, name, args = task
+    start = time.perf_counter()
+    out_dir = Path(args.out_dir)
+    route_path = out_dir / f"{name}_route.csv"
+    summary = {"manifest": str(manifest), "status": "ok"}
+    try:
+        depot = load_depot(find_depot(manifest, args.depot))
+        deliveries, n_rejected = load_deliveries_streaming(manifest, out_dir / f"{name}_rejected.csv")
+        summary.update(deliveries=len(deliveries), rejected=n_rejected)
+        if not deliveries:
+            raise ValueError("No valid deliveries")
+
+        npz_path = route_path.with_suffix(".npz") if args.npz else None
+        score, t_actual, route = optimize_route(depot, deliveries, args, route_path, npz_output=npz_path)
+        summary.update(route.totals(), score=score, t_actual=t_actual, route=str(route_path))
+        if args.maps:
+            from courier_route_optimization.plots.maps import render_route
+            render_route(route, route_path.with_suffix(".png"), cache_dir=args.map_cache)
+    except Exception as e:
+        summary.update(status="error", error=f"{type(e).__name__}: {e}")
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+# optimizes all manifests and writes the summary csv, returns the summary rows in manifest order
+def run_batch(manifests, args, workers=1):
+    Path(args.out_dir).mkdir(parents=True, exist_ok=True)
+    tasks = ((manifest, name, args) for manifest, name in zip(manifests, output_names(manifests)))
+    summaries = []
+
+    with open(Path(args.out_dir) / args.summary, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+
+        def record(summary):
+            writer.writerow(summary)
+            f.flush()
+            summaries.append(summary)
+            print(f"{summary['status']:>5} {summary['manifest']} ({summary['seconds']:.2f}s)"
+                  + (f": {summary['error']}" if summary["status"] != "ok" else ""))
+
+        if workers > 1 and len(manifests) > 1:
+            with ProcessPoolExecutor(min(workers, len(manifests))) as pool:
+                for summary in ordered_map(pool, optimize_manifest, tasks):
+                    record(summary)
+        else:
+            for summary in map(optimize_manifest, tasks):
+                record(summary)
+    return summaries
+
+
+def main():
+    ap = argparse.ArgumentParser("Smart Courier batch route optimizer")
+    ap.add_argument("manifests", help="directory of delivery CSVs or a glob pattern")
+    ap.add_argument("--depot", default=None, help="depot JSON for manifests without their own")
+    ap.add_argument("--mode", required=True, choices=["car","bicycle","walk"])
+    ap.add_argument("--objective", default="time", choices=["time","cost","co2","multi"], help="metric used for scoring")
+    ap.add_argument("--order-by", default="time", choices=["time","cost","co2","multi"], help="which parameter to optimize when building the route")
+    ap.add_argument("--w-time", type=float, default=multi_weights["time"], help="weight for time in multi-objective")
+    ap.add_argument("--w-cost", type=float, default=multi_weights["cost"], help="weight for cost in multi-objective")
+    ap.add_argument("--w-co2",  type=float, default=multi_weights["co2"], help="weight for CO2 in multi-objective")
+    ap.add_argument("--start", default=None, help="ISO time; default now")
+    ap.add_argument("--distance", default="haversine", choices=["haversine","planar","auto"], help="planar is a fast equirectangular approximation, auto uses it when the area is small enough")
+    ap.add_argument("--improve", type=float, default=None, metavar="SECONDS", help="improve each route with 2-opt/Or-opt for at most SECONDS")
+    ap.add_argument("--exact-stops", type=int, default=None, metavar="N", help=f"exact (Held-Karp) route order up to N deliveries, 0 = always greedy; default {EXACT_MAX_STOPS}. Exact orders ignore the priority exponent (prio_gamma); the Pareto sweep always uses the greedy")
+    ap.add_argument("--out-dir", default="routes", help="directory for the route, rejected and summary files")
+    ap.add_argument("--npz", action="store_true", help="also write each route as typed numpy columns (<name>_route.npz)")
+    ap.add_argument("--maps", action="store_true", help="also render each route as a png map (<name>_route.png)")
+    ap.add_argument("--map-cache", default=None, metavar="DIR", help="keep the map backgrounds (coastlines) between runs")
+    ap.add_argument("--summary", default="summary.csv", help="summary file name inside --out-dir")
+    ap.add_argument("--workers", type=int, default=0, help="worker processes (0 = one per CPU core)")
+    args = ap.parse_args()
+
+    manifests = find_manifests(args.manifests, exclude=[Path(args.out_dir) / args.summary])
+    if not manifests:
+        print(f"No delivery CSVs found for {args.manifests}. Exiting.")
+        return
+    try:
+        output_names(manifests)
+    except ValueError as e:
+        ap.error(str(e))
+
+    summaries = run_batch(manifests, args, workers=args.workers or default_workers())
+    failed = sum(s["status"] != "ok" for s in summaries)
+    print(f"Optimized {len(summaries) - failed}/{len(summaries)} manifests; summary saved in "
+          f"{Path(args.out_dir) / args.summary}")
+
+
+if __name__ == "__main__":
+    main()
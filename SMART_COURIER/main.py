@@ -5,12 +5,13 @@ import csv
 import sys
 from datetime import datetime
 from pathlib import Path
-from courier_route_optimization.constants import Mode
-from courier_route_optimization.IO.reader import load_deliveries, rejected_deliveries, load_depot, write_route_csv
-from courier_route_optimization.utils import timer
+from courier_route_optimization.constants import Mode, EXACT_MAX_STOPS
+from courier_route_optimization.IO.reader import (load_deliveries_streaming, load_depot, write_route_csv,
+                                                  write_fleet_csv, write_route_npz, write_fleet_npz)
+from courier_route_optimization import instrument
+from courier_route_optimization.instrument import timer, span
 from courier_route_optimization.route_optimizer import RouteOptimizer
-from courier_route_optimization.plots.plots import plot_route
-from courier_route_optimization.pareto import evaluate_pareto_routes, get_pareto_indices
+from courier_route_optimization.parallel import default_workers
 
 '''
 Main script to run the route optimization with command line arguments:
@@ -35,31 +36,69 @@ multi_weights = {"time": 0.9167,     # Weights for multi-objective scoring
 prio_gamma = 0.2                  # exponent weight for priority in choosing next point by priority_weight^(1+gamma*normalized_distance_to_point)
 
 
-def main():
-    # Take arguments from command line, optimizes and times entire optimization process
-    @timer
-    def run(depot, deliveries, args):                                                       
-        optimizer = RouteOptimizer(
-        depot, deliveries, args.mode, args.objective,
-        {"time": args.w_time, "cost": args.w_cost, "co2": args.w_co2})
-
-        # Compute all route orders
-        o_time, o_co2, o_cost, o_multi = optimizer.closest_route_order(multiobj=True, prio_gamma=prio_gamma)
-        orders = {"time": o_time, "cost": o_cost, "co2": o_co2, "multi": o_multi}
-
-        # Choose which order type to actually build/score for this run 
-        chosen = orders.get(getattr(args, "order_by", args.objective), o_time)
-
-        # Compute total score and actual delivery time for chosen order 
-        score, t_actual = optimizer.route_scores(chosen)
+# Optimizes one manifest with the CLI options in args and writes the route csv to output (and the typed columns
+# to npz_output when given). Shared by main and the batch runner (SMART_COURIER.batch), start_time defaults to
+# --start or now
+def optimize_route(depot, deliveries, args, output: Path, distance_cache=None, road_network=None, npz_output=None,
+                   start_time=None):
+    start_time = start_time or (datetime.fromisoformat(args.start) if args.start else datetime.now())
+    optimizer = RouteOptimizer(
+    depot, deliveries, args.mode, args.objective,
+    {"time": args.w_time, "cost": args.w_cost, "co2": args.w_co2}, distance_cache=distance_cache,
+    distance=args.distance, road_network=road_network, start_time=start_time, exact_stops=args.exact_stops)
+    if distance_cache is not None and args.distance == "auto" and optimizer.projection is not None:
+        print("Note: --distance auto picked planar distances for this manifest, --distance-cache is not used")
+
+    # Compute only the route order picked by --order-by, the others come back empty
+    o_time, o_co2, o_cost, o_multi = optimizer.closest_route_order(prio_gamma=prio_gamma, orders=(args.order_by,))
+    orders = {"time": o_time, "cost": o_cost, "co2": o_co2, "multi": o_multi}
+
+    # Choose which order type to actually build/score for this run 
+    chosen = orders.get(getattr(args, "order_by", args.objective), o_time)
+
+    # Optional 2-opt / Or-opt improvement of the chosen order within the --improve time budget
+    if args.improve:
+        chosen = optimizer.improve(chosen, args.order_by, time_budget=args.improve)
+
+    # Compute total score and actual delivery time for chosen order 
+    score, t_actual = optimizer.route_scores(chosen)
+
+    # build and save the chosen route
+    with span("build", stops=len(chosen)):
+        route = optimizer.route_builder(chosen, start_time)
+    write_route_csv(route, output)
+    if npz_output:
+        write_route_npz(route, npz_output)
+
+    return score, t_actual, route
+
+
+# Optimizes and times the entire optimization process (a span, reported at the end of the run)
+@timer
+def run(depot, deliveries, args, distance_cache=None, road_network=None, start_time=None):
+    return optimize_route(depot, deliveries, args, Path(args.output), distance_cache, road_network, args.npz,
+                          start_time)
+
+# Fleet mode: capacity-feasible routes, one per vehicle, optimized in parallel and saved to one csv
+@timer
+def run_fleet(depot, deliveries, args, road_network=None, start_time=None):
+    from courier_route_optimization.fleet import plan_fleet
+
+    fleet = plan_fleet(depot, deliveries, args.mode, args.objective,
+                       {"time": args.w_time, "cost": args.w_cost, "co2": args.w_co2},
+                       order_by=args.order_by, method=args.fleet_split, capacity=args.capacity,
+                       prio_gamma=prio_gamma, improve=args.improve,
+                       start_time=start_time,
+                       workers=args.workers or default_workers(), distance=args.distance,
+                       road_network=road_network, exact_stops=args.exact_stops)
+    write_fleet_csv(fleet, Path(args.output))
+    if args.npz:
+        write_fleet_npz(fleet, Path(args.npz))
+    return fleet
 
-        # build and save the chosen route
-        start_time = datetime.fromisoformat(args.start) if args.start else datetime.now()
-        rows = optimizer.route_builder(chosen, start_time)
-        write_route_csv(rows, Path(args.output))
-
-        return score, t_actual, rows
 
+def main():
+    # Take arguments from command line
     ap = argparse.ArgumentParser("Smart Courier Delivery Route Optimizer")
     ap.add_argument("--deliveries", required=True, help="deliveries CSV path")
     ap.add_argument("--depot", required=True, help="depot JSON path")
@@ -71,55 +110,142 @@ def main():
     ap.add_argument("--w-co2",  type=float, default=multi_weights["co2"], help="weight for CO2 in multi-objective")
     ap.add_argument("--output", default="route.csv")
     ap.add_argument("--rejected", default="rejected.csv")
+    ap.add_argument("--npz", default=None, metavar="PATH", help="also write the route as typed numpy columns to PATH (.npz)")
     ap.add_argument("--start", default=None, help="ISO time; default now")
     ap.add_argument("--plot", action="store_true", help="Plot the optimized route and/or score comparison")
+    ap.add_argument("--map", default=None, metavar="PATH", help="render the route to a png without a display; with --fleet one file per vehicle (PATH_v1.png, ...)")
+    ap.add_argument("--map-cache", default=None, metavar="DIR", help="keep the map backgrounds (coastlines) between runs")
     ap.add_argument("--pareto", action="store_true", help="multi-objective weights and show Pareto front")
     ap.add_argument("--pareto-steps", type=int, default=12, help="Grid resolution for Pareto sweep")
+    ap.add_argument("--pareto-adaptive", action="store_true", help="refine the weight grid only where routes change or sit on the front, down to --pareto-steps")
+    ap.add_argument("--pareto-budget", type=int, default=None, help="max optimizer calls for the adaptive Pareto sweep")
+    ap.add_argument("--workers", type=int, default=1, help="worker processes for loading and the Pareto sweep (0 = one per CPU core)")
+    ap.add_argument("--improve", type=float, default=None, metavar="SECONDS", help="improve the route with 2-opt/Or-opt for at most SECONDS")
+    ap.add_argument("--exact-stops", type=int, default=None, metavar="N", help=f"exact (Held-Karp) route order up to N deliveries, 0 = always greedy; default {EXACT_MAX_STOPS}. Exact orders ignore the priority exponent (prio_gamma); the Pareto sweep always uses the greedy")
+    ap.add_argument("--fleet", action="store_true", help="split the deliveries into vehicle routes that fit the payload capacity")
+    ap.add_argument("--fleet-split", default="savings", choices=["savings","sweep"], help="how --fleet splits the deliveries into routes")
+    ap.add_argument("--capacity", type=float, default=None, metavar="KG", help="payload per vehicle for --fleet; default from the mode")
+    ap.add_argument("--metrics", default=None, metavar="PATH", help="write per-phase timings and counters to PATH (.json or .csv)")
+    ap.add_argument("--profile", nargs="?", const="profile.txt", default=None, metavar="PATH", help="run under cProfile and tracemalloc and write a report (default profile.txt)")
+    ap.add_argument("--distance", default="haversine", choices=["haversine","planar","auto"], help="planar is a fast equirectangular approximation, auto uses it when the area is small enough (error within PLANAR_MAX_ERROR)")
+    ap.add_argument("--distance-cache", default=None, metavar="DIR", help="keep haversine distances between runs in a cache directory (not used with --fleet, --road-graph, --distance planar, or when --distance auto picks planar, which is cheaper to compute than to read)")
+    ap.add_argument("--road-graph", default=None, metavar="DIR", help="road distances from DIR/nodes.csv and DIR/edges.csv instead of straight lines")
     args = ap.parse_args()
 
- 
-    
-
+    # distances of known locations are read from the cache, new ones are added to it when it is closed
+    distance_cache = None
+    if args.distance_cache:
+        from courier_route_optimization.distance_cache import DistanceCache
+        distance_cache = DistanceCache(args.distance_cache)
+
+    # spans are buffered during the run and written once at the end
+    instrument.enable()
+    try:
+        if args.profile:
+            with instrument.profiled(args.profile):
+                run_cli(args, distance_cache)
+            print(f"Profile saved in {args.profile}")
+        else:
+            run_cli(args, distance_cache)
+    finally:
+        if distance_cache is not None:
+            distance_cache.close()
+
+    instrument.report_timers()
+    if args.metrics:
+        instrument.export(args.metrics)
+        print(f"Metrics saved in {args.metrics}")
+
+
+# loads, optimizes, prints the summary and runs the optional Pareto sweep / plot for the parsed arguments
+def run_cli(args, distance_cache=None):
     # Load data
     depot = load_depot(Path(args.depot))                            
-    deliveries, rejected = load_deliveries(Path(args.deliveries))        
-    rejected_deliveries(rejected, Path(args.rejected))
+    deliveries, rejected = load_deliveries_streaming(Path(args.deliveries), Path(args.rejected),
+                                                     workers=args.workers or default_workers())
     if not deliveries:
         print("No valid deliveries. Exiting.")
         return
 
+    # one start time for the route, the fleet and the Pareto sweep, so delivery windows are checked the same way
+    start_time = datetime.fromisoformat(args.start) if args.start else datetime.now()
+
+    # road graph preprocessing is cached next to the graph files, the first run builds it
+    road_network = None
+    if args.road_graph:
+        from courier_route_optimization.road import RoadNetwork
+        road_network = RoadNetwork(args.road_graph)
+
+    # the cache holds straight-line haversine distances, tell the user instead of leaving it out silently
+    if distance_cache is not None:
+        unused_with = [flag for flag, on in (("--fleet", args.fleet), ("--road-graph", road_network is not None),
+                                             ("--distance planar", args.distance == "planar")) if on]
+        if unused_with:
+            print(f"Note: --distance-cache is not used with {', '.join(unused_with)}")
+
     # Run optimization and save
-    score, t_actual, rows = run(depot, deliveries, args)
-  
-    
-    # Console summary
-    total_km  = sum(float(r["distance_from_previous"]) for r in rows if r["distance_from_previous"] != "0.000")
-    total_h   = sum(float(r["time_to_current"]) for r in rows)
-    total_nok = sum(float(r["cost_to_current"]) for r in rows)
-    total_co2 = sum(float(r["co2_to_current"])  for r in rows)
-
-    print(f"Mode: {args.mode} | Objective: {args.objective}")
-    print(f"Stops (incl. depot rows): {len(rows)}")
-    print(f"Distance: {total_km:.2f} km | Time: {total_h:.2f} h | Cost: {total_nok:.2f} NOK | CO2: {total_co2:.0f} g")
-    print(f"Objective score ({args.objective}): {score:.3f} | Actual travel time: {t_actual:.3f} h")
-    print(f"Saved {args.output}" + (f"; rejected rows saved in {args.rejected}" if rejected else ""))
+    if args.fleet:
+        fleet = run_fleet(depot, deliveries, args, road_network, start_time)
+
+        print(f"Mode: {args.mode} | Objective: {args.objective} | Vehicles: {len(fleet)} ({args.fleet_split} split)")
+        for route in fleet:
+            totals = route["rows"].totals()
+            print(f"Vehicle {route['vehicle']}: {len(route['deliveries'])} stops, {route['load_kg']:.1f} kg | "
+                  f"Distance: {totals['distance_km']:.2f} km | Time: {totals['time_h']:.2f} h | "
+                  f"Cost: {totals['cost_nok']:.2f} NOK | CO2: {totals['co2_g']:.0f} g | Score: {route['score']:.3f}")
+        print(f"Saved {args.output}" + (f"; rejected rows saved in {args.rejected}" if rejected else ""))
+    else:
+        score, t_actual, route = run(depot, deliveries, args, distance_cache, road_network, start_time)
+
+        # Console summary, from the numeric columns of the route
+        totals = route.totals()
+        total_km, total_h, total_nok, total_co2 = totals["distance_km"], totals["time_h"], totals["cost_nok"], totals["co2_g"]
+
+        print(f"Mode: {args.mode} | Objective: {args.objective}")
+        print(f"Stops (incl. depot rows): {len(route)}")
+        print(f"Distance: {total_km:.2f} km | Time: {total_h:.2f} h | Cost: {total_nok:.2f} NOK | CO2: {total_co2:.0f} g")
+        print(f"Objective score ({args.objective}): {score:.3f} | Actual travel time: {t_actual:.3f} h")
+        if "late_stops" in totals:
+            print(f"Delivery windows: {totals['late_stops']} stop(s) late")
+        print(f"Saved {args.output}" + (f"; rejected rows saved in {args.rejected}" if rejected else ""))
+    if args.npz:
+        print(f"Saved route columns to {args.npz}")
     
 
     # Plotting
     if getattr(args, "pareto", False):
+        # Pareto and plotting modules are only imported when asked for, keeps start-up fast for plain runs
+        from courier_route_optimization.pareto import evaluate_pareto_routes
+
         # do optimizer and run pareto optim with different weights from args
         pareto_opt = RouteOptimizer(
             depot, deliveries, args.mode, "multi",
-            {"time": args.w_time, "cost": args.w_cost, "co2": args.w_co2}
+            {"time": args.w_time, "cost": args.w_cost, "co2": args.w_co2}, distance_cache=distance_cache,
+            distance=args.distance, road_network=road_network, start_time=start_time, exact_stops=args.exact_stops
         )
 
-        pareto_result = evaluate_pareto_routes(pareto_opt, n_steps=args.pareto_steps, gammas=(0.2, 0.6, 1.0, 1.6))
-        non_dominated = get_pareto_indices(pareto_result["performance"])
-        print(f"Pareto sweep: candidates={len(pareto_result['performance'])}, non-dominated={len(non_dominated)}")
+        pareto_result = evaluate_pareto_routes(pareto_opt, n_steps=args.pareto_steps, gammas=(0.2, 0.6, 1.0, 1.6),
+                                               workers=args.workers or default_workers(),
+                                               adaptive=args.pareto_adaptive, max_evals=args.pareto_budget)
+        # the result only holds the non-dominated candidates, the dominated ones went straight to the csv
+        print(f"Pareto sweep: candidates={pareto_result['candidates']}, non-dominated={len(pareto_result['performance'])}")
+
 
+    # headless maps, the background of each map region is drawn once and cached
+    if args.map:
+        from courier_route_optimization.plots.maps import render_routes
+        out = Path(args.map)
+        if args.fleet:
+            jobs = [(r["rows"], out.with_name(f"{out.stem}_v{r['vehicle']}{out.suffix or '.png'}")) for r in fleet]
+        else:
+            jobs = [(route, out)]
+        paths = render_routes(jobs, cache_dir=args.map_cache, workers=args.workers or default_workers())
+        print(f"Saved {len(paths)} map(s): {', '.join(str(p) for p in paths[:3])}" + (" ..." if len(paths) > 3 else ""))
 
     if args.plot:
-        plot_route(args.output, save=True)
+        from courier_route_optimization.plots.plots import plot_route
+        # the single route is plotted from memory, fleet routes from the saved csv
+        plot_route(args.output if args.fleet else route, save=True, cache_dir=args.map_cache)
         
 
 if __name__ == "__main__":
@@ -0,0 +1,440 @@
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from courier_route_optimization.constants import MODE_PARAMS, SERVE_MAX_PENDING, SERVE_CACHE_SIZE, SERVE_MAX_ROUTES
+from courier_route_optimization.IO.reader import load_deliveries_streaming, load_depot, parse_depot, validate_rows
+from courier_route_optimization.route_optimizer import RouteOptimizer
+from courier_route_optimization.distance import DISTANCE_BACKENDS
+from courier_route_optimization.parallel import default_workers
+from SMART_COURIER.main import multi_weights, prio_gamma
+
+'''
+Local optimization service: one long-running asyncio process that keeps depots, delivery tables and warm
+optimizers (distance matrix, reference totals) in memory, so a dispatch system gets routes without paying for
+interpreter start-up and csv round-trips per request.
+specify CLI: serve.py --port 8765 --workers 4
+                serve.py --unix /tmp/courier.sock --depot Locations/depot.json --deliveries Locations/deliveries.csv
+
+HTTP/1.1 with JSON bodies (keep-alive), over TCP or a Unix socket:
+    POST /depot      {"id", "latitude", "longitude"}
+    POST /manifest   {"id", "depot", "deliveries": [{"customer", "latitude", "longitude", "priority", "weight_kg"}]}
+                     or {"id", "depot", "csv": path}, rows are validated like the csv loader, rejected ones returned
+    POST /optimize   {"manifest", "mode", "objective", "order_by", "weights", "distance", "improve", "start", "live"}
+    POST /pareto     {"manifest", "mode", "distance", "steps", "gammas", "adaptive", "budget"}
+    POST /insert     {"route", "delivery"}, /remove {"route", "node"}, /advance {"route"}, /route {"route"}
+                     and /close {"route"} work on the live route made by /optimize with "live": true, at most
+                     max_routes are kept (least recently used ones are dropped, later calls on them get 404)
+    GET  /health, GET /stats
+Optimizer work runs in a thread pool so the warm optimizers are shared. Identical optimize/pareto requests and
+optimizer builds that are already running are coalesced (later callers wait for the same result), and when
+SERVE_MAX_PENDING jobs are queued or running new work is refused with 503 and Retry-After instead of queueing
+without bound. Live route updates are small numpy passes and run on the event loop, so they apply in order.
+'''
+
+MAX_BODY = 64 * 2**20
+OBJECTIVES = ("time", "cost", "co2", "multi")
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def _require(body: dict, name: str):
+    if name not in body:
+        raise ValueError(f"Missing field: {name}")
+    return body[name]
+
+
+# request numbers are coerced like the CLI arguments, anything else is a 400 instead of failing in the optimizer
+def _number(value, name: str, cast=float):
+    if value is None:
+        return None
+    try:
+        if isinstance(value, (bool, list, dict)):
+            raise TypeError
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"{name} must be a finite number >= 0, got {value!r}")
+    return number
+
+
+def _weights(body: dict) -> dict:
+    weights = body.get("weights", {})
+    if not isinstance(weights, dict):
+        raise ValueError(f"weights must be an object like {multi_weights}")
+    unknown = sorted(set(weights) - set(multi_weights))
+    if unknown:
+        raise ValueError(f"Unknown weights {unknown}, use {list(multi_weights)}")
+    return {**multi_weights, **{k: _number(v, f"weights.{k}") for k, v in weights.items() if v is not None}}
+
+
+# numpy scalars in orders/totals
+def _json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class RouteService:
+    def __init__(self, workers=None, max_pending=SERVE_MAX_PENDING, cache_size=SERVE_CACHE_SIZE,
+                 max_routes=SERVE_MAX_ROUTES):
+        self.workers = workers or default_workers()
+        self.pool = ThreadPoolExecutor(self.workers)
+        self.depots = {}
+        self.manifests = {}                 # id -> (depot id, DeliveryTable)
+        self.optimizers = OrderedDict()     # (manifest, mode, objective, weights, distance) -> RouteOptimizer, least recent first
+        self.routes = OrderedDict()         # id -> LiveRoute, least recent first
+        self.cache_size = cache_size
+        self.max_routes = max_routes
+        self.stats = {"requests": 0, "coalesced": 0, "busy": 0, "errors": 0, "jobs": 0}
+        self._slots = asyncio.Semaphore(max_pending)
+        self._inflight = {}
+        self._next_route = 1
+        self.endpoints = {
+            ("GET", "/health"): self.health,
+            ("GET", "/stats"): self.get_stats,
+            ("POST", "/depot"): self.add_depot,
+            ("POST", "/manifest"): self.add_manifest,
+            ("POST", "/optimize"): self.optimize,
+            ("POST", "/pareto"): self.pareto,
+            ("POST", "/insert"): self.insert,
+            ("POST", "/remove"): self.remove,
+            ("POST", "/advance"): self.advance,
+            ("POST", "/route"): self.route,
+            ("POST", "/close"): self.close_route,
+        }
+
+    # runs fn in the pool, refused when max_pending jobs are already queued or running
+    async def _run(self, fn, *args):
+        if self._slots.locked():
+            self.stats["busy"] += 1
+            raise ServiceBusy()
+        async with self._slots:
+            self.stats["jobs"] += 1
+            return await asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+
+    # callers with the same key while the first one is running share its result
+    async def _coalesced(self, key, make):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # shielded so a caller that disconnects does not cancel the others
+        return await asyncio.shield(task)
+
+    def _manifest(self, name):
+        if name not in self.manifests:
+            raise NotFound(f"Unknown manifest: {name}")
+        return self.manifests[name]
+
+    def _live(self, body):
+        name = str(_require(body, "route"))
+        if name not in self.routes:
+            raise NotFound(f"Unknown route: {name}")
+        self.routes.move_to_end(name)
+        return self.routes[name]
+
+    @staticmethod
+    def _build_optimizer(depot, table, mode, objective, weights, distance):
+        optimizer = RouteOptimizer(depot, table, mode, objective, weights, distance=distance)
+        # warm: matrix, priorities and reference totals are built here instead of in the first request
+        optimizer.distance_matrix
+        optimizer._star_refs()
+        return optimizer
+
+    async def _optimizer(self, body, objective=None):
+        manifest = _require(body, "manifest")
+        mode = _require(body, "mode")
+        objective = objective or body.get("objective", "time")
+        distance = body.get("distance", "haversine")
+        if mode not in MODE_PARAMS:
+            raise ValueError(f"Unknown mode: {mode}")
+        if distance not in DISTANCE_BACKENDS:
+            raise ValueError(f"Unknown distance, use one of {DISTANCE_BACKENDS}")
+        if objective not in OBJECTIVES or body.get("order_by", "time") not in OBJECTIVES:
+            raise ValueError(f"Unknown objective, use one of {OBJECTIVES}")
+        weights = _weights(body)
+        depot_id, table = self._manifest(manifest)
+        key = (manifest, mode, objective, tuple(sorted(weights.items())), distance)
+
+        optimizer = self.optimizers.get(key)
+        if optimizer is None:
+            make = lambda: self._run(self._build_optimizer, self.depots[depot_id], table, mode, objective, weights,
+                                     distance)
+            optimizer = await self._coalesced(("optimizer", id(table)) + key[1:], make)
+            # the manifest may have been replaced while the optimizer was built
+            if self.manifests.get(manifest, (None, None))[1] is table:
+                self.optimizers[key] = optimizer
+        if key in self.optimizers:
+            self.optimizers.move_to_end(key)
+        while len(self.optimizers) > self.cache_size:
+            self.optimizers.popitem(last=False)
+        return optimizer
+
+    async def health(self, body):
+        return {"status": "ok"}
+
+    async def get_stats(self, body):
+        return {**self.stats, "pending": len(self._inflight), "depots": len(self.depots),
+                "manifests": len(self.manifests), "optimizers": len(self.optimizers), "routes": len(self.routes)}
+
+    async def add_depot(self, body):
+        name = str(_require(body, "id"))
+        self.depots[name] = parse_depot(body)
+        return {"id": name}
+
+    async def add_manifest(self, body):
+        name = str(_require(body, "id"))
+        depot_id = str(_require(body, "depot"))
+        if depot_id not in self.depots:
+            raise NotFound(f"Unknown depot: {depot_id}")
+
+        if "csv" in body:
+            table, n_rejected = await self._run(load_deliveries_streaming, body["csv"])
+            rejected = []
+        else:
+            fieldnames = ["customer", "latitude", "longitude", "priority", "weight_kg"]
+            rows = [["" if d.get(f) is None else str(d.get(f)) for f in fieldnames] for d in _require(body, "deliveries")]
+            table, rejected = await self._run(validate_rows, rows, fieldnames)
+            n_rejected = len(rejected)
+
+        self.manifests[name] = (depot_id, table)
+        for key in [key for key in self.optimizers if key[0] == name]:
+            del self.optimizers[key]
+        return {"id": name, "deliveries": len(table), "rejected": n_rejected,
+                "rejected_rows": [{"row": r["row"], "cause": r["cause"]} for r in rejected]}
+
+    @staticmethod
+    def _plan(optimizer, order_by, improve, start):
+        # the shared optimizer has no start time of its own, delivery windows are checked against this one
+        orders = optimizer.closest_route_order(prio_gamma=prio_gamma, orders=(order_by,), start_time=start)
+        order = dict(zip(("time", "co2", "cost", "multi"), orders))[order_by]
+        if improve:
+            order = optimizer.improve(order, order_by, time_budget=improve, start_time=start)
+        score, t_actual = optimizer.route_scores(order)
+        route = optimizer.route_builder(order, start)
+        return {"order": list(order), "score": score, "t_actual": t_actual, "totals": route.totals(),
+                "rows": list(route.format_rows())}
+
+    async def optimize(self, body):
+        optimizer = await self._optimizer(body)
+        if not len(optimizer.deliveries):
+            raise ValueError("No valid deliveries")
+        order_by = body.get("order_by", "time")
+        improve = _number(body.get("improve"), "improve")
+        start = datetime.fromisoformat(body["start"]) if body.get("start") else datetime.now()
+
+        key = ("optimize", id(optimizer), order_by, improve, start.isoformat())
+        result = await self._coalesced(key, lambda: self._run(self._plan, optimizer, order_by, improve, start))
+        if body.get("live"):
+            name = str(self._next_route)
+            self._next_route += 1
+            self.routes[name] = optimizer.live_route(result["order"], order_by)
+            while len(self.routes) > self.max_routes:
+                self.routes.popitem(last=False)
+            result = {**result, "route": name}
+        return result
+
+    @staticmethod
+    def _sweep(optimizer, steps, gammas, adaptive, budget):
+        from courier_route_optimization.pareto import evaluate_pareto_routes
+
+        result = evaluate_pareto_routes(optimizer, n_steps=steps, gammas=gammas, save_csv=False, workers=1,
+                                        adaptive=adaptive, max_evals=budget)
+        front = [{"time": t, "cost": c, "co2": z, "weights": weights, "gamma": gamma, "order": route.tolist()}
+                 for (t, c, z), weights, gamma, route in zip(result["performance"], result["weights"],
+                                                             result["gammas"], result["routes"])]
+        return {"candidates": result["candidates"], "front": front}
+
+    async def pareto(self, body):
+        optimizer = await self._optimizer(body, objective="multi")
+        steps = _number(body.get("steps", 12), "steps", int)
+        gammas = body.get("gammas", (0.2, 0.6, 1.0, 1.6))
+        if not isinstance(gammas, (list, tuple)) or not gammas or None in gammas:
+            raise ValueError("gammas must be a non-empty list of numbers")
+        gammas = tuple(_number(g, "gammas", float) for g in gammas)
+        adaptive = bool(body.get("adaptive", False))
+        budget = _number(body.get("budget"), "budget", int)
+        key = ("pareto", id(optimizer), steps, gammas, adaptive, budget)
+        return await self._coalesced(key, lambda: self._run(self._sweep, optimizer, steps, gammas, adaptive, budget))
+
+    @staticmethod
+    def _live_state(live):
+        return {"stops": len(live), "nodes": live.nodes(), "current": int(live.current), "totals": live.totals()}
+
+    async def insert(self, body):
+        live = self._live(body)
+        d = _require(body, "delivery")
+        fieldnames = ["customer", "latitude", "longitude", "priority", "weight_kg"]
+        table, rejected = validate_rows([["" if d.get(f) is None else str(d.get(f)) for f in fieldnames]], fieldnames)
+        if rejected:
+            raise ValueError(rejected[0]["cause"])
+        return {"node": live.insert(table[0]), **self._live_state(live)}
+
+    async def remove(self, body):
+        live = self._live(body)
+        live.remove(int(_require(body, "node")))
+        return self._live_state(live)
+
+    async def advance(self, body):
+        live = self._live(body)
+        return {"reached": live.advance(), **self._live_state(live)}
+
+    async def route(self, body):
+        live = self._live(body)
+        start = datetime.fromisoformat(body["start"]) if body.get("start") else datetime.now()
+        return {**self._live_state(live), "rows": list(live.route_result(start).format_rows())}
+
+    async def close_route(self, body):
+        self._live(body)
+        del self.routes[str(body["route"])]
+        return {"closed": str(body["route"])}
+
+    # (status, payload) for one request
+    async def handle(self, method: str, path: str, raw: bytes):
+        self.stats["requests"] += 1
+        endpoint = self.endpoints.get((method, path.split("?", 1)[0]))
+        if endpoint is None:
+            return HTTPStatus.NOT_FOUND, {"error": f"No endpoint {method} {path}"}
+        try:
+            body = json.loads(raw) if raw else {}
+            if not isinstance(body, dict):
+                raise ValueError("The request body must be a JSON object")
+            return HTTPStatus.OK, await endpoint(body)
+        except ServiceBusy:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "Too many pending requests, retry later"}
+        except NotFound as e:
+            return HTTPStatus.NOT_FOUND, {"error": str(e)}
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except Exception as e:
+            self.stats["errors"] += 1
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+    # one client connection, requests are answered in order while it keeps the connection alive
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                parts = line.decode("latin-1").split()
+                length = int(headers.get("content-length", 0) or 0)
+                if len(parts) != 3 or length > MAX_BODY:
+                    status, payload, keep_alive = HTTPStatus.BAD_REQUEST, {"error": "Bad request"}, False
+                else:
+                    method, path, version = parts
+                    raw = await reader.readexactly(length) if length else b""
+                    status, payload = await self.handle(method, path, raw)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                data = json.dumps(payload, default=_json_default).encode()
+                head = [f"HTTP/1.1 {status.value} {status.phrase}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                if status == HTTPStatus.SERVICE_UNAVAILABLE:
+                    head.append("Retry-After: 1")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+# small blocking client for scripts and local testing, returns (status, payload)
+def request(path: str, body=None, host="127.0.0.1", port=8765, unix=None, timeout=None):
+    conn = _UnixConnection(unix, timeout) if unix else http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        if body is None:
+            conn.request("GET", path)
+        else:
+            conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+
+async def serve(args):
+    service = RouteService(args.workers or None, args.max_pending, args.cache_size, args.max_routes)
+    if args.depot:
+        service.depots["default"] = load_depot(args.depot)
+    if args.deliveries:
+        table, n_rejected = load_deliveries_streaming(args.deliveries)
+        service.manifests["default"] = ("default", table)
+        print(f"Loaded manifest 'default': {len(table)} deliveries, {n_rejected} rejected")
+
+    if args.unix:
+        server = await asyncio.start_unix_server(service.serve_connection, path=args.unix)
+        where = args.unix
+    else:
+        server = await asyncio.start_server(service.serve_connection, args.host, args.port)
+        where = f"http://{args.host}:{args.port}"
+    print(f"Smart Courier service on {where} ({service.workers} workers)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    ap = argparse.ArgumentParser("Smart Courier optimization service")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--unix", default=None, metavar="PATH", help="listen on a Unix socket instead of TCP")
+    ap.add_argument("--workers", type=int, default=0, help="optimizer threads (0 = one per CPU core)")
+    ap.add_argument("--max-pending", type=int, default=SERVE_MAX_PENDING, help="jobs queued or running before requests get 503")
+    ap.add_argument("--cache-size", type=int, default=SERVE_CACHE_SIZE, help="warm optimizers kept in memory")
+    ap.add_argument("--max-routes", type=int, default=SERVE_MAX_ROUTES, help="live routes kept in memory, the least recently used is dropped")
+    ap.add_argument("--depot", default=None, help="depot JSON loaded as depot 'default'")
+    ap.add_argument("--deliveries", default=None, help="deliveries CSV loaded as manifest 'default' (needs --depot)")
+    args = ap.parse_args()
+    if args.deliveries and not args.depot:
+        ap.error("--deliveries needs --depot")
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import time
+from courier_route_optimization.constants import MODE_PARAMS, URGENCY_MULT
+from courier_route_optimization.route_optimizer import RouteOptimizer
+from courier_route_optimization.utils import haversine
+from benchmarks.synthetic import make_depot, make_deliveries
+
+'''
+Benchmark of closest_route_order against the previous implementation (four separate greedy loops with a scalar
+haversine per candidate). Run from the repo root:
+    python -m benchmarks.bench_greedy --sizes 100 1000 5000 20000
+The legacy loops are quadratic in pure Python so they are only timed up to --legacy-max stops.
+'''
+
+WEIGHTS = {"time": 0.9167, "cost": 0.0833, "co2": 0.5896}
+
+
+# previous closest_route_order, kept here as the baseline (same keys, dicts + closures per step) on the
+# list of dicts the optimizer used to store
+def legacy_closest_route_order(opt, deliveries, prio_gamma=0.6):
+    def walk(key_for):
+        order = []
+        remaining = set(range(len(deliveries)))
+        cur_lat, cur_lon = opt.depot["lat"], opt.depot["lon"]
+        while remaining:
+            distances = {k: haversine(cur_lat, cur_lon, deliveries[k]["lat"], deliveries[k]["lon"]) for k in remaining}
+            d_max = max(distances.values()) or 0.0001
+            j = min(remaining, key=key_for(distances, d_max))
+            order.append(j)
+            cur_lat, cur_lon = deliveries[j]["lat"], deliveries[j]["lon"]
+            remaining.remove(j)
+        return order
+
+    p = MODE_PARAMS[opt.mode]
+    w = opt.multi_weights
+
+    def prio_dyn(k, d, d_max):
+        return URGENCY_MULT[deliveries[k]["priority"]] ** (1.0 + prio_gamma * d / d_max)
+
+    time_key = lambda dist, d_max: lambda k: prio_dyn(k, dist[k], d_max) * dist[k]
+    co2_key = lambda dist, d_max: lambda k: p["co2"] * dist[k]
+    cost_key = lambda dist, d_max: lambda k: p["cost"] * dist[k]
+    multi_key = lambda dist, d_max: lambda k: (w["time"] * prio_dyn(k, dist[k], d_max) * (dist[k] / p["speed"])
+                                               + w["cost"] * (dist[k] * p["cost"]) + w["co2"] * (dist[k] * p["co2"]))
+    return walk(time_key), walk(co2_key), walk(cost_key), walk(multi_key)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    ap = argparse.ArgumentParser("closest_route_order benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000, 20000])
+    ap.add_argument("--legacy-max", type=int, default=2000, help="largest size to time the legacy loops on")
+    ap.add_argument("--mode", default="car", choices=["car", "bicycle", "walk"])
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    print(f"{'n':>7} {'legacy all':>11} {'matrix':>9} {'all four':>9} {'time only':>10} {'speedup':>8}")
+    for n in args.sizes:
+        depot, deliveries = make_depot(), make_deliveries(n, seed=args.seed)
+        opt = RouteOptimizer(depot, deliveries, args.mode, "time", dict(WEIGHTS))
+
+        t_matrix, _ = timed(lambda: opt.distance_matrix)
+        t_all, new = timed(opt.closest_route_order, multiobj=True)
+        t_one, _ = timed(opt.closest_route_order, orders=("time",))
+
+        legacy = speedup = "-"
+        if n <= args.legacy_max:
+            t_legacy, old = timed(legacy_closest_route_order, opt, deliveries)
+            assert [list(o) for o in old] == [list(o) for o in new], f"orders differ at n={n}"
+            legacy = f"{t_legacy:.3f}"
+            speedup = f"{t_legacy / (t_matrix + t_all):.1f}x"
+
+        print(f"{n:>7} {legacy:>11} {t_matrix:>9.3f} {t_all:>9.3f} {t_one:>10.3f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
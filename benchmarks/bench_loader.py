@@ -0,0 +1,107 @@
+import argparse
+import csv
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.synthetic import write_manifest
+
+'''
+Benchmark of the delivery manifest loaders on a synthetic csv with ~1% bad rows. Every variant runs in its own
+interpreter so the peak memory (max RSS) is its own. Run from the repo root:
+    python -m benchmarks.bench_loader --sizes 100000 1000000 --workers 4
+'''
+
+
+# previous load_deliveries (DictReader, one row at a time, all rejected rows kept in memory), kept as baseline
+def legacy_load_deliveries(csv_path):
+    deliveries = []
+    rejected = []
+    NAME_OK = re.compile(r"^[A-Za-zÀ-ÖØ-öø-ÿ'’\-\.\s]+$")
+    with open(csv_path, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        for i, row in enumerate(reader, start=2):
+            try:
+                name = (row.get("customer") or "").strip()
+                if not name:
+                    raise ValueError("No customer name")
+                if not NAME_OK.match(name):
+                    raise ValueError("Invalid customer name (contains digits or illegal characters)")
+                lat = float((row.get("latitude") or "").strip().replace(",", "."))
+                lon = float((row.get("longitude") or "").strip().replace(",", "."))
+                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                    raise ValueError("Coordinates are out of valid range")
+                priority = (row.get("priority") or "").strip().lower()
+                if priority not in ("high", "medium", "low"):
+                    raise ValueError("The priority value is not valid (high/medium/low)")
+                weight = float((row.get("weight_kg") or "").strip().replace(",", "."))
+                if weight <= 0:
+                    raise ValueError("The package weight is zero or negative value")
+                deliveries.append({"customer": name, "lat": lat, "lon": lon, "priority": priority, "weight_kg": weight})
+            except Exception as e:
+                rejected.append({"row": i, "cause": str(e), **row})
+    return deliveries, rejected
+
+
+# runs one variant in this process and prints its result as json (called through the subprocess below)
+def run_variant(variant, csv_path, workers, rejected_path):
+    from courier_route_optimization.IO.reader import load_deliveries, load_deliveries_streaming, rejected_deliveries
+
+    start = time.perf_counter()
+    if variant == "legacy":
+        deliveries, rejected = legacy_load_deliveries(csv_path)
+        n_rejected = len(rejected)
+    elif variant == "chunked":
+        deliveries, rejected = load_deliveries(csv_path)
+        rejected_deliveries(rejected, rejected_path)
+        n_rejected = len(rejected)
+    else:
+        deliveries, n_rejected = load_deliveries_streaming(csv_path, rejected_path, workers=workers)
+    seconds = time.perf_counter() - start
+
+    # ru_maxrss is kB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+    print(json.dumps({"seconds": seconds, "valid": len(deliveries), "rejected": n_rejected, "rss_mb": rss_mb}))
+
+
+def measure(variant, csv_path, workers, rejected_path):
+    cmd = [sys.executable, "-m", "benchmarks.bench_loader", "--run", variant, str(csv_path),
+           "--workers", str(workers), "--rejected", str(rejected_path)]
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser("delivery loader benchmark")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="workers for the parallel variant")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--rejected", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--run", nargs=2, metavar=("VARIANT", "CSV"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.run:
+        run_variant(args.run[0], Path(args.run[1]), args.workers, Path(args.rejected))
+        return
+
+    variants = [("legacy", 1), ("chunked", 1), ("streaming", 1), ("streaming", args.workers)]
+    print(f"{'rows':>9} {'variant':>16} {'time s':>8} {'rows/s':>10} {'max RSS MB':>11} {'rejected':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            csv_path = Path(tmp) / f"deliveries_{n}.csv"
+            write_manifest(csv_path, n, seed=args.seed)
+            for variant, workers in variants:
+                r = measure(variant, csv_path, workers, Path(tmp) / "rejected.csv")
+                label = f"{variant} x{workers}" if variant == "streaming" else variant
+                print(f"{n:>9} {label:>16} {r['seconds']:>8.2f} {n / r['seconds']:>10.0f} {r['rss_mb']:>11.1f} "
+                      f"{r['rejected']:>9}")
+
+
+if __name__ == "__main__":
+    main()
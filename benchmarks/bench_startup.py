@@ -0,0 +1,77 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from benchmarks.synthetic import make_depot, write_manifest
+
+'''
+Cold start benchmark of the smart-courier CLI. Reports the import time of SMART_COURIER.main from
+python -X importtime (cumulative microseconds per module, the slowest ones listed) and the wall time of whole
+CLI runs on a small manifest, each in a fresh interpreter. Run from the repo root:
+    python -m benchmarks.bench_startup --runs 10
+'''
+
+
+# {module: (self_us, cumulative_us)} of one interpreter start that imports module
+def import_times(module: str) -> dict:
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    err = subprocess.run(cmd, check=True, capture_output=True, text=True).stderr
+    times = {}
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def cli_wall_times(runs: int, n_stops: int, extra_args) -> list[float]:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        write_manifest(tmp / "deliveries.csv", n_stops, bad_fraction=0.0)
+        (tmp / "depot.json").write_text(json.dumps({"latitude": make_depot()["lat"], "longitude": make_depot()["lon"]}))
+        cmd = [sys.executable, "-c", "from SMART_COURIER.main import main; main()",
+               "--deliveries", str(tmp / "deliveries.csv"), "--depot", str(tmp / "depot.json"), "--mode", "car",
+               "--output", str(tmp / "route.csv"), "--rejected", str(tmp / "rejected.csv"), *extra_args]
+        walls = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(cmd, check=True, capture_output=True, cwd=tmp)
+            walls.append(time.perf_counter() - start)
+        return walls
+
+
+def main():
+    ap = argparse.ArgumentParser("CLI start-up benchmark")
+    ap.add_argument("--module", default="SMART_COURIER.main")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--stops", type=int, default=20, help="deliveries in the manifest for the CLI runs")
+    ap.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    ap.add_argument("--cli-args", nargs=argparse.REMAINDER, default=[], help="extra CLI arguments, e.g. --pareto")
+    args = ap.parse_args()
+
+    # best of the runs per module, the first start also pays for cold file caches
+    best = {}
+    for _ in range(args.runs):
+        for name, (self_us, cumulative_us) in import_times(args.module).items():
+            if name not in best or cumulative_us < best[name][1]:
+                best[name] = (self_us, cumulative_us)
+
+    total = best.get(args.module, (0, 0))[1]
+    print(f"import {args.module}: {total / 1000:.1f} ms (best of {args.runs}), {len(best)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, (self_us, cumulative_us) in sorted(best.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+
+    walls = cli_wall_times(args.runs, args.stops, args.cli_args)
+    print(f"CLI run ({args.stops} stops): median {statistics.median(walls) * 1000:.0f} ms, "
+          f"min {min(walls) * 1000:.0f} ms over {args.runs} runs")
+
+
+if __name__ == "__main__":
+    main()
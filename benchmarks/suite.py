@@ -0,0 +1,187 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from courier_route_optimization.IO.reader import load_deliveries
+from courier_route_optimization.route_optimizer import RouteOptimizer
+from courier_route_optimization.pareto import evaluate_pareto_routes
+from benchmarks.synthetic import SCENARIOS, make_depot, make_table, write_table_manifest
+
+'''
+Regression benchmark suite for the hot paths on seeded synthetic manifests (benchmarks/synthetic.py).
+Every benchmark runs for every scenario and size up to its own size limit, and the per-call times are
+written to a json file. compare reads two result files and exits with status 1 when a benchmark got slower
+than --threshold, so it can be run before a release. Run from the repo root:
+    python -m benchmarks.suite run --sizes 10 100 1000 10000 --out base.json
+    python -m benchmarks.suite run --sizes 10 100 1000 10000 --out new.json
+    python -m benchmarks.suite compare base.json new.json --threshold 0.15
+Fast calls are repeated until one measurement takes about --min-time seconds, the reported time is per call.
+Comparisons use the best of --repeat measurements, which is the least noisy one.
+'''
+
+WEIGHTS = {"time": 0.9167, "cost": 0.0833, "co2": 0.5896}
+
+# benchmark -> largest size it runs at by default (quadratic parts or a full matrix above that)
+MAX_SIZES = {
+    "load_deliveries": 1_000_000,
+    "closest_route_order": 100_000,
+    "route_totals": 100_000,
+    "route_scores": 100_000,
+    "route_builder": 100_000,
+    "evaluate_pareto_routes": 1_000,
+}
+
+
+# per-call seconds of repeat measurements, each one running fn often enough to take about min_time
+def measure(fn, repeat=3, min_time=0.2) -> list[float]:
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 2**20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+# benchmarks that time calls on one planned route, they share an optimizer and its greedy order
+ON_ORDER = ("route_totals", "route_scores", "route_builder")
+
+
+# {benchmark: zero-argument callable} for one manifest and the wanted benchmarks. The optimizer and its greedy
+# order are only built (once, outside the timing) when one of the ON_ORDER benchmarks is wanted
+def bench_calls(table, csv_path, steps, wanted=tuple(MAX_SIZES)):
+    depot = make_depot()
+    calls = {
+        "load_deliveries": lambda: load_deliveries(csv_path),
+        # a new optimizer per call, so the distance matrix is part of the time like in a CLI run
+        "closest_route_order": lambda: RouteOptimizer(depot, table, "car", "time", WEIGHTS).closest_route_order(orders=("time",)),
+        "evaluate_pareto_routes": lambda: evaluate_pareto_routes(
+            RouteOptimizer(depot, table, "car", "multi", WEIGHTS), n_steps=steps, save_csv=False, workers=1),
+    }
+    if any(bench in wanted for bench in ON_ORDER):
+        optimizer = RouteOptimizer(depot, table, "car", "time", WEIGHTS)
+        order = optimizer.closest_route_order(orders=("time",))[0]
+        start = datetime(2025, 1, 1, 8, 0)
+        calls.update({
+            "route_totals": lambda: optimizer.route_totals(order),
+            "route_scores": lambda: optimizer.route_scores(order),
+            "route_builder": lambda: optimizer.route_builder(order, start),
+        })
+    return {bench: call for bench, call in calls.items() if bench in wanted}
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_suite(sizes, scenarios, benches, repeat=3, min_time=0.2, seed=0, max_sizes=None, pareto_steps=6):
+    max_sizes = {**MAX_SIZES, **(max_sizes or {})}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in scenarios:
+            for n in sizes:
+                wanted = [b for b in benches if n <= max_sizes[b]]
+                if not wanted:
+                    continue
+                table = make_table(n, seed=seed, scenario=scenario)
+                csv_path = Path(tmp) / f"{scenario}_{n}.csv"
+                if "load_deliveries" in wanted:
+                    write_table_manifest(csv_path, table, seed=seed)
+                calls = bench_calls(table, csv_path, pareto_steps, wanted)
+
+                for bench in wanted:
+                    times = measure(calls[bench], repeat, min_time)
+                    results.append({"bench": bench, "scenario": scenario, "n": n, "times": times,
+                                    "min": min(times), "median": statistics.median(times)})
+                    print(f"{bench:<24} {scenario:<9} n={n:<8} best {min(times) * 1000:10.3f} ms  "
+                          f"median {statistics.median(times) * 1000:10.3f} ms", flush=True)
+    return {
+        "meta": {"created": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                 "python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(),
+                 "platform": platform.platform(), "seed": seed, "repeat": repeat, "min_time": min_time},
+        "results": results,
+    }
+
+
+# rows of (bench, scenario, n, base s, new s, ratio) for the benchmarks in both result files
+def compare_results(base: dict, new: dict):
+    key = lambda r: (r["bench"], r["scenario"], r["n"])
+    base_by_key = {key(r): r for r in base["results"]}
+    rows = []
+    for r in new["results"]:
+        b = base_by_key.get(key(r))
+        if b is not None:
+            rows.append((*key(r), b["min"], r["min"], r["min"] / b["min"] if b["min"] > 0 else float("inf")))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser("Benchmark suite")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmarks and write a json result file")
+    run.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    run.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    run.add_argument("--bench", nargs="+", default=list(MAX_SIZES), choices=list(MAX_SIZES))
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement, fast calls are repeated")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--pareto-steps", type=int, default=6)
+    run.add_argument("--no-limits", action="store_true", help="run every benchmark at every size")
+    run.add_argument("--out", default="benchmark_results.json")
+
+    cmp = sub.add_parser("compare", help="compare two result files, exit status 1 on a regression")
+    cmp.add_argument("base")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown, 0.15 = 15%%")
+    args = ap.parse_args()
+
+    if args.command == "run":
+        max_sizes = {b: float("inf") for b in MAX_SIZES} if args.no_limits else None
+        result = run_suite(args.sizes, args.scenarios, args.bench, args.repeat, args.min_time, args.seed, max_sizes,
+                           args.pareto_steps)
+        Path(args.out).write_text(json.dumps(result, indent=2))
+        print(f"Saved {len(result['results'])} results to {args.out}")
+        return
+
+    base = json.loads(Path(args.base).read_text())
+    new = json.loads(Path(args.new).read_text())
+    rows = compare_results(base, new)
+    print(f"base {base['meta']['commit'] or args.base} -> new {new['meta']['commit'] or args.new}")
+    print(f"{'benchmark':<24} {'scenario':<9} {'n':>8} {'base ms':>11} {'new ms':>11} {'ratio':>7}")
+    regressions = 0
+    for bench, scenario, n, b, r, ratio in rows:
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = "  faster"
+        print(f"{bench:<24} {scenario:<9} {n:>8} {b * 1000:>11.3f} {r * 1000:>11.3f} {ratio:>7.2f}{flag}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%} in {len(rows)} compared benchmarks")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
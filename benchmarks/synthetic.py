@@ -0,0 +1,89 @@
+import math
+import random
+import numpy as np
+from courier_route_optimization.deliveries import DeliveryTable
+
+'''
+Seeded synthetic depot and deliveries around Oslo for benchmarks, same dict format as IO.reader returns.
+make_table builds a DeliveryTable for one of the SCENARIOS directly from numpy, fast enough for 1M stops:
+    urban     - stops in dense clusters (neighbourhoods) inside the city box
+    regional  - stops spread uniformly over a region of about 170 x 85 km
+    mixed     - city box, uniform, with an even mix of high/medium/low priorities (the others are mostly medium)
+'''
+
+OSLO = (59.9139, 10.7522)
+
+SCENARIOS = {
+    "urban":    {"layout": "clustered", "spread": 0.08, "clusters": 12, "cluster_km": 0.6,
+                 "priority_mix": (0.1, 0.7, 0.2)},
+    "regional": {"layout": "uniform", "spread": 1.5, "priority_mix": (0.1, 0.7, 0.2)},
+    "mixed":    {"layout": "uniform", "spread": 0.08, "priority_mix": (1 / 3, 1 / 3, 1 / 3)},
+}
+
+def make_depot(center=OSLO):
+    return {"name": "Depot", "lat": center[0], "lon": center[1]}
+
+# uniform deliveries in a box of +-spread degrees around the depot
+def make_deliveries(n: int, seed=0, center=OSLO, spread=0.08):
+    rng = random.Random(seed)
+    return [{
+        "customer": f"Customer {i}",
+        "lat": center[0] + rng.uniform(-spread, spread) / 2,
+        "lon": center[1] + rng.uniform(-spread, spread),
+        "priority": rng.choice(("high", "medium", "low")),
+        "weight_kg": round(rng.uniform(0.2, 20.0), 1),
+    } for i in range(n)]
+
+# customer names may not contain digits, so the index is spelled with letters (0 -> "A", 26 -> "BA")
+def letter_name(i: int) -> str:
+    s = ""
+    while True:
+        i, r = divmod(i, 26)
+        s = chr(ord("A") + r) + s
+        if not i:
+            return "Customer " + s
+
+# deliveries of a SCENARIOS entry as a DeliveryTable, the same seed always gives the same table. spread
+# overrides the scenario's box size (degrees)
+def make_table(n: int, seed=0, scenario="urban", center=OSLO, spread=None) -> DeliveryTable:
+    spec = SCENARIOS[scenario]
+    rng = np.random.default_rng(seed)
+    spread = spec["spread"] if spread is None else spread
+    if spec["layout"] == "clustered":
+        centers = np.asarray(center) + rng.uniform(-0.5, 0.5, (spec["clusters"], 2)) * [spread / 2, spread]
+        cluster = rng.integers(spec["clusters"], size=n)
+        sigma_lat = spec["cluster_km"] / 111.0
+        sigma_lon = sigma_lat / math.cos(math.radians(center[0]))
+        lat = centers[cluster, 0] + rng.normal(0.0, sigma_lat, n)
+        lon = centers[cluster, 1] + rng.normal(0.0, sigma_lon, n)
+    else:
+        lat = center[0] + rng.uniform(-spread, spread, n) / 2
+        lon = center[1] + rng.uniform(-spread, spread, n)
+    priority = rng.choice(3, size=n, p=spec["priority_mix"])
+    weight_kg = np.round(rng.uniform(0.2, 20.0, n), 1)
+    return DeliveryTable([letter_name(i) for i in range(n)], lat, lon, priority, weight_kg)
+
+# manifest csv of a table, about bad_fraction of the rows get one invalid field
+def write_table_manifest(path, table: DeliveryTable, seed=0, bad_fraction=0.01):
+    rng = random.Random(seed)
+    bad_values = (("customer", "R2D2"), ("latitude", "abc"), ("longitude", "200"), ("priority", "urgent"),
+                  ("weight_kg", "0"))
+    with open(path, "w", newline="") as f:
+        f.write("customer,latitude,longitude,priority,weight_kg\n")
+        for d in table:
+            row = {
+                "customer": d["customer"],
+                "latitude": f"{d['lat']:.6f}",
+                "longitude": f"{d['lon']:.6f}",
+                "priority": d["priority"],
+                "weight_kg": f"{d['weight_kg']:.1f}",
+            }
+            if rng.random() < bad_fraction:
+                key, value = rng.choice(bad_values)
+                row[key] = value
+            f.write(",".join(row.values()) + "\n")
+
+# delivery manifest csv like Locations/deliveries.csv, uniform in the box with an even priority mix ("mixed"
+# scenario), about bad_fraction of the rows fail validation
+def write_manifest(path, n: int, seed=0, bad_fraction=0.01, center=OSLO, spread=0.08):
+    write_table_manifest(path, make_table(n, seed, "mixed", center, spread), seed, bad_fraction)
@@ -1,100 +1,292 @@
 import csv
 import json
+from operator import itemgetter
 from pathlib import Path
 import re
+import numpy as np
+from courier_route_optimization.constants import DELIVERY_CHUNK_ROWS
+from courier_route_optimization.deliveries import DeliveryTable, PRIORITY_CODE
+from courier_route_optimization.instrument import span, count
+from courier_route_optimization.parallel import ordered_map
+from courier_route_optimization.route_result import save_npz
+from courier_route_optimization.windows import parse_clock
 
 '''
 Loads all the deliveries from csv file, checks if all required fields are there and in the correct formats and returns it 
-as a dictionary for use in the optimizer 
+as a DeliveryTable (column arrays that still read like a list of dicts) for use in the optimizer 
 returns list of the valid and invalid deliveries for logging & optimization
 '''
 
 def load_depot(json_path: Path):
     with open(json_path, 'r') as f:
-        data = json.load(f)
-        try:
-            lat = float(data["latitude"])
-            lon = float(data["longitude"])
-            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                raise ValueError("Depot coordinates are out of valid range")
-            return {"name": "Depot", "lat": lat, "lon": lon}
-        except Exception as e:
-            raise ValueError(f"Invalid depot data: {e}")
+        return parse_depot(json.load(f))
+
+# depot dict from the JSON fields ({"latitude", "longitude"}), also used for depots sent to the service
+def parse_depot(data: dict):
+    try:
+        lat = float(data["latitude"])
+        lon = float(data["longitude"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("Depot coordinates are out of valid range")
+        return {"name": "Depot", "lat": lat, "lon": lon}
+    except Exception as e:
+        raise ValueError(f"Invalid depot data: {e}")
   
+NAME_OK = re.compile(r"^[A-Za-zÀ-ÖØ-öø-ÿ'’\-\.\s]+$") # lower/upper( english, latin, scandinavian), apo, dash, dot, space
+REQUIRED_COLUMNS = {"customer", "latitude", "longitude", "priority", "weight_kg"}
+REJECTED_FIELDS = ["row", "cause", "customer", "latitude", "longitude", "priority", "weight_kg"]
+WINDOW_COLUMNS = ("window_start", "window_end")     # optional, HH:MM on the day of the route start
+
+# float() of every value after the same strip and decimal comma fix as before, in one pass over the column
+# while all values parse, else in blocks of 64 with one value at a time only in the blocks that fail.
+# Returns the floats (nan where a value does not parse) and the float() messages (None when all parse)
+def _float_column(values):
+    text = [v.strip().replace(",", ".") for v in values]
+    try:
+        return np.fromiter(map(float, text), dtype=np.float64, count=len(text)), None
+    except ValueError:
+        pass
+    out = np.full(len(text), np.nan)
+    errors = [None] * len(text)
+    for lo in range(0, len(text), 64):
+        block = text[lo:lo + 64]
+        try:
+            out[lo:lo + len(block)] = np.fromiter(map(float, block), dtype=np.float64, count=len(block))
+        except ValueError:
+            for k, v in enumerate(block, lo):
+                try:
+                    out[k] = float(v)
+                except ValueError as e:
+                    errors[k] = str(e)
+    return out, errors
+
+# window hours of a column (empty = missing), messages of the values parse_clock rejects like _float_column
+def _clock_column(values, missing):
+    out = np.full(len(values), missing)
+    errors = None
+    for k, v in enumerate(values):
+        try:
+            hours = parse_clock(v)
+        except ValueError as e:
+            errors = errors or [None] * len(values)
+            errors[k] = str(e)
+            continue
+        if hours is not None:
+            out[k] = hours
+    return out, errors
+
+def _failed(errors, n) -> np.ndarray:
+    return np.zeros(n, dtype=bool) if errors is None else np.array([e is not None for e in errors], dtype=bool)
+
+'''
+Validates a chunk of csv rows (lists, as csv.reader gives them) with the same checks, order and messages as
+the DictReader loop had. The checks run column by column: names and priorities in one comprehension each, the
+numbers in one float() pass per column and the ranges, weights and window order as array comparisons. A row
+is rejected with the message of its first failing check in the old order (name, coordinates, priority,
+weight, window). Returns the valid deliveries as a DeliveryTable and the rejected rows as dicts with "row" =
+position in the chunk, "cause" and the original fields under the same keys csv.DictReader gives. The optional
+window_start/window_end columns are checked when the header has them.
+'''
+def validate_rows(rows, fieldnames):
+    nf = len(fieldnames)
+    n = len(rows)
+    # with repeated header names DictReader keeps the last column
+    column = lambda name: nf - 1 - fieldnames[::-1].index(name)
+    padded = [row if len(row) >= nf else row + [""] * (nf - len(row)) for row in rows]
+    values = lambda name: list(map(itemgetter(column(name)), padded))
+
+    names = [name.strip() for name in values("customer")]
+    name_ok = NAME_OK.match
+    no_name = np.array([not name for name in names], dtype=bool)
+    bad_name = np.array([name_ok(name) is None for name in names], dtype=bool)
+    lat, lat_errors = _float_column(values("latitude"))
+    lon, lon_errors = _float_column(values("longitude"))
+    with np.errstate(invalid="ignore"):
+        out_of_range = ~((-90 <= lat) & (lat <= 90) & (-180 <= lon) & (lon <= 180))
+    codes = [PRIORITY_CODE.get(priority.strip().lower(), -1) for priority in values("priority")]
+    codes = np.array(codes, dtype=np.int8)
+    weight, weight_errors = _float_column(values("weight_kg"))
+    start, start_errors = (_clock_column(values(WINDOW_COLUMNS[0]), -np.inf) if WINDOW_COLUMNS[0] in fieldnames
+                           else (np.full(n, -np.inf), None))
+    end, end_errors = (_clock_column(values(WINDOW_COLUMNS[1]), np.inf) if WINDOW_COLUMNS[1] in fieldnames
+                       else (np.full(n, np.inf), None))
+
+    # (failed, message or per-row messages) in the order the checks ran row by row
+    checks = [
+        (no_name, "No customer name"),
+        (bad_name, "Invalid customer name (contains digits or illegal characters)"),
+        (_failed(lat_errors, n), lat_errors),
+        (_failed(lon_errors, n), lon_errors),
+        (out_of_range, "Coordinates are out of valid range"),
+        (codes < 0, "The priority value is not valid (high/medium/low)"),
+        (_failed(weight_errors, n), weight_errors),
+        (weight <= 0, "The package weight is zero or negative value"),
+        (_failed(start_errors, n), start_errors),
+        (_failed(end_errors, n), end_errors),
+        (end < start, "The delivery window ends before it starts"),
+    ]
+    failed = np.vstack([mask for mask, _ in checks]) if n else np.zeros((len(checks), 0), dtype=bool)
+    bad = failed.any(axis=0)
+    first = failed.argmax(axis=0)
+
+    rejected = []
+    for k in np.flatnonzero(bad).tolist():
+        message = checks[first[k]][1]
+        row = rows[k]
+        original = dict(zip(fieldnames, row))
+        original.update((name, None) for name in fieldnames[len(row):])
+        if len(row) > nf:
+            original[None] = row[nf:]
+        rejected.append({"row": k, "cause": message if isinstance(message, str) else message[k], **original})
+
+    keep = np.flatnonzero(~bad)
+    return DeliveryTable([names[k] for k in keep.tolist()], lat[keep], lon[keep], codes[keep], weight[keep],
+                         start[keep], end[keep]), rejected
+
+# validates one chunk of csv records, also returns the number of records for the row numbering
+def _validate_chunk(rows, fieldnames):
+    with span("validate", rows=len(rows)):
+        return validate_rows(rows, fieldnames) + (len(rows),)
+
+# pool worker side: the raw lines of whole records, split again here
+def _validate_lines(args):
+    lines, fieldnames = args
+    return _validate_chunk([row for row in csv.reader(lines) if row], fieldnames)
+
+'''
+Reads the header record, then yields (lines, rows, fieldnames) for chunks of chunk_size csv records: the raw
+lines of the records (None unless keep_lines) and the records as csv.reader splits them. One csv.reader over
+the whole file decides where a record ends (it only asks for the next line while a quoted field is open), so
+quoted fields with line breaks, "" escapes or stray quotes in unquoted fields are never cut in two. Empty
+lines are skipped without counting, like DictReader does.
+'''
+def iter_record_chunks(f, chunk_size=DELIVERY_CHUNK_ROWS, keep_lines=False):
+    lines = []
+    def read():
+        for line in f:
+            lines.append(line)
+            yield line
+
+    reader = csv.reader(read() if keep_lines else f)
+    fieldnames = next(reader, None) or []
+    missing_columns = REQUIRED_COLUMNS - set(fieldnames)
+    if missing_columns:
+        raise ValueError(f"the required column(s): {missing_columns} is missing")
+
+    del lines[:]
+    rows = []
+    for row in reader:
+        if row:
+            rows.append(row)
+        if len(rows) >= chunk_size:
+            yield (lines[:] if keep_lines else None), rows, fieldnames
+            del lines[:]
+            rows = []
+    if rows:
+        yield (lines[:] if keep_lines else None), rows, fieldnames
+
+# validated chunks in file order with the rejected rows numbered like the file rows (header = row 1).
+# Pool workers get the raw lines, they pickle several times faster than the split rows
+def _validated_chunks(f, chunk_size, pool=None):
+    chunks = iter_record_chunks(f, chunk_size, keep_lines=pool is not None)
+    if pool:
+        results = ordered_map(pool, _validate_lines, ((lines, fieldnames) for lines, _, fieldnames in chunks))
+    else:
+        results = (_validate_chunk(rows, fieldnames) for _, rows, fieldnames in chunks)
+    row_no = 2
+    for deliveries, rejected, n_rows in results:
+        for r in rejected:
+            r["row"] += row_no
+        row_no += n_rows
+        yield deliveries, rejected
+
 def load_deliveries(csv_path: Path):
-    deliveries = []
+    tables = []
     rejected = []
-    NAME_OK = re.compile(r"^[A-Za-zÀ-ÖØ-öø-ÿ'’\-\.\s]+$") # lower/upper( english, latin, scandinavian), apo, dash, dot, space
-    
-    with open(csv_path, 'r', newline='') as f:
-        reader = csv.DictReader(f)
-        contents = {"customer", "latitude", "longitude", "priority", "weight_kg"}
-
-        missing_columns = contents - set(reader.fieldnames or [])
-        if missing_columns:
-            raise ValueError(f"the required column(s): {missing_columns} is missing")
-
-        for i, row in enumerate(reader, start=2):
-            try:
-                name = (row.get("customer") or "").strip()
-                if not name:
-                    raise ValueError("No customer name")
-                if not NAME_OK.match(name):
-                    raise ValueError("Invalid customer name (contains digits or illegal characters)")
-
-                # prevent none, space, range, priority, weight 
-                lat_str = (row.get("latitude") or "").strip().replace(",", ".") 
-                lon_str = (row.get("longitude") or "").strip().replace(",", ".")
-                lat = float(lat_str)
-                lon = float(lon_str)
-                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                    raise ValueError("Coordinates are out of valid range")
-
-                
-                priority = (row.get("priority") or "").strip().lower()
-                if priority not in ("high", "medium", "low"):
-                    raise ValueError("The priority value is not valid (high/medium/low)")
-
-                
-                weight = float((row.get("weight_kg") or "").strip().replace(",", "."))
-                if weight <= 0:
-                    raise ValueError("The package weight is zero or negative value")
-
-                deliveries.append({
-                    "customer": name,
-                    "lat": lat,
-                    "lon": lon,
-                    "priority": priority,
-                    "weight_kg": weight
-                })
-                
-            # This code was modified from AI to unpack key-values 
-            # How can i make the exception properly write out the 
-            except Exception as e:
-                rejected.append({"row": i, "cause": str(e), **row}) 
-    return deliveries, rejected
+    with span("load"), open(csv_path, 'r', newline='') as f:
+        for valid, bad in _validated_chunks(f, DELIVERY_CHUNK_ROWS):
+            tables.append(valid)
+            rejected.extend(bad)
+    return DeliveryTable.concat(tables), rejected
+
+'''
+Streaming version of load_deliveries for very large manifests: the csv is read in chunks of chunk_size rows,
+chunks are validated in order (over a process pool when workers > 1, with at most a few chunks in flight) and
+rejected rows are appended to rejected_path as soon as they are found instead of being kept in memory.
+Same validation rules and row numbers as load_deliveries. Returns the DeliveryTable and the rejected count.
+'''
+def load_deliveries_streaming(csv_path: Path, rejected_path=None, chunk_size=DELIVERY_CHUNK_ROWS, workers=None):
+    tables = []
+    n_rejected = 0
+    out = writer = None
+    pool = None
+    if workers and workers > 1:
+        from concurrent.futures import ProcessPoolExecutor     # not imported for single process runs
+        pool = ProcessPoolExecutor(workers)
+
+    try:
+        with span("load"), open(csv_path, 'r', newline='') as f:
+            for valid, bad in _validated_chunks(f, chunk_size, pool):
+                tables.append(valid)
+                count("deliveries", len(valid))
+                count("rejected", len(bad))
+                n_rejected += len(bad)
+                if bad and rejected_path is not None:
+                    if writer is None:
+                        out = open(rejected_path, 'w', newline='')
+                        writer = csv.DictWriter(out, fieldnames=REJECTED_FIELDS, extrasaction="ignore")
+                        writer.writeheader()
+                    writer.writerows(bad)
+    finally:
+        if out is not None:
+            out.close()
+        if pool is not None:
+            pool.shutdown()
+    return DeliveryTable.concat(tables), n_rejected
 
 # Writes csv with the rejected deliveries 
 def rejected_deliveries(rejected, csv_path: Path):
     if not rejected:
         return
     
-    fields = ["row", "cause", "customer", "latitude", "longitude", "priority", "weight_kg"]
-
     with open(csv_path, 'w', newline='') as f:
-        w = csv.DictWriter(f, fieldnames=fields)
+        w = csv.DictWriter(f, fieldnames=REJECTED_FIELDS, extrasaction="ignore")
         w.writeheader()
         w.writerows(rejected)
         
-# Writes csv of the final route deliveries
-def write_route_csv(rows, out_path: Path):
-    fields = ["customer","latitude","longitude","distance_from_previous",
-              "cumulative_distance","eta_from_start",
-              "time_to_current","cost_to_current","co2_to_current"]
-    with open(out_path, "w", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fields)
+# Writes csv of the final route deliveries (a RouteResult, formatted here)
+ROUTE_FIELDS = ["customer","latitude","longitude","distance_from_previous",
+                "cumulative_distance","eta_from_start",
+                "time_to_current","cost_to_current","co2_to_current"]
+# added by route_builder when the deliveries have time windows, late_minutes > 0 is a violation
+WINDOW_FIELDS = ["window_start", "window_end", "wait_minutes", "late_minutes"]
+
+def route_fields(routes) -> list[str]:
+    return ROUTE_FIELDS + WINDOW_FIELDS if routes and all(r.has_windows for r in routes) else ROUTE_FIELDS
+
+def write_route_csv(route, out_path: Path):
+    with span("write", rows=len(route)), open(out_path, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=route_fields([route]), extrasaction="ignore")
         w.writeheader()
-        w.writerows(rows)
+        w.writerows(route.format_rows())
+
+# Writes the routes of all vehicles from fleet.plan_fleet to one csv, each row starts with its vehicle number
+def write_fleet_csv(fleet, out_path: Path):
+    with span("write", routes=len(fleet)), open(out_path, "w", newline="") as f:
+        fields = route_fields([route["rows"] for route in fleet])
+        w = csv.DictWriter(f, fieldnames=["vehicle"] + fields, extrasaction="ignore")
+        w.writeheader()
+        for route in fleet:
+            w.writerows({"vehicle": route["vehicle"], **row} for row in route["rows"].format_rows())
+
+# Typed columns of the route (or of all fleet routes, with a route column holding the vehicle number) as .npz
+def write_route_npz(route, out_path: Path):
+    with span("write_npz", rows=len(route)):
+        route.to_npz(out_path)
+
+def write_fleet_npz(fleet, out_path: Path):
+    with span("write_npz", routes=len(fleet)):
+        save_npz(out_path, [route["rows"] for route in fleet], [route["vehicle"] for route in fleet])
 
 
 #depot = load_depot(Path("Locations/depot.json"))
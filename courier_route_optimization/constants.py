@@ -19,9 +19,9 @@ class Mode(StrEnum):
     WALK = "walk"
 
 MODE_PARAMS = {
-    Mode.CAR: {"speed": 50, "cost": 4, "co2": 120},    #km/h, NOK/km, g/km
-    Mode.BICYCLE: {"speed": 15, "cost": 0, "co2": 0},
-    Mode.WALK: {"speed": 5, "cost": 0, "co2": 0},
+    Mode.CAR: {"speed": 50, "cost": 4, "co2": 120, "capacity": 500},    #km/h, NOK/km, g/km, payload kg per vehicle
+    Mode.BICYCLE: {"speed": 15, "cost": 0, "co2": 0, "capacity": 50},
+    Mode.WALK: {"speed": 5, "cost": 0, "co2": 0, "capacity": 20},
 }
 
 URGENCY_MULT = {
@@ -29,9 +29,65 @@ URGENCY_MULT = {
     "medium": 1.0,   #Change?
     "low": 1.2
 }
+PRIORITIES = ("high", "medium", "low")    # priority codes of DeliveryTable index this tuple
 
 EARTH_RADIUS_KM = 6371.0
 
+# distance matrix storage: dense float64 below MATRIX_FLOAT32_STOPS locations, dense float32 below
+# MATRIX_LAZY_STOPS, above that rows are computed on demand and kept in a cache of MATRIX_ROW_CACHE_BYTES
+MATRIX_FLOAT32_STOPS = 4000
+MATRIX_LAZY_STOPS = 20000
+MATRIX_BLOCK_ROWS = 256
+MATRIX_ROW_CACHE_BYTES = 256 * 2**20
+
+# distance="auto" uses planar distances when their worst-case relative error against haversine over the
+# manifest's bounding box stays within this (0.005 = 0.5%, about +-18 km north-south around Oslo)
+PLANAR_MAX_ERROR = 0.005
+
+# road network contraction: witness searches settle at most this many nodes before a shortcut is kept anyway
+ROAD_WITNESS_SETTLED = 500
+
+# spatial index for the greedy orders: used from SPATIAL_INDEX_MIN_STOPS deliveries, points per tree leaf and
+# the first number of nearest candidates checked per step (grown when the best key can not be proven)
+SPATIAL_INDEX_MIN_STOPS = 10000
+SPATIAL_LEAF_SIZE = 16
+SPATIAL_CANDIDATES = 16
+
+# 2-opt / Or-opt moves are only tried towards this many nearest stops
+LOCAL_SEARCH_NEIGHBOURS = 10
+
+# exact route orders (Held-Karp, exact.py) for manifests of up to EXACT_MAX_STOPS deliveries, the greedy is used
+# instead when its table would take more than EXACT_MAX_BYTES
+EXACT_MAX_STOPS = 15
+EXACT_MAX_BYTES = 256 * 2**20
+
+# batched route evaluation works on chunks of about this many legs at a time
+BATCH_CELLS = 2**20
+
+# manifest rows read and validated per chunk by the streaming loader
+DELIVERY_CHUNK_ROWS = 10000
+
+# fleet splitting: savings are only computed between each stop and this many nearest stops
+SAVINGS_NEIGHBOURS = 20
+
+# optimization service: jobs queued or running in the executor before new ones get 503, optimizers kept warm,
+# live routes kept (the least recently used one is dropped beyond this)
+SERVE_MAX_PENDING = 64
+SERVE_CACHE_SIZE = 16
+SERVE_MAX_ROUTES = 1024
+
+# persistent distance cache: slots per tile side, locations kept and days an unused location is kept
+DISTANCE_CACHE_BLOCK = 256
+DISTANCE_CACHE_MAX_LOCATIONS = 50000
+DISTANCE_CACHE_MAX_AGE_DAYS = 180
+
+# headless route maps: half height of the smallest map region around the depot (grown until the route fits),
+# map width in inches and raster resolution, stops are numbered on maps of up to MAP_MAX_LABELS stops
+MAP_REGION_KM = 2.5
+MAP_WIDTH_IN = 8
+MAP_DPI = 100
+MAP_MAX_LABELS = 100
+
 #ex use:
 #print(Mode.CAR)                 # Mode.CAR
 #print(Mode.CAR == "car")        # True
@@ -0,0 +1,103 @@
+import sys
+import numpy as np
+from courier_route_optimization.constants import PRIORITIES, URGENCY_MULT
+
+'''
+Column storage for the deliveries: float64 lat/lon/weight arrays, int8 priority codes (index into PRIORITIES)
+and a list of interned customer names, instead of one dict per delivery. Optional delivery windows are hours
+since midnight of the route start day (windows.py), -inf / +inf where a delivery has none.
+The table still reads like the old list of dicts (len, table[k]["lat"], for d in table) so code written for
+load_deliveries' previous output keeps working, while the optimizer reads the arrays directly.
+'''
+
+PRIORITY_CODE = {name: code for code, name in enumerate(PRIORITIES)}
+URGENCY_BY_CODE = np.array([URGENCY_MULT[name] for name in PRIORITIES], dtype=np.float64)
+
+
+class DeliveryTable:
+    def __init__(self, customer, lat, lon, priority, weight_kg, window_start=None, window_end=None):
+        self.customer = [sys.intern(name) for name in customer]
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.priority = np.asarray(priority, dtype=np.int8)    # codes, PRIORITIES[code] is the name
+        self.weight_kg = np.asarray(weight_kg, dtype=np.float64)
+        n = len(self.customer)
+        self.window_start = np.full(n, -np.inf) if window_start is None else np.asarray(window_start, dtype=np.float64)
+        self.window_end = np.full(n, np.inf) if window_end is None else np.asarray(window_end, dtype=np.float64)
+        if not (len(self.lat) == len(self.lon) == len(self.priority) == len(self.weight_kg)
+                == len(self.window_start) == len(self.window_end) == n):
+            raise ValueError("DeliveryTable columns must have the same length")
+        if n and not (0 <= self.priority.min() and self.priority.max() < len(PRIORITIES)):
+            raise ValueError("Invalid priority code in DeliveryTable")
+
+    # from the dict format ({"customer", "lat", "lon", "priority", "weight_kg"} per delivery, optional
+    # "window_start"/"window_end" in hours)
+    @classmethod
+    def from_dicts(cls, deliveries):
+        try:
+            priority = [PRIORITY_CODE[d["priority"]] for d in deliveries]
+        except KeyError as e:
+            raise ValueError(f"The priority value is not valid (high/medium/low): {e}")
+        window_start = [d.get("window_start") for d in deliveries]
+        window_end = [d.get("window_end") for d in deliveries]
+        return cls([d["customer"] for d in deliveries],
+                   [d["lat"] for d in deliveries],
+                   [d["lon"] for d in deliveries],
+                   priority,
+                   [d["weight_kg"] for d in deliveries],
+                   [-np.inf if w is None else w for w in window_start],
+                   [np.inf if w is None else w for w in window_end])
+
+    @classmethod
+    def concat(cls, tables):
+        tables = list(tables)
+        if not tables:
+            return cls([], [], [], [], [])
+        return cls([name for t in tables for name in t.customer],
+                   np.concatenate([t.lat for t in tables]),
+                   np.concatenate([t.lon for t in tables]),
+                   np.concatenate([t.priority for t in tables]),
+                   np.concatenate([t.weight_kg for t in tables]),
+                   np.concatenate([t.window_start for t in tables]),
+                   np.concatenate([t.window_end for t in tables]))
+
+    def __len__(self):
+        return len(self.customer)
+
+    # one delivery in the dict format
+    def __getitem__(self, k: int) -> dict:
+        return {
+            "customer": self.customer[k],
+            "lat": float(self.lat[k]),
+            "lon": float(self.lon[k]),
+            "priority": PRIORITIES[self.priority[k]],
+            "weight_kg": float(self.weight_kg[k])
+        }
+
+    def __iter__(self):
+        for name, lat, lon, code, weight in zip(self.customer, self.lat.tolist(), self.lon.tolist(),
+                                                self.priority.tolist(), self.weight_kg.tolist()):
+            yield {"customer": name, "lat": lat, "lon": lon, "priority": PRIORITIES[code], "weight_kg": weight}
+
+    def to_dicts(self) -> list[dict]:
+        return list(self)
+
+    # sub-table of the deliveries at idx, in that order
+    def take(self, idx):
+        idx = np.asarray(idx, dtype=np.intp)
+        return DeliveryTable([self.customer[k] for k in idx.tolist()], self.lat[idx], self.lon[idx],
+                             self.priority[idx], self.weight_kg[idx], self.window_start[idx], self.window_end[idx])
+
+    # URGENCY_MULT of every delivery
+    def urgency(self) -> np.ndarray:
+        return URGENCY_BY_CODE[self.priority]
+
+    def has_windows(self) -> bool:
+        return bool(np.isfinite(self.window_start).any() or np.isfinite(self.window_end).any())
+
+
+# the optimizer's adapter: tables pass through, lists of dicts are converted once
+def as_table(deliveries) -> DeliveryTable:
+    if isinstance(deliveries, DeliveryTable):
+        return deliveries
+    return DeliveryTable.from_dicts(deliveries)
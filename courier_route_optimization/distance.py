@@ -0,0 +1,187 @@
+from collections import OrderedDict
+import math
+import threading
+import numpy as np
+from courier_route_optimization.constants import (MATRIX_FLOAT32_STOPS, MATRIX_LAZY_STOPS, MATRIX_BLOCK_ROWS,
+                                                  MATRIX_ROW_CACHE_BYTES, EARTH_RADIUS_KM)
+from courier_route_optimization.instrument import count
+from courier_route_optimization.utils import haversine_np
+
+'''
+Pairwise distance matrices (km) over a list of locations, used by RouteOptimizer with index 0 = depot and
+index k+1 = delivery k. Both classes share the same small read interface so the optimizer does not care how
+the distances are stored:
+    row(i)        -> distances from location i to every location (numpy array)
+    take(i, idx)  -> distances from location i to the locations in idx
+    pair(i, j)    -> single distance as float
+    gather(a, b)  -> distances for the index arrays a[k] -> b[k]
+Distances are haversine, or planar when a PlanarProjection is given (see below).
+'''
+
+DISTANCE_BACKENDS = ("haversine", "planar", "auto")
+
+'''
+Equirectangular projection for city-scale manifests: every location gets local planar coordinates in km,
+    x = R * cos(lat0) * (lon - lon0),   y = R * (lat - lat0)      (radians, lat0/lon0 = bounding-box centre)
+and a distance is a plain Euclidean distance, no trigonometry per pair.
+Error bound relative to haversine, for every pair inside the bounding box [lat_min, lat_max] x [lon_min, lon_max]:
+    |planar / haversine - 1| <= max over lat in the box of |cos(lat0) / cos(lat) - 1| + (D / (R * cos(lat_far)))^2
+The first term is the east-west scale error away from lat0 (it is reached at the north or south edge), the
+second covers the curvature the flat approximation ignores, D is the diagonal of the box in km and lat_far the
+box latitude furthest from the equator: an east-west leg follows its parallel while the great circle bends
+towards the pole, by a relative amount that grows with tan(lat)^2 (without the cos(lat_far) the bound is
+exceeded above about 75 degrees). Around Oslo (lat 59.9) the first term is about 0.3% per 0.1 degrees (11 km)
+of latitude from the centre and the second term stays below 0.03% for a 50 km area. error_bound is infinite
+for boxes that wrap around the date line or come within a degree of a pole.
+'''
+class PlanarProjection:
+    def __init__(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.lat0 = float(lat.min() + lat.max()) / 2
+        self.lon0 = float(lon.min() + lon.max()) / 2
+        self.k = math.cos(math.radians(self.lat0))
+        self.error_bound = planar_error_bound(float(lat.min()), float(lat.max()), float(lon.min()), float(lon.max()))
+
+    # (n, 2) planar coordinates in km east and north of the box centre
+    def xy(self, lat, lon) -> np.ndarray:
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        return np.column_stack((EARTH_RADIUS_KM * self.k * np.radians(lon - self.lon0),
+                                EARTH_RADIUS_KM * np.radians(lat - self.lat0)))
+
+    # drop-in for utils.haversine_np with the projected distance
+    def distance_np(self, lat1, lon1, lat2, lon2):
+        return EARTH_RADIUS_KM * np.hypot(np.radians(np.subtract(lat2, lat1)),
+                                          self.k * np.radians(np.subtract(lon2, lon1)))
+
+
+# worst-case relative error of PlanarProjection over a bounding box in degrees, see above
+def planar_error_bound(lat_min, lat_max, lon_min, lon_max) -> float:
+    if lon_max - lon_min >= 180 or max(abs(lat_min), abs(lat_max)) >= 89:
+        return math.inf
+    lat0 = math.radians((lat_min + lat_max) / 2)
+    edges = [math.radians(lat_min), math.radians(lat_max)] + ([0.0] if lat_min < 0 < lat_max else [])
+    scale = max(abs(math.cos(lat0) / math.cos(lat) - 1) for lat in edges)
+    # widest east-west extent is at the latitude closest to the equator
+    cos_wide = 1.0 if lat_min < 0 < lat_max else math.cos(math.radians(min(abs(lat_min), abs(lat_max))))
+    diagonal = math.hypot(math.radians(lat_max - lat_min), cos_wide * math.radians(lon_max - lon_min))
+    cos_far = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    return scale + (diagonal / cos_far) ** 2
+
+
+# Full matrix kept in memory, computed in one vectorized pass
+class DistanceMatrix:
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.dtype = data.dtype
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def row(self, i: int) -> np.ndarray:
+        return self.data[i]
+
+    def take(self, i: int, idx) -> np.ndarray:
+        return self.data[i, idx]
+
+    def pair(self, i: int, j: int) -> float:
+        return float(self.data[i, j])
+
+    def gather(self, a, b) -> np.ndarray:
+        return self.data[a, b]
+
+
+# Matrix for very large inputs: a row is computed when it is asked for and kept in a least-recently-used cache
+# bounded by cache_bytes, so memory stays fixed no matter how many locations there are
+class LazyDistanceMatrix:
+    def __init__(self, lat: np.ndarray, lon: np.ndarray, dtype=np.float32, cache_bytes=MATRIX_ROW_CACHE_BYTES,
+                 projection=None):
+        self.lat = lat
+        self.lon = lon
+        self.xy = None if projection is None else projection.xy(lat, lon)
+        self.dtype = np.dtype(dtype)
+        self.max_rows = max(1, cache_bytes // (len(lat) * self.dtype.itemsize))
+        self._rows = OrderedDict()
+        # the server shares one optimizer between its worker threads, the LRU is only touched under this lock
+        self._rows_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.lat)
+
+    def row(self, i: int) -> np.ndarray:
+        with self._rows_lock:
+            row = self._rows.get(i)
+            if row is not None:
+                self._rows.move_to_end(i)
+                return row
+
+        row = self._distances(i, slice(None))
+        with self._rows_lock:
+            self._rows[i] = row
+            while len(self._rows) > self.max_rows:
+                self._rows.popitem(last=False)
+        return row
+
+    # only the asked columns are computed when the row is not cached, greedy walks never come back to a row
+    def take(self, i: int, idx) -> np.ndarray:
+        with self._rows_lock:
+            row = self._rows.get(i)
+        if row is not None:
+            return row[idx]
+        return self._distances(i, idx)
+
+    def pair(self, i: int, j: int) -> float:
+        return float(self.gather(np.array([i]), np.array([j]))[0])
+
+    def gather(self, a, b) -> np.ndarray:
+        return self._distances(np.asarray(a), np.asarray(b))
+
+    # distances a -> b for matrix indices (an index and an index array, or two index arrays)
+    def _distances(self, a, b) -> np.ndarray:
+        if self.xy is None:
+            d = haversine_np(self.lat[a], self.lon[a], self.lat[b], self.lon[b])
+            count("haversine", d.size)
+        else:
+            diff = self.xy[b] - self.xy[a]
+            d = np.hypot(diff[..., 0], diff[..., 1])
+            count("planar", d.size)
+        return d.astype(self.dtype)
+
+
+# Picks the storage from the number of locations: float64 for normal manifests, float32 to halve memory on
+# large ones and lazy rows when a full matrix would not fit. Planar distances with a PlanarProjection
+def build_distance_matrix(lat, lon, float32_stops=MATRIX_FLOAT32_STOPS, lazy_stops=MATRIX_LAZY_STOPS,
+                          projection=None):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+
+    if n >= lazy_stops:
+        return LazyDistanceMatrix(lat, lon, projection=projection)
+
+    dtype = np.float32 if n >= float32_stops else np.float64
+    data = np.empty((n, n), dtype=dtype)
+    # fill in row blocks so the float64 temporaries stay small when storing float32
+    step = MATRIX_BLOCK_ROWS if dtype == np.float32 else max(n, 1)
+    if projection is not None:
+        # squared differences summed in place in the storage dtype, no temporaries beyond one row block
+        x, y = projection.xy(lat, lon).astype(dtype).T
+        tmp = np.empty((min(MATRIX_BLOCK_ROWS, n), n), dtype=dtype)
+        for lo in range(0, n, MATRIX_BLOCK_ROWS):
+            hi = min(lo + MATRIX_BLOCK_ROWS, n)
+            out, t = data[lo:hi], tmp[:hi - lo]
+            np.subtract(x[lo:hi, None], x[None, :], out=out)
+            out *= out
+            np.subtract(y[lo:hi, None], y[None, :], out=t)
+            t *= t
+            out += t
+            np.sqrt(out, out=out)
+        count("planar", n * n)
+        return DistanceMatrix(data)
+
+    for lo in range(0, n, step):
+        hi = min(lo + step, n)
+        data[lo:hi] = haversine_np(lat[lo:hi, None], lon[lo:hi, None], lat[None, :], lon[None, :])
+    count("haversine", n * n)
+    return DistanceMatrix(data)
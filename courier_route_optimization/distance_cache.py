@@ -0,0 +1,317 @@
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from courier_route_optimization.constants import (MATRIX_FLOAT32_STOPS, MATRIX_LAZY_STOPS, DISTANCE_CACHE_BLOCK,
+                                                  DISTANCE_CACHE_MAX_LOCATIONS, DISTANCE_CACHE_MAX_AGE_DAYS)
+from courier_route_optimization.distance import DistanceMatrix, LazyDistanceMatrix
+from courier_route_optimization.instrument import count
+from courier_route_optimization.utils import haversine_np
+
+try:
+    import fcntl                    # one writer at a time per cache directory, not available on Windows
+except ImportError:
+    fcntl = None
+
+'''
+Persistent distance cache shared by runs, for customer bases where most addresses come back every day.
+Every location gets a stable slot from its coordinates rounded to 1e-6 degrees (about 0.1 m). Distances
+between slots are stored as float32 tiles of DISTANCE_CACHE_BLOCK x DISTANCE_CACHE_BLOCK slots in a
+memory-mapped file (tiles.bin), only tiles with block i <= block j are kept (the matrix is symmetric):
+    index.npz   slot coordinates, key and last day used, tile table (tile number in tiles.bin or -1, valid flag)
+    tiles.bin   the tiles, a tile is computed the first time a run needs one of its distances
+A run only reads the tiles of its own locations through the memory map, nothing is deserialized up front.
+New locations take the next free slots; the tiles of a block that gets new slots are recomputed in place when
+next needed. Locations unused for max_age_days, or the least recently used ones above max_locations, are
+evicted by compact(), which rewrites both files (run automatically by close() when the cache is too large).
+Runs sharing the directory only hold its lock file while they change it: matrix() and close() take the lock,
+reload the index when another run replaced it since, update the tiles and write the index back.
+matrix(lat, lon) gives the optimizer a dense DistanceMatrix filled from the tiles (float64 below
+MATRIX_FLOAT32_STOPS like build_distance_matrix, the values have float32 precision). From MATRIX_LAZY_STOPS
+locations it returns the usual LazyDistanceMatrix and leaves the cache alone: the indexed greedy then only
+computes distances to a few candidates per step, while filling the cache would cost the whole matrix.
+'''
+
+SCALE = 1e6
+
+
+def coordinate_keys(lat, lon) -> np.ndarray:
+    lat_q = np.rint((np.asarray(lat, dtype=np.float64) + 90.0) * SCALE).astype(np.int64)
+    lon_q = np.rint((np.asarray(lon, dtype=np.float64) + 180.0) * SCALE).astype(np.int64)
+    return lat_q * np.int64(360 * SCALE + 1) + lon_q
+
+
+def _today() -> int:
+    return int(time.time() // 86400)
+
+
+class DistanceCache:
+    def __init__(self, path, max_locations=DISTANCE_CACHE_MAX_LOCATIONS, max_age_days=DISTANCE_CACHE_MAX_AGE_DAYS,
+                 block=DISTANCE_CACHE_BLOCK):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_locations = max_locations
+        self.max_age_days = max_age_days
+        self.closed = False
+        with self.locked():
+            self._load(block)
+
+    def _load(self, block):
+        index = self.path / "index.npz"
+        if index.exists():
+            with np.load(index) as meta:
+                self.block = int(meta["block"])
+                self.keys = meta["keys"]
+                self.lat, self.lon = meta["lat"], meta["lon"]
+                self.last_used = meta["last_used"]
+                self.tile_no, self.tile_ok = meta["tile_no"], meta["tile_ok"]
+                self.n_tiles = int(meta["n_tiles"])
+        else:
+            self.block = block
+            self.keys = np.empty(0, dtype=np.int64)
+            self.lat = self.lon = np.empty(0)
+            self.last_used = np.empty(0, dtype=np.int32)
+            self.tile_no = np.full((0, 0), -1, dtype=np.int32)
+            self.tile_ok = np.zeros((0, 0), dtype=bool)
+            self.n_tiles = 0
+        self._slot_of = dict(zip(self.keys.tolist(), range(len(self.keys))))
+        self._open_tiles(max(self.n_tiles, 1))
+        self._stamp = self._index_stamp()
+        self._dirty = False
+
+    # identifies the index file on disk, it changes whenever a run writes a new one (os.replace)
+    def _index_stamp(self):
+        try:
+            st = os.stat(self.path / "index.npz")
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    # holds the directory lock, with the index reloaded first when another run wrote one since ours was read.
+    # Changes not written back by then are dropped: slots and tiles would clash with the other run's
+    @contextmanager
+    def locked(self):
+        with open(self.path / "lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            if hasattr(self, "_stamp") and self._index_stamp() != self._stamp:
+                self._load(self.block)
+            yield self
+
+    def _open_tiles(self, capacity):
+        data = self.path / "tiles.bin"
+        tile_bytes = self.block * self.block * 4
+        with open(data, "ab") as f:
+            if f.tell() < capacity * tile_bytes:
+                f.truncate(capacity * tile_bytes)   # sparse on most file systems
+        self.capacity = os.path.getsize(data) // tile_bytes
+        self._tiles = np.memmap(data, dtype=np.float32, mode="r+", shape=(self.capacity, self.block, self.block))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # slot of every location, unknown locations are added; all of them are marked as used today
+    def slots(self, lat, lon) -> np.ndarray:
+        keys = coordinate_keys(lat, lon)
+        slot_of = self._slot_of
+        slots = np.fromiter((slot_of.get(k, -1) for k in keys.tolist()), dtype=np.int64, count=len(keys))
+
+        new = np.flatnonzero(slots < 0)
+        if len(new):
+            # slots in order of first appearance, so a repeated manifest reads whole tile ranges
+            new_keys, first = np.unique(keys[new], return_index=True)
+            by_first = np.argsort(first)
+            new_keys, first = new_keys[by_first], new[first[by_first]]
+            start = len(self.keys)
+            self.keys = np.concatenate((self.keys, new_keys))
+            self.lat = np.concatenate((self.lat, np.asarray(lat, dtype=np.float64)[first]))
+            self.lon = np.concatenate((self.lon, np.asarray(lon, dtype=np.float64)[first]))
+            self.last_used = np.concatenate((self.last_used, np.zeros(len(new_keys), dtype=np.int32)))
+            self._dirty = True
+            for k, key in enumerate(new_keys.tolist(), start=start):
+                slot_of[key] = k
+            slots[new] = [slot_of[k] for k in keys[new].tolist()]
+            self._added(start, len(self.keys))
+
+        today = _today()
+        if len(slots) and (self.last_used[slots] != today).any():
+            self.last_used[slots] = today
+            self._dirty = True
+        return slots
+
+    # grows the tile table and invalidates the tiles of blocks that got slots start..end-1
+    def _added(self, start, end):
+        B = self.block
+        nb = -(-end // B)
+        if nb > len(self.tile_no):
+            size = max(nb, 2 * len(self.tile_no))
+            tile_no = np.full((size, size), -1, dtype=np.int32)
+            tile_ok = np.zeros((size, size), dtype=bool)
+            old = len(self.tile_no)
+            tile_no[:old, :old] = self.tile_no
+            tile_ok[:old, :old] = self.tile_ok
+            self.tile_no, self.tile_ok = tile_no, tile_ok
+        for b in range(start // B, nb):
+            self.tile_ok[b, :] = False
+            self.tile_ok[:, b] = False
+
+    # computes the missing or stale tiles among the (bi <= bj) block pairs
+    def _ensure(self, bi, bj):
+        need = ~self.tile_ok[bi, bj]
+        if not need.any():
+            return
+        B = self.block
+        for i, j in set(zip(bi[need].tolist(), bj[need].tolist())):
+            no = int(self.tile_no[i, j])
+            if no < 0:
+                no = self.n_tiles
+                if no >= self.capacity:
+                    self._tiles.flush()
+                    self._open_tiles(2 * self.capacity)
+                self.n_tiles += 1
+                self.tile_no[i, j] = no
+            lat_i, lon_i = self.lat[i * B:(i + 1) * B], self.lon[i * B:(i + 1) * B]
+            lat_j, lon_j = self.lat[j * B:(j + 1) * B], self.lon[j * B:(j + 1) * B]
+            self._tiles[no, :len(lat_i), :len(lat_j)] = haversine_np(lat_i[:, None], lon_i[:, None],
+                                                                     lat_j[None, :], lon_j[None, :])
+            self.tile_ok[i, j] = True
+            self._dirty = True
+            count("cache_tiles")
+            count("haversine", len(lat_i) * len(lat_j))
+
+    # distances of the slot pairs a[k] -> b[k], read element-wise from the tiles
+    def read(self, a, b) -> np.ndarray:
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        a, b = np.broadcast_arrays(a, b)
+        B = self.block
+        ba, bb = a // B, b // B
+        lo, hi = np.minimum(ba, bb), np.maximum(ba, bb)
+        # the tile of blocks (lo, hi) has the lo block's slots as rows, a tile within one block is a full square
+        swap = ba > bb
+        r = np.where(swap, b, a) % B
+        c = np.where(swap, a, b) % B
+        self._ensure(lo.ravel(), hi.ravel())
+        return self._tiles[self.tile_no[lo, hi], r, c]
+
+    # (len(a), len(b)) distance block. Built one strip of rows (a's slots in one block) at a time with b sorted
+    # by slot, so every tile is copied into one contiguous column range; runs of consecutive slots are copied as
+    # slices
+    def block_of(self, a, b) -> np.ndarray:
+        a = np.asarray(a, dtype=np.int64)
+        b = np.asarray(b, dtype=np.int64)
+        B = self.block
+        out = np.empty((len(a), len(b)), dtype=np.float32)
+        order_b = np.argsort(b, kind="stable")
+        b_sorted = b[order_b]
+        ranges_b = _block_ranges(b_sorted, B)
+        restore = None if (order_b[1:] > order_b[:-1]).all() else np.argsort(order_b)
+
+        order_a = np.argsort(a, kind="stable")
+        a_sorted = a[order_a]
+        for i, r0, r1 in _block_ranges(a_sorted, B):
+            rows = _tile_index(a_sorted[r0:r1], B)
+            self._ensure(np.minimum(i, ranges_b[:, 0]), np.maximum(i, ranges_b[:, 0]))
+            strip = np.empty((r1 - r0, len(b)), dtype=np.float32)
+            for j, c0, c1 in ranges_b.tolist():
+                cols = _tile_index(b_sorted[c0:c1], B)
+                if i <= j:
+                    tile = self._tiles[self.tile_no[i, j]]
+                    strip[:, c0:c1] = tile[rows][:, cols]
+                else:
+                    tile = self._tiles[self.tile_no[j, i]]
+                    strip[:, c0:c1] = tile[cols][:, rows].T
+            out[order_a[r0:r1]] = strip if restore is None else strip[:, restore]
+        return out
+
+    # distance matrix over the locations for RouteOptimizer, see the module notes
+    def matrix(self, lat, lon):
+        if len(lat) >= MATRIX_LAZY_STOPS:
+            return LazyDistanceMatrix(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64))
+        with self.locked():
+            slots = self.slots(lat, lon)
+            data = self.block_of(slots, slots)
+            if self._dirty:
+                self.flush()
+        if len(slots) < MATRIX_FLOAT32_STOPS:
+            data = data.astype(np.float64)
+        return DistanceMatrix(data)
+
+    '''
+    Evicts the locations not used for max_age_days and, above max_locations, the least recently used ones.
+    The kept locations are renumbered in their old order and both files are rewritten, tiles are copied from
+    the old ones (computed first where they are missing).
+    '''
+    def compact(self):
+        keep = self.last_used >= _today() - self.max_age_days
+        if keep.sum() > self.max_locations:
+            recent = np.argsort(-self.last_used, kind="stable")[:self.max_locations]
+            keep = np.zeros(len(self.keys), dtype=bool)
+            keep[recent] = True
+        old = np.flatnonzero(keep)
+
+        B = self.block
+        nb = -(-len(old) // B)
+        pairs = [(i, j) for i in range(nb) for j in range(i, nb)]
+        tmp = self.path / "tiles.tmp"
+        tiles = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(max(len(pairs), 1), B, B))
+        tile_no = np.full((nb, nb), -1, dtype=np.int32)
+        for no, (i, j) in enumerate(pairs):
+            rows, cols = old[i * B:(i + 1) * B], old[j * B:(j + 1) * B]
+            tiles[no, :len(rows), :len(cols)] = self.block_of(rows, cols)
+            tile_no[i, j] = no
+        tiles.flush()
+        del tiles
+
+        self._tiles.flush()
+        del self._tiles
+        os.replace(tmp, self.path / "tiles.bin")
+        self.keys, self.lat, self.lon = self.keys[old], self.lat[old], self.lon[old]
+        self.last_used = self.last_used[old]
+        self.tile_no, self.tile_ok = tile_no, tile_no >= 0
+        self.n_tiles = len(pairs)
+        self._slot_of = dict(zip(self.keys.tolist(), range(len(self.keys))))
+        self._open_tiles(max(self.n_tiles, 1))
+        self.flush()
+
+    # tiles first, then the index that points at them (written to a temp file and renamed)
+    def flush(self):
+        self._tiles.flush()
+        tmp = self.path / "index.tmp.npz"
+        np.savez(tmp, block=self.block, keys=self.keys, lat=self.lat, lon=self.lon, last_used=self.last_used,
+                 tile_no=self.tile_no, tile_ok=self.tile_ok, n_tiles=self.n_tiles)
+        os.replace(tmp, self.path / "index.npz")
+        self._stamp = self._index_stamp()
+        self._dirty = False
+
+    def close(self):
+        if self.closed:
+            return
+        with self.locked():
+            if len(self.keys) > self.max_locations:
+                self.compact()
+            elif self._dirty:
+                self.flush()
+        del self._tiles
+        self.closed = True
+
+
+# (block, start, end) rows for the runs of sorted slots that fall in the same block
+def _block_ranges(sorted_slots, B) -> np.ndarray:
+    blocks, starts = np.unique(sorted_slots // B, return_index=True)
+    return np.column_stack((blocks, starts, np.append(starts[1:], len(sorted_slots)))).astype(np.int64)
+
+
+# rows / columns of a run of sorted slots in their tile: a slice when the slots are consecutive, else the
+# offsets (repeated slots, i.e. stops at the same address, and gaps both need the fancy index)
+def _tile_index(run, B):
+    if (np.diff(run) == 1).all():
+        return slice(int(run[0] % B), int(run[-1] % B) + 1)
+    return run % B
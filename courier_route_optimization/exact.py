@@ -0,0 +1,64 @@
+import numpy as np
+
+'''
+Exact route order for small manifests: bitmask Held-Karp dynamic programming over the depot (index 0) and n
+stops (index 1..n). With leg a -> b costing W[a, b] * c[b] (the arrival weights of RouteOptimizer, so time with
+priority weighting, cost, co2 or the multi-objective mix, same totals as route_totals):
+    best[S, j] = cheapest path depot -> all stops in S, ending at j in S
+    best[S, j] = min over i in S - {j} of best[S - {j}, i] + W[i, j] * c[j]
+The subsets are processed one size at a time and every step is a numpy operation over all subsets of that size
+with stop j, so the work is about 2^n * n^2 / 2 array operations and the table 2^n * n values.
+held_karp_bytes gives the peak memory (table, predecessors and the temporary of one step), held_karp returns None
+instead of allocating more than max_bytes so the caller can fall back to the heuristic.
+'''
+
+def held_karp_bytes(n: int) -> int:
+    # float64 table + int8 predecessors + float64 candidates of the largest step, per subset its mask and size
+    return (1 << n) * (n * (8 + 1 + 8) + 8 + 1)
+
+
+# visiting order of the stops (0-based, stop k is matrix index k + 1) minimizing the weighted tour, or None when
+# the table would not fit in max_bytes. W is the dense (n + 1) x (n + 1) distance matrix, c the arrival weights
+def held_karp(W, c, max_bytes):
+    n = len(W) - 1
+    if n <= 2:
+        return list(range(n)) if n < 2 else _best_of_two(W, c)
+    if n > 63 or held_karp_bytes(n) > max_bytes:
+        return None
+
+    cost = np.asarray(W, dtype=np.float64) * np.asarray(c, dtype=np.float64)[None, :]
+    legs = cost[1:, 1:]                         # stop i -> stop j
+    full = (1 << n) - 1
+
+    best = np.full((full + 1, n), np.inf)
+    pred = np.full((full + 1, n), -1, dtype=np.int8)
+    bits = 1 << np.arange(n)
+    best[bits, np.arange(n)] = cost[0, 1:]
+
+    # subsets grouped by their number of stops
+    masks = np.arange(full + 1)
+    size = np.zeros(full + 1, dtype=np.int8)
+    for b in range(n):
+        size += (masks >> b) & 1
+
+    for k in range(2, n + 1):
+        layer = masks[size == k]
+        for j in range(n):
+            S = layer[(layer >> j) & 1 == 1]
+            cand = best[S ^ (1 << j)] + legs[:, j]      # best[S - {j}, i] is inf for i not in S - {j}
+            i = np.argmin(cand, axis=1)
+            best[S, j] = cand[np.arange(len(S)), i]
+            pred[S, j] = i
+
+    # back to the depot, then follow the predecessors
+    j = int(np.argmin(best[full] + cost[1:, 0]))
+    order, S = [], full
+    while j >= 0:
+        order.append(j)
+        S, j = S ^ (1 << j), int(pred[S, j])
+    return order[::-1]
+
+
+def _best_of_two(W, c):
+    tour = lambda a, b: W[0][a] * c[a] + W[a][b] * c[b] + W[b][0] * c[0]
+    return [0, 1] if tour(1, 2) <= tour(2, 1) else [1, 0]
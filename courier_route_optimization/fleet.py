@@ -0,0 +1,186 @@
+import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+from courier_route_optimization.constants import MODE_PARAMS, SAVINGS_NEIGHBOURS
+from courier_route_optimization.deliveries import as_table
+from courier_route_optimization.instrument import span
+from courier_route_optimization.parallel import ordered_map
+from courier_route_optimization.route_optimizer import RouteOptimizer, ORDER_KINDS
+from courier_route_optimization.spatial import SphereKDTree, unit_vectors
+from courier_route_optimization.utils import haversine_np
+
+'''
+Fleet mode: the deliveries of one depot are split into routes whose total weight_kg fits the payload of one
+vehicle (MODE_PARAMS capacity by default), then every route is ordered/improved by its own RouteOptimizer.
+Splitting:
+    sweep    - stops sorted by bearing from the depot, a new route starts when the next stop would not fit
+    savings  - Clarke-Wright: routes start as depot -> stop -> depot and are joined end to end by the largest
+               saving d(0,i) + d(0,j) - d(i,j) while the load fits. Savings are only computed towards each
+               stop's SAVINGS_NEIGHBOURS nearest stops so it stays near-linear for 10k+ stops
+Each route is a small independent problem, so they are optimized in parallel and no distance matrix over all
+stops is ever built.
+'''
+
+SPLIT_METHODS = ("savings", "sweep")
+
+
+def _check_capacity(table, capacity):
+    if capacity <= 0:
+        raise ValueError(f"Vehicle capacity must be positive, got {capacity}")
+    heavy = np.flatnonzero(table.weight_kg > capacity)
+    if len(heavy):
+        k = int(heavy[0])
+        raise ValueError(f"Delivery to {table.customer[k]} weighs {table.weight_kg[k]} kg, more than the "
+                         f"vehicle capacity of {capacity} kg ({len(heavy)} such deliveries)")
+
+
+# routes as lists of delivery indices, filled in bearing order around the depot
+def split_sweep(depot: dict, deliveries, capacity: float) -> list[list[int]]:
+    table = as_table(deliveries)
+    _check_capacity(table, capacity)
+    east = (table.lon - depot["lon"]) * math.cos(math.radians(depot["lat"]))
+    north = table.lat - depot["lat"]
+    bearing = np.arctan2(north, east)
+
+    routes, route, load = [], [], 0.0
+    weights = table.weight_kg.tolist()
+    for k in np.argsort(bearing, kind="stable").tolist():
+        if route and load + weights[k] > capacity:
+            routes.append(route)
+            route, load = [], 0.0
+        route.append(k)
+        load += weights[k]
+    if route:
+        routes.append(route)
+    return routes
+
+
+# routes as lists of delivery indices (in the joined order), see the module notes
+def split_savings(depot: dict, deliveries, capacity: float, neighbours=SAVINGS_NEIGHBOURS) -> list[list[int]]:
+    table = as_table(deliveries)
+    _check_capacity(table, capacity)
+    n = len(table)
+    if n == 0:
+        return []
+
+    # candidate pairs i < j from the nearest neighbour lists
+    k = min(neighbours, n - 1)
+    pairs = np.empty((0, 2), dtype=np.intp)
+    if k > 0:
+        near = SphereKDTree(unit_vectors(table.lat, table.lon)).knearest_all(k + 1)
+        i_idx = np.repeat(np.arange(n), near.shape[1])
+        j_idx = near.ravel()
+        keep = i_idx != j_idx
+        pairs = np.unique(np.sort(np.column_stack((i_idx[keep], j_idx[keep])), axis=1), axis=0)
+
+    d0 = haversine_np(depot["lat"], depot["lon"], table.lat, table.lon)
+    i_idx, j_idx = pairs[:, 0], pairs[:, 1]
+    saving = d0[i_idx] + d0[j_idx] - haversine_np(table.lat[i_idx], table.lon[i_idx], table.lat[j_idx], table.lon[j_idx])
+    # largest saving first, ties by pair so the split is repeatable
+    by_saving = np.lexsort((j_idx, i_idx, -saving))
+
+    route_of = list(range(n))
+    members = {r: deque([r]) for r in range(n)}
+    load = table.weight_kg.tolist()
+
+    for p in by_saving.tolist():
+        if saving[p] < 0:
+            break
+        i, j = int(i_idx[p]), int(j_idx[p])
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj or load[ri] + load[rj] > capacity:
+            continue
+        a, b = members[ri], members[rj]
+        # both stops have to be at an end of their route (next to the depot)
+        if i not in (a[0], a[-1]) or j not in (b[0], b[-1]):
+            continue
+        if a[-1] != i:
+            a.reverse()
+        if b[0] != j:
+            b.reverse()
+
+        # relabel the shorter route
+        if len(a) >= len(b):
+            a.extend(b)
+            keep_r, drop_r, moved = ri, rj, b
+        else:
+            b.extendleft(reversed(a))
+            keep_r, drop_r, moved = rj, ri, a
+        for node in moved:
+            route_of[node] = keep_r
+        load[keep_r] += load[drop_r]
+        del members[drop_r]
+
+    return sorted((list(route) for route in members.values()), key=min)
+
+
+def split_deliveries(depot: dict, deliveries, capacity: float, method="savings") -> list[list[int]]:
+    if method == "savings":
+        return split_savings(depot, deliveries, capacity)
+    if method == "sweep":
+        return split_sweep(depot, deliveries, capacity)
+    raise ValueError(f"Unknown split method: {method} (use one of {SPLIT_METHODS})")
+
+
+# orders, improves and builds one route, run in a worker process when the fleet is optimized in parallel
+def _optimize_route(table, depot, mode, objective, multi_weights, order_by, prio_gamma, improve, start_time, distance,
+                    road_network, exact_stops):
+    optimizer = RouteOptimizer(depot, table, mode, objective, multi_weights, distance=distance,
+                               road_network=road_network, start_time=start_time, exact_stops=exact_stops)
+    orders = dict(zip(ORDER_KINDS, optimizer.closest_route_order(prio_gamma=prio_gamma, orders=(order_by,))))
+    order = orders[order_by]
+    if improve:
+        order = optimizer.improve(order, order_by, time_budget=improve)
+    score, t_actual = optimizer.route_scores(order)
+    return order, score, t_actual, optimizer.route_builder(order, start_time)
+
+# options shared by the routes of the pool workers (the road network is large), set once by _init_worker
+_worker = {}
+
+def _init_worker(options):
+    _worker.update(options)
+
+def _optimize_in_worker(table):
+    return _optimize_route(table, **_worker)
+
+
+'''
+Splits the deliveries into capacity-feasible routes and optimizes every route like the single route CLI does:
+greedy order by order_by, optional improvement (improve = seconds per route), route_scores and route_builder.
+Routes are optimized over a process pool when workers > 1. Returns one dict per vehicle with
+    vehicle, deliveries (delivery indices in visiting order), load_kg, score, t_actual and
+    rows (the RouteResult from route_builder)
+'''
+def plan_fleet(depot: dict, deliveries, mode, objective: str, multi_weights: dict, order_by="time",
+               method="savings", capacity=None, prio_gamma=0.6, improve=None, start_time=None, workers=1,
+               distance="haversine", road_network=None, exact_stops=None):
+    table = as_table(deliveries)
+    capacity = MODE_PARAMS[mode]["capacity"] if capacity is None else capacity
+    start_time = start_time or datetime.now()
+    with span("split", deliveries=len(table)):
+        routes = split_deliveries(depot, table, capacity, method)
+
+    options = {"depot": depot, "mode": mode, "objective": objective, "multi_weights": multi_weights,
+               "order_by": order_by, "prio_gamma": prio_gamma, "improve": improve, "start_time": start_time,
+               "distance": distance, "road_network": road_network, "exact_stops": exact_stops}
+    tables = (table.take(route) for route in routes)
+    if workers > 1 and len(routes) > 1:
+        # the workers get the options once at start-up, the tasks only carry their route's deliveries
+        with ProcessPoolExecutor(min(workers, len(routes)), initializer=_init_worker, initargs=(options,)) as pool:
+            results = list(ordered_map(pool, _optimize_in_worker, tables))
+    else:
+        results = [_optimize_route(t, **options) for t in tables]
+
+    fleet = []
+    for v, (route, (order, score, t_actual, rows)) in enumerate(zip(routes, results), start=1):
+        fleet.append({
+            "vehicle": v,
+            "deliveries": [route[k] for k in order],
+            "load_kg": float(table.weight_kg[route].sum()),
+            "score": score,
+            "t_actual": t_actual,
+            "rows": rows
+        })
+    return fleet
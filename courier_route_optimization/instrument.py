@@ -0,0 +1,174 @@
+import csv
+import io
+import json
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+'''
+Per-phase instrumentation: nestable spans with counters, buffered in memory and exported once per run.
+    with span("distance", pairs=n * n):       # times the block, counters can be given up front ...
+        count("haversine", n)                 # ... or added to the innermost open span while it runs
+Each finished span is one record {"name", "path" ("run/greedy:time"), "depth", "start", "seconds", counters}.
+Recording is off until enable() is called (the CLI turns it on), a disabled span is a shared null context so the
+optimizer can keep its spans in place in the service and in worker processes at no real cost. Spans are per
+phase, never per stop, and nothing is printed or written while the run is going: export_json / export_csv /
+report_timers write the buffer once at the end. @timer is always on: without enable() it behaves like the old
+decorator (prints and appends to execution_timer_log.csv per call), so callers outside the CLI keep their log.
+profiled(path) runs a block under cProfile and tracemalloc and writes a text report (slows the block down).
+'''
+
+_NULL = nullcontext()
+
+
+class Recorder:
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.origin = time.perf_counter()
+        self._local = threading.local()     # open spans per thread, the service runs optimizers in threads
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def _span(self, name, counters):
+        stack = self._stack()
+        record = {"name": name, "path": "/".join([r["name"] for r in stack] + [name]), "depth": len(stack),
+                  "start": 0.0, "seconds": 0.0, "counters": dict(counters)}
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["start"] = start - self.origin
+            stack.pop()
+            self.records.append(record)
+
+    def span(self, name: str, **counters):
+        return self._span(name, counters) if self.enabled else _NULL
+
+    # adds n to a counter of the innermost open span of this thread
+    def count(self, name: str, n=1):
+        if self.enabled:
+            stack = self._stack()
+            if stack:
+                counters = stack[-1]["counters"]
+                counters[name] = counters.get(name, 0) + n
+
+    def reset(self):
+        self.records = []
+        self.origin = time.perf_counter()
+
+    # calls, seconds and summed counters per span path, in order of first appearance
+    def summary(self) -> list[dict]:
+        by_path = {}
+        for record in sorted(self.records, key=lambda r: r["start"]):
+            total = by_path.setdefault(record["path"], {"path": record["path"], "calls": 0, "seconds": 0.0,
+                                                        "counters": {}})
+            total["calls"] += 1
+            total["seconds"] += record["seconds"]
+            for name, n in record["counters"].items():
+                total["counters"][name] = total["counters"].get(name, 0) + n
+        return list(by_path.values())
+
+
+RECORDER = Recorder()
+span = RECORDER.span
+count = RECORDER.count
+
+
+def enable(on=True):
+    RECORDER.enabled = on
+
+
+# times every call of func: a span named after it when recording (reported once by report_timers), otherwise
+# printed and appended to the log straight away like the old decorator
+def timer(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not RECORDER.enabled:
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            _log_timers([(func.__name__, time.perf_counter() - start)])
+            return result
+        with span(func.__name__) as record:
+            record["timer"] = True
+            return func(*args, **kwargs)
+    return wrapper
+
+
+# prints (name, seconds) timings and appends them to log_file, the format of the old @timer
+def _log_timers(timings, log_file="execution_timer_log.csv"):
+    from datetime import datetime
+
+    for name, seconds in timings:
+        print(f"{name} took {seconds:.5f} seconds")
+    with open(log_file, mode="a", newline="") as file:
+        writer = csv.writer(file)
+        if file.tell() == 0:
+            writer.writerow(["timestamp", "function", "duration_seconds"])
+        now = datetime.now().isoformat()
+        writer.writerows([now, name, f"{seconds:.5f}"] for name, seconds in timings)
+
+
+def export_json(path: Path):
+    with open(path, "w") as f:
+        json.dump({"spans": sorted(RECORDER.records, key=lambda r: r["start"]), "summary": RECORDER.summary()},
+                  f, indent=2)
+
+
+# one row per span path, counters as name=value pairs
+def export_csv(path: Path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "calls", "seconds", "counters"])
+        for total in RECORDER.summary():
+            writer.writerow([total["path"], total["calls"], f"{total['seconds']:.6f}",
+                             " ".join(f"{k}={v}" for k, v in total["counters"].items())])
+
+
+# json or csv by the file suffix
+def export(path: Path):
+    (export_csv if Path(path).suffix.lower() == ".csv" else export_json)(path)
+
+
+# the @timer output of the old decorator, once at the end of the run: printed and appended to log_file
+def report_timers(log_file="execution_timer_log.csv"):
+    timed = [r for r in sorted(RECORDER.records, key=lambda r: r["start"]) if r.get("timer")]
+    if timed:
+        _log_timers([(r["name"], r["seconds"]) for r in timed], log_file)
+
+
+# cProfile (top functions by cumulative time) and tracemalloc (peak and top allocation sites) report of the block
+@contextmanager
+def profiled(path: Path, top=30):
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        out = io.StringIO()
+        out.write(f"Memory: current {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB (tracemalloc)\n\n")
+        out.write(f"Top {top} allocation sites:\n")
+        for stat in snapshot.statistics("lineno")[:top]:
+            out.write(f"  {stat}\n")
+        out.write(f"\nTop {top} functions by cumulative time:\n")
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        Path(path).write_text(out.getvalue())
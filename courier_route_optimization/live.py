@@ -0,0 +1,160 @@
+import numpy as np
+from courier_route_optimization.constants import MODE_PARAMS
+from courier_route_optimization.deliveries import PRIORITY_CODE, URGENCY_BY_CODE
+from courier_route_optimization.route_result import RouteResult
+
+'''
+Incremental route for updates during the shift, made by RouteOptimizer.live_route(order).
+Stops are nodes in array-backed linked lists (nxt/prv), node 0 is the depot and node k+1 is delivery k of the
+optimizer, added deliveries get new nodes. The route is depot -> ... -> depot, so nxt of the last stop is 0.
+    insert(delivery)  cheapest insertion after the courier's position: the extra cost of every remaining leg
+                      a -> b is computed in one numpy pass, the stop goes on the leg where it costs least
+    remove(node)      splices the stop out in O(1)
+    advance()         the courier has reached the next stop; stops up to the current one are driven and are
+                      never moved, removed or inserted before
+Leg distances and the distance / priority-weighted distance sums are kept per update, so totals() costs O(1).
+Insertion cost uses the objective's arrival weights as improve() does, with the optimizer's star reference
+totals for "multi" (they are not recomputed when stops are added).
+'''
+
+class LiveRoute:
+    def __init__(self, optimizer, order: list[int], objective: str):
+        table = optimizer.deliveries
+        n = len(table) + 1
+        size = max(16, 2 * n)
+        self.mode = optimizer.mode
+        self.depot = optimizer.depot
+        self.objective = objective
+        self._optimizer = optimizer
+        self._distance_np = optimizer.distance_np     # haversine or planar, same as the optimizer's matrix
+
+        self.customer = [optimizer.depot["name"]] + list(table.customer)
+        self.lat = np.zeros(size)
+        self.lon = np.zeros(size)
+        self.prio = np.ones(size)           # URGENCY_MULT of the stop, 1.0 for the depot
+        self.c = np.zeros(size)             # arrival weight of the objective (leg a -> b costs d * c[b])
+        self.nxt = np.zeros(size, dtype=np.intp)
+        self.prv = np.zeros(size, dtype=np.intp)
+        self.leg = np.zeros(size)           # distance node -> nxt[node]
+        self.active = np.zeros(size, dtype=bool)
+        self.driven = np.zeros(size, dtype=bool)
+        self.n_nodes = n
+
+        self.lat[:n] = np.concatenate(([optimizer.depot["lat"]], table.lat))
+        self.lon[:n] = np.concatenate(([optimizer.depot["lon"]], table.lon))
+        self.prio[1:n] = optimizer.priority_weights
+        self.c[:n] = optimizer._arrival_weights(objective)
+
+        tour = [0] + [k + 1 for k in order] + [0]
+        t = np.array(tour)
+        self.nxt[t[:-1]] = t[1:]
+        self.prv[t[1:]] = t[:-1]
+        self.leg[t[:-1]] = optimizer.distance_matrix.gather(t[:-1], t[1:])
+        self.active[t[:-1]] = True
+        self.current = 0                    # node the courier is at (or leaving), the depot before departure
+        self.driven[0] = True
+
+        legs = self.leg[t[:-1]]
+        self._dist = float(legs.sum())
+        self._prio_dist = float((legs * self.prio[t[1:]]).sum())
+
+    def __len__(self):
+        return int(self.active.sum()) - 1
+
+    def _grow(self):
+        size = 2 * len(self.lat)
+        for name in ("lat", "lon", "prio", "c", "nxt", "prv", "leg", "active", "driven"):
+            old = getattr(self, name)
+            new = np.zeros(size, dtype=old.dtype)
+            if name == "prio":
+                new[:] = 1.0
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    '''
+    Adds a delivery ({"customer", "lat", "lon", "priority", ...}) on the remaining leg where it increases the
+    objective least. Returns its node, use it for remove(). Raises ValueError for an unknown priority.
+    '''
+    def insert(self, delivery: dict) -> int:
+        code = PRIORITY_CODE.get(delivery["priority"])
+        if code is None:
+            raise ValueError(f"The priority value is not valid (high/medium/low): {delivery['priority']}")
+        if self.n_nodes == len(self.lat):
+            self._grow()
+        x = self.n_nodes
+        lat, lon = float(delivery["lat"]), float(delivery["lon"])
+        prio = float(URGENCY_BY_CODE[code])
+        c_x = float(self._optimizer._arrival_weights(self.objective, np.array([prio]))[0])
+
+        # legs a -> b that are not driven yet: from the current stop onwards
+        a = np.concatenate(([self.current], np.flatnonzero(self.active[:x] & ~self.driven[:x])))
+        b = self.nxt[a]
+        d_x = self._distance_np(lat, lon, self.lat[:x], self.lon[:x])
+        delta = d_x[a] * c_x + d_x[b] * self.c[b] - self.leg[a] * self.c[b]
+        best = int(np.argmin(delta))
+        a, b = int(a[best]), int(b[best])
+
+        self.customer.append(delivery["customer"])
+        self.lat[x], self.lon[x], self.prio[x], self.c[x] = lat, lon, prio, c_x
+        self.active[x] = True
+        self.n_nodes += 1
+        self._splice_in(a, x, b, float(d_x[a]), float(d_x[b]))
+        return x
+
+    def _splice_in(self, a, x, b, d_ax, d_xb):
+        self._dist += d_ax + d_xb - self.leg[a]
+        self._prio_dist += d_ax * self.prio[x] + (d_xb - self.leg[a]) * self.prio[b]
+        self.nxt[a], self.nxt[x] = x, b
+        self.prv[x], self.prv[b] = a, x
+        self.leg[a], self.leg[x] = d_ax, d_xb
+
+    # removes a stop that is not driven yet (a cancelled order)
+    def remove(self, node: int):
+        if node <= 0 or node >= self.n_nodes or not self.active[node]:
+            raise ValueError(f"Stop {node} is not on the route")
+        if self.driven[node]:
+            raise ValueError(f"Stop {node} ({self.customer[node]}) is already driven")
+        a, b = self.prv[node], self.nxt[node]
+        d_ab = float(self._distance_np(self.lat[a], self.lon[a], self.lat[b], self.lon[b]))
+        self._dist += d_ab - self.leg[a] - self.leg[node]
+        self._prio_dist += d_ab * self.prio[b] - self.leg[a] * self.prio[node] - self.leg[node] * self.prio[b]
+        self.nxt[a], self.prv[b] = b, a
+        self.leg[a] = d_ab
+        self.active[node] = False
+
+    # the courier reached the next stop, returns its node
+    def advance(self) -> int:
+        nxt = int(self.nxt[self.current])
+        if nxt == 0:
+            raise ValueError("The route is finished, only the return to the depot is left")
+        self.current = nxt
+        self.driven[nxt] = True
+        return nxt
+
+    # delivery stops in driving order (nodes, depot excluded); node k+1 is delivery k of the optimizer
+    def nodes(self) -> list[int]:
+        out = []
+        node = int(self.nxt[0])
+        while node != 0:
+            out.append(node)
+            node = int(self.nxt[node])
+        return out
+
+    # same keys as RouteOptimizer.route_totals (time weighted by priority), plus the distance in km
+    def totals(self) -> dict:
+        d_mode = MODE_PARAMS[self.mode]
+        return {
+            "time": self._prio_dist / d_mode["speed"],
+            "cost": self._dist * d_mode["cost"],
+            "co2": self._dist * d_mode["co2"],
+            "t_actual": self._dist / d_mode["speed"],
+            "distance": self._dist,
+        }
+
+    # the current plan as a RouteResult, like RouteOptimizer.route_builder (without delivery windows)
+    def route_result(self, start_time) -> RouteResult:
+        tour = [0] + self.nodes() + [0]
+        distance = np.zeros(len(tour))
+        distance[1:] = self.leg[tour[:-1]]
+        return RouteResult([self.customer[node] for node in tour], self.lat[tour], self.lon[tour], distance,
+                           self.mode, start_time)
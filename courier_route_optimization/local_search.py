@@ -0,0 +1,119 @@
+import time
+from collections import deque
+import numpy as np
+
+'''
+2-opt and Or-opt improvement of a route after the greedy construction.
+The tour is a list of distance matrix indices starting and ending at the depot (0). Every leg a -> b costs
+D[a, b] * c[b], where c is the weight of the stop the leg arrives at, which covers the priority-weighted time
+of route_totals as well as plain cost/CO2. Reversing a segment changes which stop each inner leg arrives at,
+so a prefix sum over (reversed leg - leg) keeps the 2-opt delta O(1) also with priorities.
+Moves are only tried towards each stop's nearest neighbours, and stops whose surroundings did not change since
+they last failed to improve are skipped (don't-look bits).
+'''
+
+def _legs(D, c, tour):
+    t = np.asarray(tour)
+    forward = np.asarray(D.gather(t[:-1], t[1:]), dtype=np.float64) * c[t[1:]]
+    backward = np.asarray(D.gather(t[1:], t[:-1]), dtype=np.float64) * c[t[:-1]]
+    prefix = np.concatenate(([0.0], np.cumsum(backward - forward)))
+    return forward.tolist(), prefix.tolist()
+
+
+def tour_cost(D, c, tour) -> float:
+    return float(sum(_legs(D, c, tour)[0]))
+
+
+# neighbours[a] = nearest stops of matrix index a, as produced by RouteOptimizer._neighbour_lists
+def improve_tour(D, c: np.ndarray, tour: list[int], neighbours: list[list[int]], time_budget: float,
+                 max_segment=3) -> list[int]:
+    deadline = time.perf_counter() + time_budget
+    tour = list(tour)
+    m = len(tour) - 1                       # tour[0] and tour[m] are the depot
+    if m < 3:
+        return tour
+
+    dist = D.pair
+    cw = c.tolist()
+    eps = 1e-12 * max(tour_cost(D, c, tour), 1.0)
+
+    def cost(a, b):
+        return dist(a, b) * cw[b]
+
+    def refresh():
+        nonlocal legs, prefix, pos
+        legs, prefix = _legs(D, c, tour)
+        pos = {node: p for p, node in enumerate(tour)}
+        pos[0] = 0
+
+    legs = prefix = pos = None
+    refresh()
+
+    # reversing positions i..j: new legs t[i-1] -> t[j] and t[i] -> t[j+1], inner legs flip direction
+    def two_opt_delta(i, j):
+        return (cost(tour[i - 1], tour[j]) + cost(tour[i], tour[j + 1])
+                - legs[i - 1] - legs[j] + prefix[j] - prefix[i])
+
+    # moving positions s..e between p and p+1, optionally reversed
+    def or_opt_delta(s, e, p, reverse):
+        removed = cost(tour[s - 1], tour[e + 1]) - legs[s - 1] - legs[e]
+        if reverse:
+            inserted = cost(tour[p], tour[e]) + cost(tour[s], tour[p + 1]) + prefix[e] - prefix[s]
+        else:
+            inserted = cost(tour[p], tour[s]) + cost(tour[e], tour[p + 1])
+        return removed + inserted - legs[p]
+
+    def try_two_opt(a):
+        for pa in ((0, m) if a == 0 else (pos[a],)):
+            for b in neighbours[a]:
+                pb = pos[b]
+                for i, j in ((pa + 1, pb), (pa, pb - 1), (pb + 1, pa), (pb, pa - 1)):
+                    if 1 <= i < j <= m - 1 and two_opt_delta(i, j) < -eps:
+                        tour[i:j + 1] = tour[i:j + 1][::-1]
+                        return tour[i - 1], tour[i], tour[j], tour[j + 1]
+        return None
+
+    def try_or_opt(a):
+        if a == 0:
+            return None
+        pa = pos[a]
+        for length in range(1, max_segment + 1):
+            for s, e in ((pa, pa + length - 1), (pa - length + 1, pa)):
+                if s < 1 or e > m - 1:
+                    continue
+                for b in neighbours[a]:
+                    pb = pos[b]
+                    for p in (pb, pb - 1):
+                        if not (0 <= p < s - 1 or e < p <= m - 1):
+                            continue
+                        for reverse in (False, True):
+                            if or_opt_delta(s, e, p, reverse) < -eps:
+                                segment = tour[s:e + 1][::-1] if reverse else tour[s:e + 1]
+                                touched = (tour[s - 1], tour[e + 1], tour[p], tour[p + 1], tour[s], tour[e])
+                                if p > e:
+                                    tour[p + 1:p + 1] = segment
+                                    del tour[s:e + 1]
+                                else:
+                                    del tour[s:e + 1]
+                                    tour[p + 1:p + 1] = segment
+                                return touched
+        return None
+
+    # every stop starts active, stops next to a changed leg are woken up again
+    active = deque(tour[:-1])
+    looking = set(active)
+    while active and time.perf_counter() < deadline:
+        a = active.popleft()
+        looking.discard(a)
+
+        touched = try_two_opt(a) or try_or_opt(a)
+        if touched is None:
+            continue
+
+        refresh()
+        for node in (a, *touched):
+            if node not in looking:
+                looking.add(node)
+                active.append(node)
+
+    return tour
@@ -0,0 +1,50 @@
+import os
+from collections import deque
+import numpy as np
+from courier_route_optimization.distance import DistanceMatrix
+
+'''
+Helpers for process pools: a dense distance matrix is copied once into shared memory by the parent and every
+worker maps the same block instead of receiving (or recomputing) the matrix per task.
+'''
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
+
+
+# copy a dense DistanceMatrix into a new shared memory block, returns the block (parent must close + unlink it)
+# and the spec the workers attach with. Lazy matrices are not shared, workers compute their own rows
+def share_matrix(D):
+    if not isinstance(D, DistanceMatrix):
+        return None, None
+    from multiprocessing import shared_memory      # imported on first use, keeps plain CLI start-up light
+    shm = shared_memory.SharedMemory(create=True, size=max(D.data.nbytes, 1))
+    np.ndarray(D.data.shape, dtype=D.data.dtype, buffer=shm.buf)[:] = D.data
+    return shm, (shm.name, D.data.shape, D.data.dtype.str)
+
+
+# worker side of share_matrix, keep the returned block referenced for as long as the matrix is used
+def attach_matrix(spec):
+    from multiprocessing import shared_memory
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, DistanceMatrix(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+
+
+def release(shm):
+    if shm is not None:
+        shm.close()
+        shm.unlink()
+
+
+# like pool.map but keeps at most window tasks in flight, so a long input is not submitted all at once.
+# Results come back in input order
+def ordered_map(pool, fn, iterable, window=None):
+    window = window or 2 * (getattr(pool, "_max_workers", None) or default_workers())
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
@@ -1,5 +1,14 @@
+import copy
 import csv
+import hashlib
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+import numpy as np
+from courier_route_optimization.instrument import span, count
+from courier_route_optimization.route_optimizer import RouteOptimizer
+from courier_route_optimization.parallel import share_matrix, attach_matrix, release
 
 """
 Functions for evaluating Pareto optimality of courier routes for time, cost, and CO2.
@@ -11,66 +20,355 @@ def is_dominated(p, others):
             return True
     return False
 
-#index of non-dominated points
+'''
+Non-dominated sorting for (time, cost, co2) points. Exact duplicates are collapsed and the unique points sorted
+lexicographically, after that only earlier points can dominate a later one, and they do exactly when they are
+<= on cost and co2. Each front keeps a staircase of its (cost, co2) points (cost ascending, co2 descending) so
+that check is a bisect, and a point's rank is found by binary search over the fronts since a point dominated by
+front k is also dominated by front k-1.
+'''
+def _as_points(points) -> np.ndarray:
+    return np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+def _stair_dominates(stair, c, z) -> bool:
+    cs, neg_zs = stair
+    i = bisect_right(cs, c) - 1
+    return i >= 0 and -neg_zs[i] <= z
+
+def _stair_insert(stair, c, z):
+    cs, neg_zs = stair
+    i = bisect_left(cs, c)
+    j = bisect_right(neg_zs, -z, lo=i)   # following steps with co2 >= z are not needed anymore
+    del cs[i:j], neg_zs[i:j]
+    cs.insert(i, c)
+    neg_zs.insert(i, -z)
+
+# rank of every point, 0 = non-dominated front, 1 = front after removing front 0, ...
+def pareto_ranks(points) -> np.ndarray:
+    P = _as_points(points)
+    if len(P) == 0:
+        return np.empty(0, dtype=np.intp)
+    uniq, inverse = np.unique(P, axis=0, return_inverse=True)
+
+    fronts = []
+    ranks = np.empty(len(uniq), dtype=np.intp)
+    for idx, (c, z) in enumerate(uniq[:, 1:].tolist()):
+        lo, hi = 0, len(fronts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _stair_dominates(fronts[mid], c, z):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(fronts):
+            fronts.append(([], []))
+        _stair_insert(fronts[lo], c, z)
+        ranks[idx] = lo
+    return ranks[inverse.ravel()]
+
+#index of non-dominated points (identical points do not dominate each other)
 def pareto_index(points):
-    non_dominated = []
-    for i, p in enumerate(points):
-        if not is_dominated(p, points[:i] + points[i+1:]):
-            non_dominated.append(i)
-    return non_dominated
+    P = _as_points(points)
+    if len(P) == 0:
+        return []
+    uniq, inverse = np.unique(P, axis=0, return_inverse=True)
+
+    stair = ([], [])
+    keep = np.zeros(len(uniq), dtype=bool)
+    for idx, (c, z) in enumerate(uniq[:, 1:].tolist()):
+        if not _stair_dominates(stair, c, z):
+            _stair_insert(stair, c, z)
+            keep[idx] = True
+    return np.flatnonzero(keep[inverse.ravel()]).tolist()
 
+get_pareto_indices = pareto_index
+
+# NSGA-II crowding distance within each front, boundary points of a front get inf
+def crowding_distance(points, ranks=None) -> np.ndarray:
+    P = _as_points(points)
+    ranks = pareto_ranks(P) if ranks is None else np.asarray(ranks)
+    dist = np.zeros(len(P))
+    if len(P) == 0:
+        return dist
+
+    for m in range(P.shape[1]):
+        order = np.lexsort((P[:, m], ranks))
+        r, v = ranks[order], P[order, m]
+        first = np.r_[True, r[1:] != r[:-1]]
+        last = np.r_[r[1:] != r[:-1], True]
+        group = np.cumsum(first) - 1
+        extent = (v[last] - v[first])[group]
+
+        gap = np.zeros(len(P))
+        inner = ~(first | last)
+        inner_idx = np.flatnonzero(inner)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gap[inner_idx] = np.where(extent[inner_idx] > 0, (v[inner_idx + 1] - v[inner_idx - 1]) / extent[inner_idx], 0.0)
+        gap[first | last] = np.inf
+        dist[order] += gap
+    return dist
+
+# weight combinations (gamma, w_time, w_cost, w_co2) of the sweep, in the order they are evaluated
 # This code was modified from AI prompt is:
 # fix the nested loop to properly iterate over the different weights:
-def evaluate_pareto_routes(optimizer, n_steps=12, gammas=(0.2, 0.6, 1.0, 1.6), save_csv=True):
-    performance, weights, routes, gammas_used = [], [], [], []
-    seen = set()  # stop identical duplicate (route + gamma + weights)
-
+def weight_grid(n_steps, gammas):
     for gamma in gammas:            # for each different gamma value iterate over n steps of weight combinations
         for i in range(n_steps + 1):     
             for j in range(n_steps + 1 - i):
                 k = n_steps - i - j
                 if i + j + k == 0:
                     continue
+                yield gamma, i / n_steps, j / n_steps, k / n_steps
+
+# multi-objective order for one weight combination and its unweighted totals (time, cost, co2)
+def _evaluate(optimizer, combo):
+    gamma, w_t, w_c, w_z = combo
+    optimizer.multi_weights = {"time": w_t, "cost": w_c, "co2": w_z}
+    order_multi = optimizer.closest_route_order(prio_gamma=gamma, orders=("multi",))[3]
+    totals = optimizer.route_totals(order_multi, prio_on_time=False)
+    return order_multi, (totals["t_actual"], totals["cost"], totals["co2"])
+
+# per-process optimizer of the pool workers, set up once by _init_worker
+_worker = {}
+
+def _init_worker(depot, deliveries, mode, options, spec):
+    shm, D = attach_matrix(spec) if spec else (None, None)
+    optimizer = RouteOptimizer(depot, deliveries, mode, "multi", {"time": 0.0, "cost": 0.0, "co2": 0.0}, **options)
+    if D is not None:
+        optimizer._matrix = D
+    _worker["shm"] = shm
+    _worker["optimizer"] = optimizer
+
+def _evaluate_in_worker(combo):
+    return _evaluate(_worker["optimizer"], combo)
+
+# _init_worker arguments for an optimizer like the parent's. The road network goes along so a worker has the same
+# distance backend (road distance_np, no projection or spatial index), like the fleet workers. The distance cache
+# stays in the parent, it is a handle on files of this process, and a worker never builds a matrix it could serve:
+# dense ones come from shared memory, and from MATRIX_LAZY_STOPS the cache hands out a plain LazyDistanceMatrix
+def _worker_args(optimizer, spec):
+    options = {"spatial_index": optimizer.spatial_index, "distance": optimizer.distance,
+               "road_network": optimizer.road_network, "start_time": optimizer.start_time,
+               "exact_stops": optimizer.exact_stops}
+    return optimizer.depot, optimizer.deliveries, optimizer.mode, options, spec
+
+'''
+Evaluates the weight combinations serially, or over a pool of worker processes when workers > 1.
+Workers get depot/deliveries once at start-up and map the parent's distance matrix from shared memory, and the
+results come back in the order of combos either way so the sweep output is the same as a serial run.
+_combo_evaluator gives a function evaluate(combos) yielding (combo, order, performance), the pool (if any)
+lives as long as the with block so callers with several batches of combos start it only once.
+'''
+@contextmanager
+def _combo_evaluator(optimizer, workers=None):
+    def serial(combos):
+        for combo in combos:
+            yield combo, *_evaluate(optimizer, combo)
+
+    if not workers or workers <= 1:
+        yield serial
+        return
+
+    shm, spec = share_matrix(optimizer.distance_matrix)
+    try:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=_worker_args(optimizer, spec)) as pool:
+            def parallel(combos):
+                combos = list(combos)
+                if len(combos) < 2:
+                    yield from serial(combos)
+                    return
+                chunksize = max(1, len(combos) // (workers * 4))
+                for combo, (order_multi, perf) in zip(combos, pool.map(_evaluate_in_worker, combos,
+                                                                       chunksize=chunksize)):
+                    yield combo, order_multi, perf
+            yield parallel
+    finally:
+        release(shm)
+
+def evaluate_combos(optimizer, combos, workers=None):
+    combos = list(combos)
+    with _combo_evaluator(optimizer, workers if len(combos) >= 2 else None) as evaluate:
+        yield from evaluate(combos)
+
+'''
+Adaptive alternative to the full weight_grid sweep. For each gamma the weight simplex is split into a coarse
+triangulation, and only triangles whose corner weights give different routes, or have a corner on the current
+non-dominated front, are split further (into 4 by their edge midpoints) until the cells are one n_steps grid
+step wide. Corners are lattice points of the n_steps grid, so every evaluated combination is one the full grid
+would evaluate too. max_evals caps the number of optimizer calls. Yields like evaluate_combos, level by level,
+with one worker pool for all levels.
+'''
+def _check_steps(n_steps):
+    if n_steps < 1:
+        raise ValueError(f"n_steps must be >= 1, got {n_steps}")
 
-                w_t, w_c, w_z = i / n_steps, j / n_steps, k / n_steps
-                optimizer.multi_weights = {"time": w_t, "cost": w_c, "co2": w_z}
+def _coarse_cells(n_steps):
+    coarse = n_steps
+    while coarse % 2 == 0 and coarse > 2:
+        coarse //= 2
+    size = n_steps // coarse
 
-                order_time, order_co2, order_cost, order_multi = optimizer.closest_route_order(multiobj=True, prio_gamma=gamma)
-                key = (tuple(order_multi), round(gamma, 6), round(w_t, 6), round(w_c, 6), round(w_z, 6))
-                if key in seen:
+    cells = []
+    for a in range(coarse):
+        for b in range(coarse - a):
+            cells.append((size, ((a * size, b * size), ((a + 1) * size, b * size), (a * size, (b + 1) * size))))
+            if a + b <= coarse - 2:
+                cells.append((size, (((a + 1) * size, b * size), (a * size, (b + 1) * size), ((a + 1) * size, (b + 1) * size))))
+    return cells
+
+def _split_cell(cell):
+    size, (p0, p1, p2) = cell
+    def mid(p, q):
+        return (p[0] + q[0]) // 2, (p[1] + q[1]) // 2
+    m01, m12, m02 = mid(p0, p1), mid(p1, p2), mid(p0, p2)
+    half = size // 2
+    return [(half, (p0, m01, m02)), (half, (m01, p1, m12)), (half, (m02, m12, p2)), (half, (m01, m12, m02))]
+
+def adaptive_combos(optimizer, n_steps=48, gammas=(0.2, 0.6, 1.0, 1.6), max_evals=None, workers=None):
+    _check_steps(n_steps)
+    evaluated = {}  # (gamma, (i, j)) -> (route_key, performance)
+    cells = [(gamma, cell) for gamma in gammas for cell in _coarse_cells(n_steps)]
+    with _combo_evaluator(optimizer, workers) as evaluate:
+        while cells:
+            # corners not evaluated yet, in cell order so the output is deterministic
+            new = list(dict.fromkeys((gamma, p) for gamma, (_, corners) in cells for p in corners
+                                     if (gamma, p) not in evaluated))
+            if max_evals is not None:
+                new = new[:max(0, max_evals - len(evaluated))]
+
+            combos = [(gamma, i / n_steps, j / n_steps, (n_steps - i - j) / n_steps) for gamma, (i, j) in new]
+            for key, (combo, order_multi, perf) in zip(new, evaluate(combos)):
+                evaluated[key] = (route_key(order_multi), perf)
+                yield combo, order_multi, perf
+
+            if max_evals is not None and len(evaluated) >= max_evals:
+                return
+
+            keys = list(evaluated)
+            front = {keys[i] for i in pareto_index([evaluated[k][1] for k in keys])}
+
+            refined = []
+            for gamma, cell in cells:
+                size, corners = cell
+                if size < 2:
                     continue
-                seen.add(key)
+                corner_keys = [(gamma, p) for p in corners]
+                if len({evaluated[k][0] for k in corner_keys}) > 1 or any(k in front for k in corner_keys):
+                    refined.extend((gamma, sub) for sub in _split_cell(cell))
+            cells = refined
 
-                totals = optimizer.route_totals(order_multi, prio_on_time=False)
-                performance.append((totals["t_actual"], totals["cost"], totals["co2"]))
-                weights.append((w_t, w_c, w_z))
-                routes.append(order_multi)
-                gammas_used.append(gamma)
+'''
+Online non-dominated archive for the sweep, so memory follows the size of the front instead of the number of
+candidates. Each candidate is checked against the current front when it arrives (one vectorized comparison):
+a dominated candidate is written to the csv writer right away as "no" and its route is dropped, a candidate
+that gets on the front evicts (and writes) the members it dominates. Dominance is transitive, so what is left
+at the end is exactly the front pareto_index would find over all candidates, in arrival order; identical
+points do not dominate each other. A candidate with the same route and gamma as any earlier candidate is a
+duplicate: it is counted but not kept or written, so every (route, gamma) gets one csv row whatever the arrival
+order. The seen set holds a 16 byte route_key per distinct route and gamma, not per candidate.
+close() writes the front as "yes". Front routes are kept as int32 arrays.
+'''
+class ParetoArchive:
+    def __init__(self, writer=None, timestamp=None):
+        self.writer = writer
+        self.timestamp = timestamp or datetime.now().isoformat()
+        self.points = np.empty((0, 3))          # time_h, cost, co2 of the front members
+        self.params = np.empty((0, 4))          # gamma, w_time, w_cost, w_co2
+        self.routes = []
+        self.seen = set()                       # (route_key, gamma) of every candidate so far
+        self.candidates = 0
 
- 
-    non_dominated = set(pareto_index(performance))
+    def _write(self, point, params, non_dominated):
+        if self.writer is not None:
+            gamma, w_t, w_c, w_z = params
+            self.writer.writerow([self.timestamp, gamma, w_t, w_c, w_z, *point, "yes" if non_dominated else "no"])
 
-    if save_csv:
-        path = "pareto_results.csv"
-        with open(path, "w", newline="") as f:
+    # True when the candidate is on the front (so far)
+    def add(self, perf, gamma, weights, route) -> bool:
+        self.candidates += 1
+        key = (route_key(route), round(float(gamma), 6))
+        if key in self.seen:
+            count("pareto_duplicates")
+            return False
+        self.seen.add(key)
+        p = np.asarray(perf, dtype=np.float64)
+        params = [gamma, *weights]
+        F = self.points
+        differs = (F != p).any(axis=1)
+        if ((F <= p).all(axis=1) & differs).any():
+            self._write(p.tolist(), params, False)
+            return False
+
+        evict = (p <= F).all(axis=1) & differs
+        if evict.any():
+            for k in np.flatnonzero(evict).tolist():
+                self._write(F[k].tolist(), self.params[k].tolist(), False)
+            keep = ~evict
+            self.points, self.params = F[keep], self.params[keep]
+            self.routes = [r for r, kept in zip(self.routes, keep.tolist()) if kept]
+            count("pareto_evicted", int(evict.sum()))
+
+        self.points = np.vstack((self.points, p))
+        self.params = np.vstack((self.params, params))
+        self.routes.append(np.asarray(route, dtype=np.int32))
+        return True
+
+    def close(self):
+        for point, params in zip(self.points.tolist(), self.params.tolist()):
+            self._write(point, params, True)
+
+    # the front in the old result format (performance tuples, weights, routes, gammas) plus the candidate count
+    def result(self) -> dict:
+        return {
+            "performance": [tuple(p) for p in self.points.tolist()],
+            "weights": [tuple(w) for w in self.params[:, 1:].tolist()],
+            "routes": list(self.routes),
+            "gammas": self.params[:, 0].tolist(),
+            "candidates": self.candidates
+        }
+
+
+# short digest of a route, to tell routes apart without keeping the permutation
+def route_key(order) -> bytes:
+    return hashlib.blake2b(np.asarray(order, dtype=np.int32).tobytes(), digest_size=16).digest()
+
+# adaptive=True samples the weights with adaptive_combos (n_steps is then the finest resolution) instead of
+# the full grid, max_evals bounds its number of optimizer calls. Candidates go through a ParetoArchive as they
+# come in, dominated ones are written to pareto_results.csv straight away. Returns the non-dominated candidates
+# (routes as int32 arrays) and the number of candidates
+def evaluate_pareto_routes(optimizer, n_steps=12, gammas=(0.2, 0.6, 1.0, 1.6), save_csv=True, workers=None,
+                           adaptive=False, max_evals=None):
+    # the sweep sets multi_weights per combination, so it runs on a copy and the caller's optimizer (shared by
+    # the requests of the service) keeps its weights; the copy shares the matrix and reference totals.
+    # Exact orders do not depend on gamma and cost a Held-Karp run per combination, the sweep uses the greedy
+    _check_steps(n_steps)
+    optimizer._star_refs()
+    optimizer = copy.copy(optimizer)
+    optimizer.exact_stops = 0
+
+    if adaptive:
+        results = adaptive_combos(optimizer, n_steps, gammas, max_evals, workers)
+    else:
+        results = evaluate_combos(optimizer, weight_grid(n_steps, gammas), workers)
+
+    path = "pareto_results.csv"
+    with span("pareto"), (open(path, "w", newline="") if save_csv else nullcontext()) as f:
+        writer = None
+        if save_csv:
             writer = csv.writer(f)
             writer.writerow([
                 "timestamp", "gamma", "w_time", "w_cost", "w_co2",
                 "time_h", "cost_NOK", "co2_g", "non_dominated"
             ])
-            now = datetime.now().isoformat()
-            for i, (t, c, z) in enumerate(performance):
-                writer.writerow([
-                    now, gammas_used[i],
-                    *weights[i],
-                    t, c, z,
-                    "yes" if i in non_dominated else "no"
-                ])
-        print(f"Saved Pareto results to {path}")
+        archive = ParetoArchive(writer)
+
+        # duplicates (same route and gamma as an earlier candidate) are skipped by the archive
+        for (gamma, w_t, w_c, w_z), order_multi, perf in results:
+            archive.add(perf, gamma, (w_t, w_c, w_z), order_multi)
+
+        archive.close()
+        count("candidates", archive.candidates)
 
-    return {
-        "performance": performance,
-        "weights": weights,
-        "routes": routes,
-        "gammas": gammas_used
-    }
\ No newline at end of file
+    if save_csv:
+        print(f"Saved Pareto results to {path}")
+    return archive.result()
@@ -0,0 +1,157 @@
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import matplotlib.image as mpimg
+import matplotlib.patheffects as path_effects
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from courier_route_optimization.constants import MAP_REGION_KM, MAP_WIDTH_IN, MAP_DPI, MAP_MAX_LABELS
+from courier_route_optimization.instrument import span, count
+from courier_route_optimization.parallel import ordered_map
+
+'''
+Headless route maps for batch use. Building a high resolution Basemap takes seconds (coastline clipping), so it
+is done once per map region: the coastline / land / water layer is drawn once, kept as a raster and cached in
+memory per process and, with cache_dir, as a png shared by processes and runs. A route is then drawn on top of
+that raster on a plain Agg figure (no pyplot, no display needed) and saved as png in milliseconds.
+A region is a box around the depot (the first stop) with a half height of MAP_REGION_KM grown in steps of sqrt(2)
+until every stop fits, so the routes of one depot share a few backgrounds. The route is projected with the same spherical
+Mercator as the Basemap background (projection "merc"), so it lines up with the raster without a Basemap.
+'''
+
+R_SPHERE = 6370997.0        # Basemap's default sphere radius, m
+KM_PER_DEG_LAT = 111.195
+
+_backgrounds = {}           # region key -> background raster, per process
+
+
+def mercator(lon, lat):
+    lon, lat = np.radians(np.asarray(lon, dtype=np.float64)), np.radians(np.asarray(lat, dtype=np.float64))
+    return R_SPHERE * lon, R_SPHERE * np.log(np.tan(np.pi / 4 + lat / 2))
+
+
+# map region of a route: bounds, projected extent, figure size and the cache key
+def map_region(lat, lon) -> dict:
+    lat, lon = np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64)
+    lat0, lon0 = round(float(lat[0]), 4), round(float(lon[0]), 4)
+    coslat = max(math.cos(math.radians(lat0)), 0.05)
+    # largest offset from the depot in degrees of latitude, 10% margin so stops are not on the edge
+    reach = 1.1 * max(float(np.abs(lat - lat0).max()), float(np.abs(lon - lon0).max()) * coslat, 1e-9)
+    base = MAP_REGION_KM / KM_PER_DEG_LAT
+    level = max(0, math.ceil(2 * math.log2(reach / base)))
+    half_lat = base * 2 ** (level / 2)
+    half_lon = min(half_lat / coslat, 180.0)
+    bounds = (max(lat0 - half_lat, -85.0), min(lat0 + half_lat, 85.0), lon0 - half_lon, lon0 + half_lon)
+
+    (x0, x1), (y0, y1) = mercator([bounds[2], bounds[3]], [bounds[0], bounds[1]])
+    return {"key": f"{lat0:.4f}_{lon0:.4f}_{level}", "bounds": bounds,
+            "extent": (float(x0), float(x1), float(y0), float(y1)),
+            "figsize": (MAP_WIDTH_IN, MAP_WIDTH_IN * (y1 - y0) / (x1 - x0))}
+
+
+# coastline / land / water raster of a region, drawn with Basemap (imported only here) on a headless figure
+def _draw_background(region, res):
+    from mpl_toolkits.basemap import Basemap
+    lat_min, lat_max, lon_min, lon_max = region["bounds"]
+    fig = Figure(figsize=region["figsize"], dpi=MAP_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    m = Basemap(projection="merc", resolution=res, llcrnrlat=lat_min, urcrnrlat=lat_max, llcrnrlon=lon_min,
+                urcrnrlon=lon_max, rsphere=R_SPHERE, fix_aspect=False, ax=ax)
+    m.drawmapboundary(fill_color="lightblue")
+    m.fillcontinents(color="beige", lake_color="lightblue")
+    m.drawcoastlines()
+    m.drawcountries()
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())[..., :3].copy()
+
+
+def background(region, res="h", cache_dir=None):
+    key = f"{region['key']}_{res}_{MAP_WIDTH_IN}_{MAP_DPI}"
+    image = _backgrounds.get(key)
+    if image is not None:
+        count("map_background_hits")
+        return image
+
+    path = Path(cache_dir) / f"map_{key}.png" if cache_dir else None
+    if path is not None and path.exists():
+        image = mpimg.imread(path)
+    else:
+        with span("map_background", res=res):
+            image = _draw_background(region, res)
+        if path is not None:
+            # written under a temporary name first, so a process reading the cache never sees half a file
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".png")
+            os.close(fd)
+            mpimg.imsave(tmp, image)
+            os.replace(tmp, path)
+    _backgrounds[key] = image
+    return image
+
+
+# draws the route over its region's background on fig (one axes filling the figure)
+def draw_route(fig, lat, lon, region, res="h", cache_dir=None, title="Optimized Delivery Route"):
+    x0, x1, y0, y1 = region["extent"]
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.imshow(background(region, res, cache_dir), extent=(x0, x1, y0, y1), aspect="auto",
+              interpolation="nearest", zorder=0)
+
+    x, y = mercator(lon, lat)
+    ax.plot(x, y, color="darkred", linewidth=2, zorder=4)
+    ax.scatter(x, y, c="red", s=70, edgecolors="black", linewidth=0.7, zorder=5)
+    if len(x) <= MAP_MAX_LABELS:
+        stroke = [path_effects.withStroke(linewidth=3, foreground="white")]
+        for i, (xx, yy) in enumerate(zip(x.tolist(), y.tolist()), start=1):
+            ax.text(xx, yy + 0.015 * (y1 - y0), "1" if i == len(x) else str(i), fontsize=10, fontweight="bold",
+                    color="black", ha="center", va="center", zorder=6, path_effects=stroke)
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    if title:
+        fig.text(0.5, 0.99, title, ha="center", va="top", fontsize=12,
+                 path_effects=[path_effects.withStroke(linewidth=3, foreground="white")])
+    return ax
+
+
+# renders one route (a RouteResult, depot first) to out_path; the format follows the suffix, png by default
+def render_route(route, out_path, res="h", cache_dir=None, title="Optimized Delivery Route"):
+    region = map_region(route.lat, route.lon)
+    fig = Figure(figsize=region["figsize"], dpi=MAP_DPI)
+    FigureCanvasAgg(fig)
+    draw_route(fig, route.lat, route.lon, region, res, cache_dir, title)
+    fig.savefig(out_path, dpi=MAP_DPI)
+    return out_path
+
+
+def _render_task(task):
+    return render_route(*task)
+
+
+'''
+Renders many routes, jobs are (route, out_path) pairs. With workers > 1 the routes are rendered over a process
+pool: the background of every region is drawn once in this process first and the workers read it from the
+cache directory (a temporary one when cache_dir is None), so no region is drawn twice.
+'''
+def render_routes(jobs, res="h", cache_dir=None, workers=1, title="Optimized Delivery Route") -> list:
+    jobs = list(jobs)
+    with span("render", routes=len(jobs)):
+        if workers <= 1 or len(jobs) <= 1:
+            return [render_route(route, path, res, cache_dir, title) for route, path in jobs]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir = cache_dir or tmp
+            regions = {}
+            for route, _ in jobs:
+                region = map_region(route.lat, route.lon)
+                regions.setdefault(region["key"], region)
+            for region in regions.values():
+                background(region, res, cache_dir)
+
+            tasks = ((route, path, res, cache_dir, title) for route, path in jobs)
+            with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+                return list(ordered_map(pool, _render_task, tasks))
@@ -1,69 +1,36 @@
 import numpy as np 
 import matplotlib.pyplot as plt
-import matplotlib.patheffects as path_effects
-import pandas as pd
+import csv
 from pathlib import Path
-from mpl_toolkits.basemap import Basemap
+from courier_route_optimization.constants import MAP_DPI
+from courier_route_optimization.plots.maps import map_region, draw_route
 
 #https://gis.stackexchange.com/questions/364584/how-to-make-graphs-of-latitude-and-longitude-and-generating-summary-table
 
 # This code was modified from AI with the prompt:
 # 1. Make it so the map is zoomed in on the locations in the file
 # 2. Add dots to the delivery points
-def plot_route(path, save=False, res='h'):
-
-    route = pd.read_csv(Path(path))
-
-    lat = route['latitude'].values
-    lon = route['longitude'].values
-
-    pad = 0.002  # smaller for closer zoom
-    llcrnrlat, urcrnrlat = lat.min() - pad, lat.max() + pad
-    llcrnrlon, urcrnrlon = lon.min() - pad, lon.max() + pad 
-
-
-    fig = plt.figure(figsize=(10, 8))
-    m = Basemap(projection="merc", resolution=res,
-                llcrnrlat=llcrnrlat, urcrnrlat=urcrnrlat,
-                llcrnrlon=llcrnrlon, urcrnrlon=urcrnrlon)
-
-    # Draw base features
-    m.drawcoastlines()
-    m.drawcountries()
-    m.drawmapboundary(fill_color="lightblue")
-    m.fillcontinents(color="beige", lake_color="lightblue")
-    m.drawparallels(range(int(llcrnrlat), int(urcrnrlat) + 1, 1), labels=[1,0,0,0])
-    m.drawmeridians(range(int(llcrnrlon), int(urcrnrlon) + 1, 1), labels=[0,0,0,1])
-
-    x, y = m(lon, lat)
-
-    m.plot(lon, lat, latlon=True, color="darkred", linewidth=2, zorder=4)
-    m.scatter(lon, lat, latlon=True, c="red", s=70, edgecolors="black", linewidth=0.7, zorder=5)
-
-    for i, (xx, yy) in enumerate(zip(x, y), start=1):
-    
-        label = "1" if i == len(x) else str(i)
-        
-        plt.text(
-            xx, yy + 300, label,
-            fontsize=10, fontweight="bold", color="black",
-            ha="center", va="center", zorder=6,
-            path_effects=[path_effects.withStroke(linewidth=3, foreground="white")]
-        )
-
-    plt.title("Optimized Delivery Route (Oslo area)")
-    plt.show()
+# Interactive view of a route. The map itself comes from plots.maps: the coastline layer is drawn once per
+# region and cached, only the route is drawn per call. With save the figure is written as a png before showing
+# route is the RouteResult from route_builder, or the path of a saved route csv
+def plot_route(route, save=False, res='h', cache_dir=None, out_path="optimized_route.png"):
+
+    if isinstance(route, (str, Path)):
+        with open(Path(route), newline="") as f:
+            rows = list(csv.DictReader(f))
+        lat = np.array([float(r['latitude']) for r in rows])
+        lon = np.array([float(r['longitude']) for r in rows])
+    else:
+        lat, lon = route.lat, route.lon
+
+    region = map_region(lat, lon)
+    fig = plt.figure(figsize=region["figsize"], dpi=MAP_DPI)
+    draw_route(fig, lat, lon, region, res, cache_dir, title="Optimized Delivery Route (Oslo area)")
 
     if save:
-    
-        fig.savefig(
-                "optimized_route.eps",
-                format="eps",
-                bbox_inches='tight',   
-                pad_inches=0.05,       
-                dpi=300                
-            )
-        plt.close(fig)             
+        fig.savefig(out_path, dpi=MAP_DPI)
+    plt.show()
+    plt.close(fig)
 
 
 # not used, gpt generated for testing some plotting
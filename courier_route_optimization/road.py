@@ -0,0 +1,324 @@
+import csv
+import heapq
+import math
+import os
+from pathlib import Path
+import numpy as np
+from courier_route_optimization.constants import MATRIX_FLOAT32_STOPS, MATRIX_LAZY_STOPS, ROAD_WITNESS_SETTLED
+from courier_route_optimization.distance import DistanceMatrix
+from courier_route_optimization.instrument import span, count
+from courier_route_optimization.spatial import SphereKDTree, unit_vectors
+from courier_route_optimization.utils import haversine_np
+
+'''
+Road-network distances (km along the roads) from a local graph, used by RouteOptimizer(road_network=...) in
+place of haversine so legs across rivers and fjords get their real length and the route_builder ETAs follow.
+The graph directory holds two csv files, e.g. extracted from OpenStreetMap:
+    nodes.csv   id, latitude, longitude
+    edges.csv   u, v, length (metres), oneway (optional: 1/true/yes, else the edge is driven both ways)
+Preprocessing builds a contraction hierarchy: nodes are contracted in order of importance (edge difference),
+adding shortcut edges where the only shortest path ran through the contracted node, and every edge is kept
+in CSR arrays pointing upwards (forward) or downwards (backward) in the order. It is cached in road_ch.npz
+next to the csv files and rebuilt when they change.
+Travel matrices are many-to-many bucket queries: an upward backward search from every target stores
+(target, distance) in a bucket on every node it settles, an upward forward search from every source scans the
+buckets of the nodes it settles, and the shortest meeting point gives the distance. Locations are snapped to
+the nearest graph node and the straight distance to it is added at both ends. Locations that snap to the same
+node are the straight distance apart (0 for the same location), the graph has nothing finer between them and
+the detour over the node would be longer. Oneway streets make the matrix asymmetric, D[a, b] is the distance
+a -> b. Location pairs without a road connection raise ValueError.
+'''
+
+CACHE_NAME = "road_ch.npz"
+
+
+def _truthy(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "-1")
+
+
+# node ids, lat, lon and directed edges (tail, head, km) from the graph csv files, both directions for two-way edges
+def read_road_graph(path: Path):
+    path = Path(path)
+    with open(path / "nodes.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    try:
+        ids = np.array([int(r["id"]) for r in rows], dtype=np.int64)
+        lat = np.array([float(r["latitude"]) for r in rows])
+        lon = np.array([float(r["longitude"]) for r in rows])
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"nodes.csv needs id, latitude and longitude columns: {e}") from e
+
+    order = np.argsort(ids)
+    ids, lat, lon = ids[order], lat[order], lon[order]
+    if len(ids) == 0 or np.any(ids[1:] == ids[:-1]):
+        raise ValueError("nodes.csv is empty or has duplicate node ids")
+
+    with open(path / "edges.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    try:
+        u = np.array([int(r["u"]) for r in rows], dtype=np.int64)
+        v = np.array([int(r["v"]) for r in rows], dtype=np.int64)
+        km = np.array([float(r["length"]) for r in rows]) / 1000.0
+        oneway = np.array([_truthy(r.get("oneway") or "") for r in rows], dtype=bool)
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"edges.csv needs u, v and length columns: {e}") from e
+    if np.any(~np.isfinite(km)) or np.any(km < 0):
+        raise ValueError("edges.csv has negative or missing lengths")
+
+    tail = np.searchsorted(ids, u)
+    head = np.searchsorted(ids, v)
+    known = (tail < len(ids)) & (head < len(ids))
+    known[known] &= (ids[tail[known]] == u[known]) & (ids[head[known]] == v[known])
+    if not known.all():
+        raise ValueError(f"edges.csv refers to {int((~known).sum())} edges with unknown node ids")
+
+    two_way = ~oneway
+    tail, head, km = (np.concatenate((tail, head[two_way])), np.concatenate((head, tail[two_way])),
+                      np.concatenate((km, km[two_way])))
+    return ids, lat, lon, tail, head, km
+
+
+# CSR arrays (indptr, indices, weights) of the edges grouped by tail
+def _csr(n, tail, head, weight):
+    order = np.lexsort((head, tail))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tail, minlength=n), out=indptr[1:])
+    return indptr, head[order].astype(np.int64), weight[order].astype(np.float64)
+
+
+'''
+Contraction hierarchy over n nodes and directed edges. Returns the upward forward edges (u -> w with w
+contracted after u) and the upward backward edges (stored at w for an edge u -> w with u contracted after w),
+each as (tail, head, km) arrays, shortcuts included.
+Priority of a node = shortcuts it needs - edges it removes + contracted neighbours, updated lazily when popped.
+Witness searches stop after ROAD_WITNESS_SETTLED nodes; a shortcut that could not be disproved is added,
+which costs query time but never correctness.
+'''
+def contract(n, tail, head, km, witness_settled=ROAD_WITNESS_SETTLED):
+    out_adj = [{} for _ in range(n)]
+    in_adj = [{} for _ in range(n)]
+    for u, w, d in zip(tail.tolist(), head.tolist(), km.tolist()):
+        if u != w and d < out_adj[u].get(w, math.inf):     # parallel edges keep the shortest, loops are dropped
+            out_adj[u][w] = d
+            in_adj[w][u] = d
+
+    contracted = bytearray(n)
+    deleted_neighbours = [0] * n
+    up_fwd, up_bwd = [], []                 # (tail, head, km) of the upward edges
+
+    # shortest distances from source to the targets without passing through skip, over uncontracted nodes
+    def witness(source, skip, targets, limit, pop=heapq.heappop, push=heapq.heappush, inf=math.inf):
+        dist = {source: 0.0, skip: -1.0}    # skip can never be improved on
+        get = dist.get
+        heap = [(0.0, source)]
+        left = set(targets)
+        settled = 0
+        while heap and left and settled < witness_settled:
+            d, x = pop(heap)
+            if d > dist[x]:
+                continue
+            if d > limit:
+                break
+            left.discard(x)
+            settled += 1
+            for y, w in out_adj[x].items():
+                nd = d + w
+                if nd < get(y, inf):
+                    dist[y] = nd
+                    push(heap, (nd, y))
+        return dist
+
+    def shortcuts(v):
+        outs = out_adj[v]
+        found = []
+        if not outs:
+            return found
+        max_out = max(outs.values())
+        for u, d_uv in in_adj[v].items():
+            targets = [w for w in outs if w != u]
+            if not targets:
+                continue
+            dist = witness(u, v, targets, d_uv + max_out)
+            for w in targets:
+                via = d_uv + outs[w]
+                if dist.get(w, math.inf) > via:
+                    found.append((u, w, via))
+        return found
+
+    def priority(v, found):
+        return len(found) - len(in_adj[v]) - len(out_adj[v]) + deleted_neighbours[v]
+
+    heap = [(priority(v, shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(heap)
+    while heap:
+        _, v = heapq.heappop(heap)
+        if contracted[v]:
+            continue
+        found = shortcuts(v)
+        p = priority(v, found)
+        if heap and p > heap[0][0]:
+            heapq.heappush(heap, (p, v))
+            continue
+
+        for u, w, d in found:
+            if d < out_adj[u].get(w, math.inf):
+                out_adj[u][w] = d
+                in_adj[w][u] = d
+        for w, d in out_adj[v].items():
+            up_fwd.append((v, w, d))
+            del in_adj[w][v]
+        for u, d in in_adj[v].items():
+            up_bwd.append((v, u, d))
+            del out_adj[u][v]
+        for x in out_adj[v].keys() | in_adj[v].keys():
+            deleted_neighbours[x] += 1
+        out_adj[v], in_adj[v] = {}, {}
+        contracted[v] = 1
+
+    out = []
+    for edges in (up_fwd, up_bwd):
+        edges = np.array(edges, dtype=np.float64).reshape(-1, 3)
+        out.append((edges[:, 0].astype(np.int64), edges[:, 1].astype(np.int64), edges[:, 2]))
+    return out
+
+
+class RoadNetwork:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._tree = None
+        with span("road_load"):
+            self._load()
+
+    # sizes and modification times of the csv files, the cache is rebuilt when they change
+    def _source(self) -> np.ndarray:
+        stats = [os.stat(self.path / name) for name in ("nodes.csv", "edges.csv")]
+        return np.array([x for s in stats for x in (s.st_size, s.st_mtime_ns)], dtype=np.int64)
+
+    def _load(self):
+        source = self._source()
+        cache = self.path / CACHE_NAME
+        if cache.exists():
+            with np.load(cache) as data:
+                if np.array_equal(data["source"], source):
+                    self._set(**{k: data[k] for k in data.files if k != "source"})
+                    return
+
+        ids, lat, lon, tail, head, km = read_road_graph(self.path)
+        with span("contract", nodes=len(ids), edges=len(tail)):
+            (ft, fh, fd), (bt, bh, bd) = contract(len(ids), tail, head, km)
+        fwd_ptr, fwd_idx, fwd_km = _csr(len(ids), ft, fh, fd)
+        bwd_ptr, bwd_idx, bwd_km = _csr(len(ids), bt, bh, bd)
+        arrays = dict(ids=ids, lat=lat, lon=lon, fwd_ptr=fwd_ptr, fwd_idx=fwd_idx, fwd_km=fwd_km,
+                      bwd_ptr=bwd_ptr, bwd_idx=bwd_idx, bwd_km=bwd_km)
+        tmp = self.path / "road_ch.tmp.npz"
+        np.savez(tmp, source=source, **arrays)
+        os.replace(tmp, cache)
+        self._set(**arrays)
+
+    def _set(self, ids, lat, lon, fwd_ptr, fwd_idx, fwd_km, bwd_ptr, bwd_idx, bwd_km):
+        self.ids, self.lat, self.lon = ids, lat, lon
+        # plain lists, the searches index them one element at a time
+        self._fwd = (fwd_ptr.tolist(), fwd_idx.tolist(), fwd_km.tolist())
+        self._bwd = (bwd_ptr.tolist(), bwd_idx.tolist(), bwd_km.tolist())
+
+    def __len__(self):
+        return len(self.ids)
+
+    # nearest graph node of every location and the straight distance to it (km)
+    def snap(self, lat, lon):
+        if self._tree is None:
+            self._tree = SphereKDTree(unit_vectors(self.lat, self.lon))
+        q = unit_vectors(lat, lon)
+        nodes = np.array([self._tree.nearest(p) for p in q], dtype=np.int64)
+        return nodes, haversine_np(lat, lon, self.lat[nodes], self.lon[nodes])
+
+    # every node settled by a Dijkstra search from source over the upward edges, with its distance
+    @staticmethod
+    def _upward(source, graph):
+        ptr, idx, km = graph
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        nodes, dists = [], []
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            nodes.append(x)
+            dists.append(d)
+            for e in range(ptr[x], ptr[x + 1]):
+                y, nd = idx[e], d + km[e]
+                if nd < dist.get(y, math.inf):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return np.array(nodes, dtype=np.int64), np.array(dists)
+
+    # road distances (km) between graph nodes, sources x targets, inf where there is no route
+    def node_matrix(self, sources, targets) -> np.ndarray:
+        b_node, b_target, b_dist = [], [], []
+        for j, t in enumerate(targets):
+            nodes, dists = self._upward(int(t), self._bwd)
+            b_node.append(nodes)
+            b_target.append(np.full(len(nodes), j, dtype=np.int64))
+            b_dist.append(dists)
+        b_node = np.concatenate(b_node)
+        order = np.argsort(b_node, kind="stable")
+        b_target = np.concatenate(b_target)[order]
+        b_dist = np.concatenate(b_dist)[order]
+        bucket_ptr = np.searchsorted(b_node[order], np.arange(len(self.ids) + 1))
+        count("bucket_entries", len(b_node))
+
+        out = np.full((len(sources), len(targets)), np.inf)
+        for i, s in enumerate(sources):
+            nodes, dists = self._upward(int(s), self._fwd)
+            lo, hi = bucket_ptr[nodes], bucket_ptr[nodes + 1]
+            sizes = hi - lo
+            # flat indices of every bucket entry of the settled nodes
+            entries = np.repeat(lo - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+            np.minimum.at(out[i], b_target[entries], np.repeat(dists, sizes) + b_dist[entries])
+            count("bucket_scans", len(entries))
+        return out
+
+    # road distances between the locations: snap, many-to-many over the distinct nodes, add the snap distances.
+    # Pairs on the same node get the straight distance, for the matrix and distance_np alike
+    def distances(self, lat1, lon1, lat2, lon2) -> np.ndarray:
+        lat1, lon1, lat2, lon2 = (np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2))
+        s_nodes, s_snap = self.snap(lat1, lon1)
+        t_nodes, t_snap = self.snap(lat2, lon2)
+        s_unique, s_inv = np.unique(s_nodes, return_inverse=True)
+        t_unique, t_inv = np.unique(t_nodes, return_inverse=True)
+        road = self.node_matrix(s_unique, t_unique)
+        d = s_snap[:, None] + road[s_inv][:, t_inv] + t_snap[None, :]
+        a, b = np.nonzero(s_nodes[:, None] == t_nodes[None, :])
+        d[a, b] = haversine_np(lat1[a], lon1[a], lat2[b], lon2[b])
+        return d
+
+    # drop-in for utils.haversine_np on scalar or 1-d coordinates (used for stops added to a LiveRoute)
+    def distance_np(self, lat1, lon1, lat2, lon2):
+        shape = np.broadcast(lat1, lon1, lat2, lon2).shape
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                                       for x in (lat1, lon1, lat2, lon2)))
+        a = np.unique(np.column_stack((lat1, lon1)), axis=0, return_inverse=True)
+        b = np.unique(np.column_stack((lat2, lon2)), axis=0, return_inverse=True)
+        d = self.distances(a[0][:, 0], a[0][:, 1], b[0][:, 0], b[0][:, 1])[a[1].ravel(), b[1].ravel()]
+        return d.reshape(shape)
+
+    '''
+    Travel matrix over the locations (index 0 = depot, k+1 = delivery k) as a dense DistanceMatrix, float32 from
+    MATRIX_FLOAT32_STOPS like build_distance_matrix. A road matrix is always computed in full, so from
+    MATRIX_LAZY_STOPS locations it raises ValueError, as it does when some pair has no road connection.
+    '''
+    def matrix(self, lat, lon) -> DistanceMatrix:
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        n = len(lat)
+        if n >= MATRIX_LAZY_STOPS:
+            raise ValueError(f"Road distances need a full matrix, use fewer than {MATRIX_LAZY_STOPS} locations")
+
+        with span("road_matrix", locations=n):
+            d = self.distances(lat, lon, lat, lon)
+        missing = ~np.isfinite(d)
+        if missing.any():
+            a, b = np.argwhere(missing)[0]
+            raise ValueError(f"No road connection for {int(missing.sum())} location pairs, e.g. matrix index {a} -> {b} "
+                             f"(0 = depot); the road graph is not connected there")
+        return DistanceMatrix(d.astype(np.float32) if n >= MATRIX_FLOAT32_STOPS else d)
@@ -1,11 +1,24 @@
-
-
-from datetime import datetime, timedelta
-from courier_route_optimization.constants import Mode, MODE_PARAMS, URGENCY_MULT, EARTH_RADIUS_KM
-from courier_route_optimization.utils import normalize, haversine
+from __future__ import annotations
+
+from datetime import datetime
+from courier_route_optimization.constants import (Mode, MODE_PARAMS, EARTH_RADIUS_KM, MATRIX_BLOCK_ROWS,
+                                                  SPATIAL_INDEX_MIN_STOPS, SPATIAL_CANDIDATES, LOCAL_SEARCH_NEIGHBOURS,
+                                                  BATCH_CELLS, PLANAR_MAX_ERROR, EXACT_MAX_STOPS, EXACT_MAX_BYTES)
+from courier_route_optimization.deliveries import DeliveryTable, as_table
+from courier_route_optimization.distance import build_distance_matrix, PlanarProjection, DISTANCE_BACKENDS
+from courier_route_optimization.instrument import span, count
+from courier_route_optimization.spatial import SphereKDTree, unit_vectors
+from courier_route_optimization.local_search import improve_tour
+from courier_route_optimization.exact import held_karp
+from courier_route_optimization.live import LiveRoute
+from courier_route_optimization.windows import schedule, fit_windows, relocate_windows, hour_of_day
+from courier_route_optimization.route_result import RouteResult
+from courier_route_optimization.utils import haversine_np
+import numpy as np
 import math
 
 
+ORDER_KINDS = ("time", "co2", "cost", "multi")   # same order as the closest_route_order return tuple
 
 '''
 Class that optimizes the courier route based on depot and deliveries location, delivery mode and objective
@@ -13,13 +26,70 @@ Applies cost function to determien the route order based on desired urgency weig
 '''
 
 class RouteOptimizer:
-    def __init__(self, depot: dict, deliveries: list[dict], mode: Mode, objective: str, multi_weights: dict):
+    def __init__(self, depot: dict, deliveries: DeliveryTable | list[dict], mode: Mode, objective: str, multi_weights: dict,
+                 spatial_index=None, distance_cache=None, distance="haversine", road_network=None, start_time=None,
+                 exact_stops=None):
         self.depot = depot                  #name, lat, lon
-        self.deliveries = deliveries        #customer, lon, lat, weight, prio
+        self.deliveries = as_table(deliveries)  #customer, lon, lat, weight, prio (lists of dicts are converted)
         self.mode = mode                    #car|walk|bicycle 
         self.objective = objective          #time|cost|co2
         self.multi_weights = multi_weights  # weights for multi-objective scoring
-
+        self.spatial_index = spatial_index  # True/False, None picks it from the number of deliveries
+        self.distance_cache = distance_cache  # DistanceCache to read/store the distances in, None computes them
+        self.distance = distance            # haversine|planar|auto, see distance.PlanarProjection
+        self.road_network = road_network    # RoadNetwork (road.py), replaces the distance backend when given
+        self.start_time = start_time        # departure, delivery windows are clock times on its day (None = now)
+        # up to this many deliveries the orders are exact (Held-Karp), 0 always uses the greedy
+        self.exact_stops = EXACT_MAX_STOPS if exact_stops is None else exact_stops
+        self.projection = self._projection(distance) if road_network is None else None
+        self.distance_np = haversine_np if self.projection is None else self.projection.distance_np
+        if road_network is not None:
+            self.distance_np = road_network.distance_np
+            # the spatial index finds the nearest stops by straight distance, not by road
+            if spatial_index is None:
+                self.spatial_index = False
+        self._matrix = None                 # depot + deliveries distances, built on first use
+        self._prio = None                   # URGENCY_MULT of every delivery
+        self._refs = None                   # star reference totals for route_scores
+
+    # Distance matrix over depot (index 0) and deliveries (index k+1), computed once and shared by all methods
+    @property
+    def distance_matrix(self):
+        if self._matrix is None:
+            lat = np.concatenate(([self.depot["lat"]], self.deliveries.lat))
+            lon = np.concatenate(([self.depot["lon"]], self.deliveries.lon))
+            with span("distance", locations=len(lat)):
+                if self.road_network is not None:
+                    self._matrix = self.road_network.matrix(lat, lon)
+                # the cache holds haversine distances, planar ones are cheaper to compute than to read
+                elif self.distance_cache is not None and self.projection is None:
+                    self._matrix = self.distance_cache.matrix(lat, lon)
+                else:
+                    self._matrix = build_distance_matrix(lat, lon, projection=self.projection)
+        return self._matrix
+
+    # "auto" projects when the error bound over the depot and deliveries is within PLANAR_MAX_ERROR
+    def _projection(self, distance):
+        if distance not in DISTANCE_BACKENDS:
+            raise ValueError(f"Unknown distance: {distance} (use one of {DISTANCE_BACKENDS})")
+        if distance == "haversine":
+            return None
+        projection = PlanarProjection(np.concatenate(([self.depot["lat"]], self.deliveries.lat)),
+                                      np.concatenate(([self.depot["lon"]], self.deliveries.lon)))
+        if distance == "planar" or projection.error_bound <= PLANAR_MAX_ERROR:
+            return projection
+        return None
+
+    # Points for the spatial index: the nearest point in it is the nearest by the matrix distance
+    def _spatial_points(self, lat, lon) -> np.ndarray:
+        return unit_vectors(lat, lon) if self.projection is None else self.projection.xy(lat, lon)
+
+    # Priority multiplier (URGENCY_MULT) of every delivery as an array
+    @property
+    def priority_weights(self) -> np.ndarray:
+        if self._prio is None:
+            self._prio = self.deliveries.urgency()
+        return self._prio
     
     def _delivery_metrics(self, distance: float):
         d_mode = MODE_PARAMS[self.mode]    
@@ -29,112 +99,273 @@ class RouteOptimizer:
         
         return d_time, d_cost, d_co2
 
-    # Determines the clostest delivery points by km and weights 
-    def closest_route_order(self, multiobj=False, prio_gamma=0.6):
-        
-        order_time = []                                             # List of deliveris determined by time objective
-        remaining_deliveries = set(range(len(self.deliveries)))     # set of remaining objectives
-        cur_lat, cur_lon = self.depot["lat"], self.depot["lon"]     # Coordinates start
-
-        
-        while remaining_deliveries:
-            # determine distances for all the remaining objectives
-            distances = {
-                k: haversine(cur_lat, cur_lon, self.deliveries[k]["lat"], self.deliveries[k]["lon"]) for k in remaining_deliveries}
-            d_max = max(distances.values()) or 0.0001  # avoid zero div
+    # Determines the clostest delivery points by km and weights
+    # orders picks which of time/co2/cost/multi to compute (default: time, co2 and cost, plus multi if multiobj),
+    # orders that are not asked for come back as empty lists. With delivery windows late stops are moved to
+    # where they are on time (windows.fit_windows), start_time defaults to self.start_time.
+    # Up to exact_stops deliveries (and no windows) the orders are the optimal tours for each order's objective
+    # as in route_totals (see _exact_orders), the greedy and prio_gamma are then not used
+    def closest_route_order(self, multiobj=False, prio_gamma=0.6, orders=None, start_time=None):
+        if orders is None:
+            orders = ORDER_KINDS if multiobj else ORDER_KINDS[:3]
+        unknown = set(orders) - set(ORDER_KINDS)
+        if unknown:
+            raise ValueError(f"Unknown route order(s): {unknown}")
+
+        result = {kind: [] for kind in ORDER_KINDS}
+        if len(self.deliveries):
+            kinds = tuple(kind for kind in ORDER_KINDS if kind in orders)
+            exact = self._exact_orders(kinds)
+            result.update(exact)
+            kinds = tuple(kind for kind in kinds if kind not in exact)
+
+            use_index = self.spatial_index
+            if use_index is None:
+                use_index = len(self.deliveries) >= SPATIAL_INDEX_MIN_STOPS
+            greedy = self._greedy_orders_indexed if use_index else self._greedy_orders
+            if kinds:
+                with span("greedy", orders=len(kinds)):
+                    result.update(greedy(kinds, prio_gamma))
+
+            if self.deliveries.has_windows():
+                window_args = self._window_args(start_time)
+                with span("windows", orders=len(kinds)):
+                    for kind in kinds:
+                        tour = [0] + [k + 1 for k in result[kind]] + [0]
+                        tour = fit_windows(self.distance_matrix, self._arrival_weights(kind), tour, *window_args)
+                        result[kind] = [node - 1 for node in tour[1:-1]]
+
+        return result["time"], result["co2"], result["cost"], result["multi"]
+
+    # Held-Karp orders (exact.py) for small manifests: the time order minimizes the priority weighted time, cost
+    # and co2 their totals, multi the weighted sum of the three normalized like route_scores. Empty when there
+    # are more than exact_stops deliveries, delivery windows, or the table would exceed EXACT_MAX_BYTES
+    def _exact_orders(self, kinds) -> dict:
+        n = len(self.deliveries)
+        if n > self.exact_stops or self.deliveries.has_windows():
+            return {}
+        with span("exact", stops=n, orders=len(kinds)):
+            W = np.asarray(self.distance_matrix.gather(*np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")),
+                           dtype=np.float64)
+            orders, solved = {}, {}
+            for kind in kinds:
+                c = self._arrival_weights(kind)
+                # weights that only differ by a factor give the same tour (cost and co2 are both per km)
+                key = (c / c.max() if c.max() > 0 else c).tobytes()
+                if key not in solved:
+                    solved[key] = held_karp(W, c, EXACT_MAX_BYTES)
+                if solved[key] is None:
+                    count("exact_over_memory")
+                    return {}
+                orders[kind] = list(solved[key])
+        return orders
+
+    # speed, start hour and window start/end per matrix index (depot open) for windows.py
+    def _window_args(self, start_time=None):
+        start = start_time or self.start_time or datetime.now()
+        early = np.concatenate(([-np.inf], self.deliveries.window_start))
+        late = np.concatenate(([np.inf], self.deliveries.window_end))
+        return MODE_PARAMS[self.mode]["speed"], hour_of_day(start), early, late
 
-            # function to compute the keys for remaining deliveries by time and priority based on a scaling distance function, increased gamma -> more priority weight on distant points
-            def key_time(k: int) -> float:
-                d = distances[k]
-                d_norm = d / d_max
-                base_prio = URGENCY_MULT[self.deliveries[k]["priority"]]         # priority weight high/med/low
-                prio_dyn = base_prio ** (1.0 + prio_gamma * d_norm)              # dynamic priority -> priority ** (1+gamma*normalized distance) 
-                return prio_dyn * d                                              
+    '''
+    Greedy kernel behind closest_route_order. The requested orders are walked in one loop; each step gathers the
+    distance row of the current stop for the remaining deliveries and takes the argmin of the order's key:
+        time:  prio ** (1 + gamma * d_norm) * d, priority term done as exp(log(prio) * (1 + gamma * d_norm))
+        co2:   co2_per_km * d
+        cost:  cost_per_km * d
+        multi: w_time * prio_dyn * d_time + w_cost * d_cost + w_co2 * d_co2 (dynamic priority only on time)
+    d_norm is the distance over the largest distance to a remaining delivery, increased gamma -> more priority
+    weight on distant points. Remaining deliveries are kept in index order so ties go to the lowest index.
+    '''
+    def _greedy_orders(self, kinds, prio_gamma):
+        D = self.distance_matrix
+        n = len(self.deliveries)
+
+        # weights for each metric and log of the priority multipliers
+        w = self.multi_weights if "multi" in kinds else None
+        log_prio = np.log(self.priority_weights)
+
+        count("candidates", len(kinds) * n * (n + 1) // 2)
+        remaining = {kind: np.arange(n) for kind in kinds}    # remaining deliveries per order
+        cur = {kind: 0 for kind in kinds}                      # matrix index of current position (depot)
+        orders = {kind: [] for kind in kinds}
+
+        for _ in range(n):
+            for kind in kinds:
+                rem = remaining[kind]
+                d = np.asarray(D.take(cur[kind], rem + 1), dtype=np.float64)
+
+                d_max = (d.max() or 0.0001) if kind in ("time", "multi") else None  # avoid zero div
+                key = self._order_keys(kind, d, log_prio[rem], d_max, prio_gamma, w)
+
+                # index next delivery, append, update position and remove the finished delivery
+                p = int(np.argmin(key))
+                j = int(rem[p])
+                orders[kind].append(j)
+                cur[kind] = j + 1
+                remaining[kind] = np.delete(rem, p)
+
+        return orders
+
+    # Greedy key of each candidate at distance d (float array) for one order kind, see _greedy_orders
+    def _order_keys(self, kind, d, log_prio, d_max, prio_gamma, w):
+        speed = MODE_PARAMS[self.mode]["speed"]
+        cost_per_km = MODE_PARAMS[self.mode]["cost"]
+        co2_per_km  = MODE_PARAMS[self.mode]["co2"]
 
-             # index next delivery, append, update position and remove the finished delivery from list
-            j_time = min(remaining_deliveries, key=key_time)           
-            order_time.append(j_time)
-            cur_lat, cur_lon = self.deliveries[j_time]["lat"], self.deliveries[j_time]["lon"]
-            remaining_deliveries.remove(j_time)
+        if kind == "co2":
+            return co2_per_km * d
+        if kind == "cost":
+            return cost_per_km * d
 
+        prio_dyn = np.exp(log_prio * (1.0 + prio_gamma * (d / d_max)))
+        if kind == "time":
+            return prio_dyn * d
+        return w["time"] * prio_dyn * (d / speed) + w["cost"] * (d * cost_per_km) + w["co2"] * (d * co2_per_km)
 
+    '''
+    Same greedy orders as _greedy_orders, but the next stop is looked up in a spatial index over the deliveries
+    instead of scanning every remaining one, so each step is sub-linear on large manifests.
+    Every key has the form d * g(d) with g(d) >= lb_coef, so once the best key among the k nearest candidates is
+    below lb_coef * (distance of the furthest candidate) no delivery further away can beat it; otherwise the
+    candidate list is grown. For cost and co2 this is a plain nearest-neighbour query.
+    '''
+    def _greedy_orders_indexed(self, kinds, prio_gamma):
+        D = self.distance_matrix
+        n = len(self.deliveries)
 
-        
-        # co2 same logic, but no scaling priority
-        order_co2 = []
-        remaining_deliveries_co2 = set(range(len(self.deliveries)))
-        cur_lat_co2, cur_lon_co2 = self.depot["lat"], self.depot["lon"]
-        co2_per_km = MODE_PARAMS[self.mode]["co2"]
-
-        while remaining_deliveries_co2:
-            j_co2 = min(remaining_deliveries_co2,
-                key=lambda k: co2_per_km * haversine(cur_lat_co2, cur_lon_co2, self.deliveries[k]["lat"], self.deliveries[k]["lon"]))
-            order_co2.append(j_co2)
-            cur_lat_co2, cur_lon_co2 = self.deliveries[j_co2]["lat"], self.deliveries[j_co2]["lon"]
-            remaining_deliveries_co2.remove(j_co2)
-
-
-        # cost, same as co2 
-        order_cost = []
-        remaining_deliveries_cost = set(range(len(self.deliveries)))
-        cur_lat_cost, cur_lon_cost = self.depot["lat"], self.depot["lon"]
+        speed = MODE_PARAMS[self.mode]["speed"]
         cost_per_km = MODE_PARAMS[self.mode]["cost"]
+        co2_per_km  = MODE_PARAMS[self.mode]["co2"]
+        w = self.multi_weights if "multi" in kinds else None
+        prio = self.priority_weights
+        log_prio = np.log(prio)
+        # smallest value prio ** (1 + gamma * d_norm) can take for d_norm in [0, 1]
+        prio_min = float(np.minimum(prio, prio ** (1.0 + prio_gamma)).min())
+
+        xyz = self._spatial_points(self.deliveries.lat, self.deliveries.lon)
+        depot_xyz = self._spatial_points([self.depot["lat"]], [self.depot["lon"]])[0]
+        base_tree = SphereKDTree(xyz)
+
+        orders = {}
+        for kind in kinds:
+            lb_coef = {
+                "co2": co2_per_km,
+                "cost": cost_per_km,
+                "time": prio_min,
+                "multi": (w["time"] * prio_min / speed + w["cost"] * cost_per_km + w["co2"] * co2_per_km) if w else 0.0,
+            }[kind]
+            # every key is zero (e.g. cost by bicycle), min() then always takes the lowest remaining index
+            if lb_coef == 0:
+                orders[kind] = list(range(n))
+                continue
+
+            with span(kind) as record:
+                tree = base_tree.copy()
+                cur, q = 0, depot_xyz
+                order = []
+                candidates = 0
+                while len(tree):
+                    d_max = None
+                    if kind in ("time", "multi"):
+                        far = tree.farthest(q)
+                        d_max = float(D.take(cur, [far + 1])[0]) or 0.0001
+
+                    k = SPATIAL_CANDIDATES
+                    while True:
+                        cand = tree.knearest(q, k)
+                        d = np.asarray(D.take(cur, cand + 1), dtype=np.float64)
+                        key = self._order_keys(kind, d, log_prio[cand], d_max, prio_gamma, w)
+                        candidates += len(cand)
+                        best = key.min()
+                        # small margin so float32 matrix rounding can not let a further stop slip below the bound
+                        if len(cand) == len(tree) or best < lb_coef * d.max() * (1 - 1e-6):
+                            break
+                        k *= 4
+
+                    j = int(cand[key == best].min())
+                    order.append(j)
+                    tree.remove(j)
+                    cur, q = j + 1, xyz[j]
+                count("candidates", candidates)
+            orders[kind] = order
+
+        return orders
 
-        while remaining_deliveries_cost:
-            j_cost = min(remaining_deliveries_cost,
-                key=lambda k: cost_per_km * haversine(cur_lat_cost, cur_lon_cost, self.deliveries[k]["lat"], self.deliveries[k]["lon"]))
-            
-            order_cost.append(j_cost)
-            cur_lat_cost, cur_lon_cost = self.deliveries[j_cost]["lat"], self.deliveries[j_cost]["lon"]
-            remaining_deliveries_cost.remove(j_cost)
-
-        '''
-        multi-objective optimization by weighted sum of time, cost and co2 (Currently only dynamic priority on time as the other metrics got no other scaling factors)
-        Follows similar logic but also applies a weight for each metric based on wanted importance, which can be optimized by pareto front 
-        '''
-        order_multi = []
-        if multiobj:
-            remaining_deliveries_m = set(range(len(self.deliveries)))
-            cur_lat_m, cur_lon_m = self.depot["lat"], self.depot["lon"]
-
-            # weights for each metric
-            w = self.multi_weights  
-            w_time = w["time"] 
-            w_cost = w["cost"] 
-            w_co2 = w["co2"]
-            
-            # get paremeters based on the chosen mode car/bicycle/walk
-            speed = MODE_PARAMS[self.mode]["speed"]
-            cost_per_km = MODE_PARAMS[self.mode]["cost"]
-            co2_per_km  = MODE_PARAMS[self.mode]["co2"]
-
-            while remaining_deliveries_m:
-                
-                distances = {
-                    k: haversine(cur_lat_m, cur_lon_m,
-                                self.deliveries[k]["lat"], self.deliveries[k]["lon"])
-                    for k in remaining_deliveries_m}
-
-                
-                d_max = max(distances.values()) or 0.0001
-                # get keys for each remaining delivery based on weighted sum of time, cost and co2. also uses the priority scaling for the time metric. 
-                def key_multi(k: int) -> float:
-                    distance = distances[k]
-                    d_time, d_cost, d_co2 = self._delivery_metrics(distance)
-                    d_norm = distance / d_max
-                    base_prio = URGENCY_MULT[self.deliveries[k]["priority"]]
-                    prio_dyn = base_prio ** (1.0 + prio_gamma * d_norm)
-                 
-                    return w_time * prio_dyn * d_time + w_cost * d_cost + w_co2 * d_co2 # determine the actual metrics and apply weights
-
-                j_multi = min(remaining_deliveries_m, key=key_multi)
-                order_multi.append(j_multi)
-                cur_lat_m, cur_lon_m = self.deliveries[j_multi]["lat"], self.deliveries[j_multi]["lon"]
-                remaining_deliveries_m.remove(j_multi)
-
-        
-        return order_time, order_co2, order_cost, order_multi
 
+    '''
+    Optional improvement stage after closest_route_order: 2-opt and Or-opt local search (local_search.py) on the
+    objective time/cost/co2/multi (default self.objective), with time weighted by priority as in route_totals.
+    Runs until no move improves the route or time_budget seconds have passed.
+    With delivery windows it relocates single stops instead (windows.relocate_windows), a move never makes a
+    stop later than its window allows; 2-opt reversals would turn whole segments around in time.
+    '''
+    def improve(self, order: list[int], objective=None, time_budget=1.0, start_time=None) -> list[int]:
+        c = self._arrival_weights(objective or self.objective)
+        tour = [0] + [k + 1 for k in order] + [0]
+        if self.deliveries.has_windows() and order:
+            window_args = self._window_args(start_time)
+            with span("improve", stops=len(order)):
+                tour = fit_windows(self.distance_matrix, c, tour, *window_args)
+                tour = relocate_windows(self.distance_matrix, c, tour, *window_args, time_budget)
+            return [node - 1 for node in tour[1:-1]]
+
+        if len(order) < 3 or not c.any():
+            return list(order)
+
+        with span("improve", stops=len(order)):
+            tour = improve_tour(self.distance_matrix, c, tour, self._neighbour_lists(), time_budget)
+        return [node - 1 for node in tour[1:-1]]
+
+    # Weight per matrix index so a leg a -> b costs distance * c[b] for the objective, same weighting as
+    # route_totals (priority of the stop arrived at, none on the return to the depot at index 0).
+    # prio gives the weights for other priority multipliers instead (used for stops added to a LiveRoute)
+    def _arrival_weights(self, objective, prio=None) -> np.ndarray:
+        d_mode = MODE_PARAMS[self.mode]
+        if prio is None:
+            prio = np.concatenate(([1.0], self.priority_weights))
+        time_w = prio / d_mode["speed"]
+
+        if objective == "time":
+            return time_w
+        if objective == "cost":
+            return np.full(len(prio), float(d_mode["cost"]))
+        if objective == "co2":
+            return np.full(len(prio), float(d_mode["co2"]))
+        if objective == "multi":
+            # same normalization as route_scores
+            refs = self._star_refs()
+            w = self.multi_weights
+            return (w["time"] * time_w / refs["time"] + w["cost"] * d_mode["cost"] / refs["cost"]
+                    + w["co2"] * d_mode["co2"] / refs["co2"])
+        raise ValueError(f"Unknown objective: {objective}")
+
+    # Incremental view of a planned order for updates during the shift (insert/remove/advance), see live.py
+    def live_route(self, order: list[int], objective=None):
+        return LiveRoute(self, order, objective or self.objective)
+
+    # LOCAL_SEARCH_NEIGHBOURS nearest deliveries of every matrix index (depot included), from the matrix rows
+    # when it is in memory and from the spatial index otherwise
+    def _neighbour_lists(self, k=LOCAL_SEARCH_NEIGHBOURS) -> list[list[int]]:
+        D = self.distance_matrix
+        n = len(self.deliveries)
+        k = min(k, n - 1)
+
+        if hasattr(D, "data"):
+            neighbours = []
+            for lo in range(0, n + 1, MATRIX_BLOCK_ROWS):
+                block = np.array(D.data[lo:lo + MATRIX_BLOCK_ROWS, 1:], dtype=np.float64)
+                rows = np.arange(lo, lo + len(block))
+                own = rows >= 1
+                block[own.nonzero()[0], rows[own] - 1] = np.inf   # a stop is not its own neighbour
+                near = np.argpartition(block, k - 1, axis=1)[:, :k]
+                neighbours.extend((near + 1).tolist())
+            return neighbours
+
+        xyz = self._spatial_points(np.concatenate(([self.depot["lat"]], self.deliveries.lat)),
+                                   np.concatenate(([self.depot["lon"]], self.deliveries.lon)))
+        tree = SphereKDTree(xyz[1:])
+        return [[j + 1 for j in tree.knearest(xyz[a], k + 1).tolist() if j + 1 != a][:k] for a in range(n + 1)]
 
     '''
     Method to calculate raw metrics of the route based on the delivery order
@@ -147,92 +378,92 @@ class RouteOptimizer:
         - co2:  total CO2
         - t_actual: unweighted travel time 
         """
-        t_sum = 0.0
-        cost_sum = 0.0
-        co2_sum = 0.0
-        t_actual = 0.0
-
-        # depot -> first
-        first = self.deliveries[order[0]]
-        dist = haversine(self.depot["lat"], self.depot["lon"], first["lat"], first["lon"])
-        
-        d_time, d_cost, d_co2 = self._delivery_metrics(dist)
-        w_prio = URGENCY_MULT[first["priority"]] if prio_on_time else 1.0
-        t_sum += w_prio * d_time
-        cost_sum += d_cost
-        co2_sum += d_co2
-        t_actual += d_time
-
-        # loop through deliveries by delivery order 
-        for i in range(1, len(order)):
-            # determine distance from previous to current stop and determine metrics 
-            a = self.deliveries[order[i-1]]     
-            b = self.deliveries[order[i]]
-            dist = haversine(a["lat"], a["lon"], b["lat"], b["lon"])
-            d_time, d_cost, d_co2 = self._delivery_metrics(dist)
-
-            # add metrics to the totals 
-            w_prio = URGENCY_MULT[b["priority"]] if prio_on_time else 1.0
-            t_sum += w_prio * d_time
-            cost_sum += d_cost
-            co2_sum += d_co2
-            t_actual += d_time
-
-        # return to depot (no priority on return)
-        last = self.deliveries[order[-1]]
-        dist = haversine(last["lat"], last["lon"], self.depot["lat"], self.depot["lon"])
-        d_time, d_cost, d_co2 = self._delivery_metrics(dist)
-        t_sum += d_time
-        cost_sum += d_cost
-        co2_sum += d_co2
-        t_actual += d_time
-
-        return {"time": t_sum, "cost": cost_sum, "co2": co2_sum, "t_actual": t_actual}
+        totals = self.route_totals_batch([order], prio_on_time)
+        return {k: float(v[0]) for k, v in totals.items()}
+
+    '''
+    Same totals as route_totals for many orders at once: orders is a 2D array with one permutation of the
+    delivery indices per row, every leg of every route is read from the distance matrix in one gather.
+    Rows are processed in chunks so temporaries stay around BATCH_CELLS values.
+    '''
+    def route_totals_batch(self, orders, prio_on_time=True) -> dict[str, np.ndarray]:
+        orders = np.asarray(orders, dtype=np.intp)
+        if orders.ndim == 1:
+            orders = orders[None, :]
+        m, n = orders.shape
+        D = self.distance_matrix
+        prio = self.priority_weights
+        totals = {k: np.empty(m) for k in ("time", "cost", "co2", "t_actual")}
+
+        step = max(1, BATCH_CELLS // (n + 1))
+        for lo in range(0, m, step):
+            chunk = orders[lo:lo + step]
+
+            # matrix indices of the whole tours depot -> deliveries -> depot
+            tours = np.zeros((len(chunk), n + 2), dtype=np.intp)
+            tours[:, 1:-1] = chunk + 1
+            legs = np.asarray(D.gather(tours[:, :-1], tours[:, 1:]), dtype=np.float64)
+            d_time, d_cost, d_co2 = self._delivery_metrics(legs)
+
+            # time of each leg weighted by the priority of the stop it arrives at (no priority on return)
+            w_prio = np.ones_like(legs)
+            if prio_on_time:
+                w_prio[:, :-1] = prio[chunk]
+
+            totals["time"][lo:lo + step] = (w_prio * d_time).sum(axis=1)
+            totals["cost"][lo:lo + step] = d_cost.sum(axis=1)
+            totals["co2"][lo:lo + step] = d_co2.sum(axis=1)
+            totals["t_actual"][lo:lo + step] = d_time.sum(axis=1)
+
+        return totals
             
     '''
     Follows same logic as route_scores but builds route with the wanted outputs format
     '''
 
-    def route_scores(self, order: list[int]) -> tuple[float, float]:
-        '''
-        Calculates the total route score using per-metric normalization:
-        where refs are computed inline from a simple star baseline.
-        '''
-        totals = self.route_totals(order, prio_on_time=True)
+    # Reference totals of a star route (depot -> delivery -> depot for every delivery) used to normalize scores,
+    # computed once per optimizer
+    def _star_refs(self) -> dict[str, float]:
+        if self._refs is not None:
+            return self._refs
 
-    
-        depot_lat, depot_lon = self.depot["lat"], self.depot["lon"]
         speed = MODE_PARAMS[self.mode]["speed"]
         cost_per_km = MODE_PARAMS[self.mode]["cost"]
         co2_per_km  = MODE_PARAMS[self.mode]["co2"]
 
-        time_ref = 0.0
-        cost_ref = 0.0
-        co2_ref  = 0.0
+        # Every delivery is visited from the depot and back (2*distance) where time is weighted by priority
+        dist = np.asarray(self.distance_matrix.row(0)[1:], dtype=np.float64)
+        prio = self.priority_weights
 
-        # Loops over every delivery point and find the distance to each point and back (2*distance) where time is weighted by priority 
-        for d in self.deliveries:
-            dist = haversine(depot_lat, depot_lon, d["lat"], d["lon"])
-            prio = URGENCY_MULT[d["priority"]]
-       
-            cost_ref += 2.0 * dist * cost_per_km
-            co2_ref  += 2.0 * dist * co2_per_km
-            time_ref += prio * (dist / speed) + (dist / speed)
+        cost_ref = float((2.0 * dist * cost_per_km).sum())
+        co2_ref  = float((2.0 * dist * co2_per_km).sum())
+        time_ref = float((prio * (dist / speed) + (dist / speed)).sum())
 
         # find the max 
         zero_div = 0.0001
-        refs = {
+        self._refs = {
             "time": max(time_ref, zero_div),
             "cost": max(cost_ref, zero_div),
             "co2":  max(co2_ref,  zero_div),
         }
+        return self._refs
+
+    def route_scores(self, order: list[int]) -> tuple[float, float]:
+        '''
+        Calculates the total route score using per-metric normalization:
+        where refs are computed from a simple star baseline.
+        '''
+        with span("score"):
+            scores, t_actual = self.route_scores_batch([order])
+        return float(scores[0]), float(t_actual[0])
+
+    # route_scores for a 2D array of orders, returns the score and actual travel time arrays
+    def route_scores_batch(self, orders) -> tuple[np.ndarray, np.ndarray]:
+        totals = self.route_totals_batch(orders, prio_on_time=True)
+        refs = self._star_refs()
 
         # normalize between [0,1] based on the max values for equal scoring
-        scores = {
-            "time": normalize(totals["time"] / refs["time"]),
-            "cost": normalize(totals["cost"] / refs["cost"]),
-            "co2":  normalize(totals["co2"]  / refs["co2"]),
-        }
+        scores = {k: np.clip(totals[k] / refs[k], 0.0, 1.0) for k in ("time", "cost", "co2")}
 
         # do per objective weight if doing multi-optimization 
         if self.objective == "multi":
@@ -247,53 +478,28 @@ class RouteOptimizer:
 
         return total_score, totals["t_actual"]
         
-    # Build the route for plotting and logging - same logic as route_totals
+    # Build the route for plotting and logging - same legs as route_totals, returned as a typed RouteResult
+    # (formatted only when it is written). One row per stop: depot, every delivery of order (the first one
+    # included, the original builder skipped its row), depot
     def route_builder(self, order, start_time):
-        route = []
-        cum_dis = 0.0
-        cum_time = 0.0
-
-        # Method to add stop to the route list
-        def add_stop(customer, lat, lon, distance, time, cost, co2):
-            nonlocal cum_dis, cum_time
-            cum_dis += distance
-            cum_time += time
-            time_arrival = start_time + timedelta(hours=cum_time)
-
-            route.append({"customer": customer,
-                          "latitude": f"{lat:.6f}",
-                          "longitude": f"{lon:.6f}",
-                          "distance_from_previous": distance,
-                          "cumulative_distance": cum_dis,
-                          "eta_from_start": time_arrival.isoformat(timespec="minutes"),
-                          "time_to_current": f"{time:.2f}",
-                          "cost_to_current": f"{cost:.2f}",
-                          "co2_to_current": f"{co2:.2f}"
-                          })
-
-        # Initilize from depot to first
-        add_stop(self.depot["name"], self.depot["lat"], self.depot["lon"], 0, 0, 0, 0)
-
-        #depot to first
-        first = self.deliveries[order[0]]
-        distance = haversine(self.depot["lat"], self.depot["lon"], first["lat"], first["lon"])
-
-        # loop through deliveries
-        for i in range(1, len(order)):
-            a = self.deliveries[order[i-1]]  
-            b = self.deliveries[order[i]]
-            distance = haversine(a["lat"], a["lon"], b["lat"], b["lon"])
-
-            d_time, d_cost, d_co2 = self._delivery_metrics(distance)
-            add_stop(b["customer"], b["lat"], b["lon"], distance, d_time, d_cost, d_co2)
-            
-        # return
-        last = self.deliveries[order[-1]]
-        distance = haversine(last["lat"], last["lon"], self.depot["lat"], self.depot["lon"])
-        d_time, d_cost, d_co2 = self._delivery_metrics(distance)
-        add_stop(self.depot["name"], self.depot["lat"], self.depot["lon"], distance, d_time, d_cost, d_co2)
-
-        return route
+        tour = np.zeros(len(order) + 2, dtype=np.intp)
+        tour[1:-1] = np.asarray(order, dtype=np.intp) + 1
+        distance = np.zeros(len(tour))
+        distance[1:] = self.distance_matrix.gather(tour[:-1], tour[1:])
+
+        depot = self.depot
+        customer = [depot["name"]] + [self.deliveries.customer[k] for k in order] + [depot["name"]]
+        lat = np.concatenate(([depot["lat"]], self.deliveries.lat[order], [depot["lat"]]))
+        lon = np.concatenate(([depot["lon"]], self.deliveries.lon[order], [depot["lon"]]))
+        if not self.deliveries.has_windows():
+            return RouteResult(customer, lat, lon, distance, self.mode, start_time)
+
+        # with windows the ETAs include the waiting, counted from midnight of the start day
+        speed, start_h, early, late = self._window_args(start_time)
+        s = schedule(self.distance_matrix, tour, speed, start_h, early, late)
+        midnight = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        return RouteResult(customer, lat, lon, distance, self.mode, midnight, s["arrival"], early[tour], late[tour],
+                           s["wait"], s["late"])
 
 
         
\ No newline at end of file
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+import numpy as np
+from courier_route_optimization.constants import MODE_PARAMS
+from courier_route_optimization.windows import EPS, format_clock
+
+'''
+Typed result of route_builder: one row per stop, depot -> deliveries -> depot, stored as columns (list of
+customer names and float64 arrays) like the DeliveryTable. Numbers stay numbers until the route is written:
+format_rows() gives the csv strings, totals() sums the numeric columns and save_npz() writes the columns to a
+compressed numpy archive, which downstream systems read back with np.load (no pickle) or load_npz.
+Iterating or indexing gives typed row dicts with the csv column names (ETA as a datetime, windows in hours).
+ETAs are kept as hours after eta_base: the start time, or midnight of the start day when there are windows.
+'''
+
+
+class RouteResult:
+    def __init__(self, customer, lat, lon, distance, mode, eta_base: datetime, eta_hours=None,
+                 window_start=None, window_end=None, wait=None, late=None):
+        d_mode = MODE_PARAMS[mode]
+        self.customer = list(customer)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.distance = np.asarray(distance, dtype=np.float64)     # km from the previous stop, 0 at the start
+        self.cumulative_distance = np.cumsum(self.distance)
+        self.time = self.distance / d_mode["speed"]                 # h, cost and co2 of the leg to each stop
+        self.cost = self.distance * d_mode["cost"]
+        self.co2 = self.distance * d_mode["co2"]
+        self.eta_base = eta_base
+        self.eta_hours = np.cumsum(self.time) if eta_hours is None else np.asarray(eta_hours, dtype=np.float64)
+        # windows in hours since midnight (-inf / +inf when open), waiting and lateness in hours
+        self.window_start, self.window_end, self.wait, self.late = window_start, window_end, wait, late
+        if not len(self.lat) == len(self.lon) == len(self.distance) == len(self.eta_hours) == len(self.customer):
+            raise ValueError("RouteResult columns must have the same length")
+
+    @property
+    def has_windows(self) -> bool:
+        return self.late is not None
+
+    def __len__(self):
+        return len(self.customer)
+
+    def etas(self) -> list[datetime]:
+        return [self.eta_base + timedelta(hours=h) for h in self.eta_hours.tolist()]
+
+    # one stop as a typed row dict
+    def __getitem__(self, k: int) -> dict:
+        row = {"customer": self.customer[k],
+               "latitude": float(self.lat[k]),
+               "longitude": float(self.lon[k]),
+               "distance_from_previous": float(self.distance[k]),
+               "cumulative_distance": float(self.cumulative_distance[k]),
+               "eta_from_start": self.eta_base + timedelta(hours=float(self.eta_hours[k])),
+               "time_to_current": float(self.time[k]),
+               "cost_to_current": float(self.cost[k]),
+               "co2_to_current": float(self.co2[k])}
+        if self.has_windows:
+            row.update(window_start=float(self.window_start[k]), window_end=float(self.window_end[k]),
+                       wait_minutes=float(self.wait[k]) * 60, late_minutes=float(self.late[k]) * 60)
+        return row
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    # rows as written to the route csv (and returned by the service), the only place numbers become strings
+    def format_rows(self):
+        columns = zip(self.customer, self.lat.tolist(), self.lon.tolist(), self.distance.tolist(),
+                      self.cumulative_distance.tolist(), self.etas(), self.time.tolist(), self.cost.tolist(),
+                      self.co2.tolist())
+        for k, (name, lat, lon, distance, cum_dis, eta, time, cost, co2) in enumerate(columns):
+            row = {"customer": name,
+                   "latitude": f"{lat:.6f}",
+                   "longitude": f"{lon:.6f}",
+                   "distance_from_previous": distance,
+                   "cumulative_distance": cum_dis,
+                   "eta_from_start": eta.isoformat(timespec="minutes"),
+                   "time_to_current": f"{time:.2f}",
+                   "cost_to_current": f"{cost:.2f}",
+                   "co2_to_current": f"{co2:.2f}"}
+            if self.has_windows:
+                row.update(window_start=format_clock(self.window_start[k]),
+                           window_end=format_clock(self.window_end[k]),
+                           wait_minutes=f"{max(float(self.wait[k]), 0.0) * 60:.1f}",
+                           late_minutes=f"{float(self.late[k]) * 60:.1f}")
+            yield row
+
+    # km, hours, NOK and g CO2 of the route, plus the stops that miss their window when there are windows
+    def totals(self) -> dict:
+        totals = {"distance_km": float(self.distance.sum()), "time_h": float(self.time.sum()),
+                  "cost_nok": float(self.cost.sum()), "co2_g": float(self.co2.sum())}
+        if self.has_windows:
+            totals["late_stops"] = int((self.late > EPS).sum())
+        return totals
+
+    # the typed columns, ETAs as datetime64 in the local time of the start (time zone dropped)
+    def columns(self) -> dict:
+        etas = [eta.replace(tzinfo=None) for eta in self.etas()]
+        cols = {"customer": np.array(self.customer, dtype=np.str_), "latitude": self.lat, "longitude": self.lon,
+                "distance_from_previous": self.distance, "cumulative_distance": self.cumulative_distance,
+                "eta": np.array(etas, dtype="datetime64[s]"), "time_h": self.time, "cost_nok": self.cost,
+                "co2_g": self.co2}
+        if self.has_windows:
+            cols.update(window_start_h=self.window_start, window_end_h=self.window_end, wait_h=self.wait,
+                        late_h=self.late)
+        return cols
+
+    def to_npz(self, path):
+        save_npz(path, [self])
+
+
+# writes routes as one set of columns, with a route column (the vehicle numbers, default 1, 2, ...) when there
+# is more than one. Windows columns are only written when every route has them
+def save_npz(path, routes, route_ids=None):
+    routes = list(routes)
+    per_route = [r.columns() for r in routes]
+    keys = [k for k in per_route[0] if all(k in cols for cols in per_route)] if per_route else []
+    arrays = {k: np.concatenate([cols[k] for cols in per_route]) for k in keys}
+    if len(routes) > 1 or route_ids is not None:
+        ids = range(1, len(routes) + 1) if route_ids is None else route_ids
+        arrays["route"] = np.repeat(np.asarray(list(ids), dtype=np.int32), [len(r) for r in routes])
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_npz(path) -> dict:
+    with np.load(path, allow_pickle=False) as data:
+        return {k: data[k] for k in data.files}
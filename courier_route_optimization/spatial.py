@@ -0,0 +1,226 @@
+import heapq
+import numpy as np
+from courier_route_optimization.constants import SPATIAL_LEAF_SIZE
+
+'''
+Spatial index for nearest-stop queries on large manifests.
+Locations are mapped to 3D unit-sphere vectors where the straight chord between two points grows with the
+great-circle (haversine) distance, so the nearest point by chord is the nearest point by haversine.
+The tree is built once and supports deleting points, which is what the greedy route construction needs:
+query the nearest remaining stop, visit it, remove it.
+'''
+
+# lat/lon in degrees -> (n, 3) unit vectors
+def unit_vectors(lat, lon) -> np.ndarray:
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)))
+
+
+# KD-tree over an (n, dim) point array with deletion. Leaves hold up to leaf_size points that are checked with
+# numpy, every node keeps a count of alive points below it so empty subtrees are skipped in queries
+class SphereKDTree:
+    def __init__(self, points: np.ndarray, leaf_size=SPATIAL_LEAF_SIZE):
+        points = np.asarray(points, dtype=np.float64)
+        n = len(points)
+        perm = np.arange(n)
+
+        self._lo, self._hi, self._left, self._right, self._parent = [], [], [], [], []
+        self._box_lo, self._box_hi = [], []
+        leaf_of = np.empty(n, dtype=np.intp)
+
+        stack = [(0, n, -1)] if n else []
+        while stack:
+            lo, hi, parent = stack.pop()
+            node = len(self._lo)
+            idx = perm[lo:hi]
+            box_lo = points[idx].min(axis=0)
+            box_hi = points[idx].max(axis=0)
+
+            self._lo.append(lo)
+            self._hi.append(hi)
+            self._left.append(-1)
+            self._right.append(-1)
+            self._parent.append(parent)
+            self._box_lo.append(tuple(box_lo.tolist()))
+            self._box_hi.append(tuple(box_hi.tolist()))
+            if parent != -1:
+                # children are pushed right first so the left child is always created first
+                if self._left[parent] == -1:
+                    self._left[parent] = node
+                else:
+                    self._right[parent] = node
+
+            if hi - lo <= leaf_size:
+                leaf_of[lo:hi] = node
+                continue
+
+            # split the widest dimension at the median
+            dim = int(np.argmax(box_hi - box_lo))
+            mid = (lo + hi) // 2
+            part = np.argpartition(points[idx, dim], mid - lo)
+            perm[lo:hi] = idx[part]
+            stack.append((mid, hi, node))
+            stack.append((lo, mid, node))
+
+        self.points = points[perm]              # points in tree order, leaves are contiguous slices
+        self.ids = perm                          # tree position -> original index
+        self.pos = np.empty(n, dtype=np.intp)    # original index -> tree position
+        self.pos[perm] = np.arange(n)
+        self.alive = np.ones(n, dtype=bool)      # by tree position
+        self._leaf_of = leaf_of.tolist()
+        self._count = [hi - lo for lo, hi in zip(self._lo, self._hi)]
+
+    def __len__(self):
+        return self._count[0] if self._count else 0
+
+    # new tree sharing the static structure with all points alive again
+    def copy(self):
+        tree = SphereKDTree.__new__(SphereKDTree)
+        tree.__dict__.update(self.__dict__)
+        tree.alive = np.ones(len(self.ids), dtype=bool)
+        tree._count = [hi - lo for lo, hi in zip(self._lo, self._hi)]
+        return tree
+
+    def remove(self, i: int):
+        p = self.pos[i]
+        if not self.alive[p]:
+            return
+        self.alive[p] = False
+        node = self._leaf_of[p]
+        while node != -1:
+            self._count[node] -= 1
+            node = self._parent[node]
+
+    def _min_dist2(self, node, q):
+        d2 = 0.0
+        for qi, lo, hi in zip(q, self._box_lo[node], self._box_hi[node]):
+            if qi < lo:
+                d2 += (lo - qi) ** 2
+            elif qi > hi:
+                d2 += (qi - hi) ** 2
+        return d2
+
+    def _max_dist2(self, node, q):
+        return sum(max(qi - lo, hi - qi) ** 2 for qi, lo, hi in zip(q, self._box_lo[node], self._box_hi[node]))
+
+    def _leaf(self, node, q):
+        lo, hi = self._lo[node], self._hi[node]
+        alive = self.alive[lo:hi]
+        diff = self.points[lo:hi][alive] - q
+        return self.ids[lo:hi][alive], np.einsum("ij,ij->i", diff, diff)
+
+    # ids of the k nearest alive points to q sorted by distance (ties by index), all of them if k >= len(self)
+    def knearest(self, q, k: int) -> np.ndarray:
+        q = tuple(float(x) for x in q)
+        qa = np.array(q)
+        best_ids = np.empty(0, dtype=np.intp)
+        best_d2 = np.empty(0)
+        bound = np.inf
+
+        heap = [(0.0, 0)] if len(self) else []
+        while heap:
+            d2, node = heapq.heappop(heap)
+            if d2 > bound:
+                break
+            if self._left[node] == -1:
+                ids, leaf_d2 = self._leaf(node, qa)
+                best_ids = np.concatenate((best_ids, ids))
+                best_d2 = np.concatenate((best_d2, leaf_d2))
+                if len(best_ids) > k:
+                    keep = np.lexsort((best_ids, best_d2))[:k]
+                    best_ids, best_d2 = best_ids[keep], best_d2[keep]
+                if len(best_ids) == k:
+                    bound = best_d2.max()
+                continue
+            for child in (self._left[node], self._right[node]):
+                if self._count[child]:
+                    heapq.heappush(heap, (self._min_dist2(child, q), child))
+
+        order = np.lexsort((best_ids, best_d2))
+        return best_ids[order]
+
+    # squared distance between the box of node and the box [q_lo, q_hi]
+    def _box_gap2(self, node, q_lo, q_hi):
+        d2 = 0.0
+        for qlo, qhi, lo, hi in zip(q_lo, q_hi, self._box_lo[node], self._box_hi[node]):
+            if qhi < lo:
+                d2 += (lo - qhi) ** 2
+            elif qlo > hi:
+                d2 += (qlo - hi) ** 2
+        return d2
+
+    # alive (ids, points) of the leaves within gap2 of the box [q_lo, q_hi], nearest leaves first, stopping once
+    # at least k points are found when k is given
+    def _leaves_near(self, q_lo, q_hi, gap2=np.inf, k=None):
+        ids, points, found = [], [], 0
+        heap = [(0.0, 0)] if len(self) else []
+        while heap:
+            d2, node = heapq.heappop(heap)
+            if d2 > gap2 or (k is not None and found >= k):
+                break
+            if self._left[node] == -1:
+                lo, hi = self._lo[node], self._hi[node]
+                alive = self.alive[lo:hi]
+                ids.append(self.ids[lo:hi][alive])
+                points.append(self.points[lo:hi][alive])
+                found += len(ids[-1])
+                continue
+            for child in (self._left[node], self._right[node]):
+                if self._count[child]:
+                    heapq.heappush(heap, (self._box_gap2(child, q_lo, q_hi), child))
+        return np.concatenate(ids), np.concatenate(points)
+
+    # (n, k) ids of the k nearest alive points of every point (itself included, nearest first). All points of a
+    # leaf are answered together: the nearest leaves holding k points give an upper bound on the k-th distance
+    # of every point in the leaf, then all points within that bound are checked in one numpy block
+    def knearest_all(self, k: int) -> np.ndarray:
+        k = min(k, len(self))
+        out = np.empty((len(self.ids), k), dtype=np.intp)
+        if k == 0:
+            return out
+
+        for leaf in sorted(set(self._leaf_of)):
+            lo, hi = self._lo[leaf], self._hi[leaf]
+            q = self.points[lo:hi]
+            q_lo, q_hi = tuple(q.min(axis=0).tolist()), tuple(q.max(axis=0).tolist())
+
+            _, first = self._leaves_near(q_lo, q_hi, k=k)
+            diff = q[:, None, :] - first[None, :, :]
+            bound = np.partition(np.einsum("ijk,ijk->ij", diff, diff), k - 1, axis=1)[:, k - 1].max()
+
+            # any point within sqrt(bound) of some query lies within that distance of the query box
+            ids, cand = self._leaves_near(q_lo, q_hi, gap2=bound)
+            diff = q[:, None, :] - cand[None, :, :]
+            d2 = np.einsum("ijk,ijk->ij", diff, diff)
+            near = np.argpartition(d2, k - 1, axis=1)[:, :k] if d2.shape[1] > k else np.tile(np.arange(k), (hi - lo, 1))
+            order = np.argsort(np.take_along_axis(d2, near, axis=1), axis=1, kind="stable")
+            out[self.ids[lo:hi]] = ids[np.take_along_axis(near, order, axis=1)]
+        return out
+
+    def nearest(self, q) -> int:
+        return int(self.knearest(q, 1)[0])
+
+    # id of the alive point furthest from q
+    def farthest(self, q) -> int:
+        q = tuple(float(x) for x in q)
+        qa = np.array(q)
+        best_id, best_d2 = -1, -1.0
+
+        heap = [(-self._max_dist2(0, q), 0)] if len(self) else []
+        while heap:
+            neg_d2, node = heapq.heappop(heap)
+            if -neg_d2 <= best_d2:
+                break
+            if self._left[node] == -1:
+                ids, leaf_d2 = self._leaf(node, qa)
+                j = int(np.argmax(leaf_d2))
+                if leaf_d2[j] > best_d2:
+                    best_id, best_d2 = int(ids[j]), float(leaf_d2[j])
+                continue
+            for child in (self._left[node], self._right[node]):
+                if self._count[child]:
+                    heapq.heappush(heap, (-self._max_dist2(child, q), child))
+
+        return best_id
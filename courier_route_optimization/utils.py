@@ -1,36 +1,8 @@
 
-from functools import wraps
-from datetime import datetime
-import csv
-import time
-import itertools
 import numpy as np
 import math
-import matplotlib.pyplot as plt
 from courier_route_optimization.constants import EARTH_RADIUS_KM
-
-
-def timer(func):
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start = time.perf_counter()
-        result = func(*args, **kwargs)
-        end = time.perf_counter()
-        duration = end - start
-
-        print(f"{func.__name__} took {duration:.5f} seconds")
- 
-        log_file = "execution_timer_log.csv"
-        with open(log_file, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            
-            # This code was modified from AI to fix indexing issues
-            if file.tell() == 0:
-                writer.writerow(["timestamp", "function", "duration_seconds"])
-            writer.writerow([datetime.now().isoformat(), func.__name__, f"{duration:.5f}"])
-
-        return result
-    return wrapper
+from courier_route_optimization.instrument import timer     # buffered now, see instrument.report_timers
 
 # clamp*
 def normalize(x: float) -> float:
@@ -50,3 +22,17 @@ def haversine(lat1, lon1, lat2, lon2, R=EARTH_RADIUS_KM):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     
     return R * c
+
+# vectorized haversine over numpy arrays, broadcasts like any numpy ufunc (same formula as haversine)
+def haversine_np(lat1, lon1, lat2, lon2, R=EARTH_RADIUS_KM):
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    a = np.minimum(a, 1.0)  # rounding can push near-antipodal pairs just above 1
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return R * c
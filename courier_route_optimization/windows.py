@@ -0,0 +1,146 @@
+import time
+from datetime import datetime
+import numpy as np
+
+'''
+Delivery time windows: a delivery may give window_start and/or window_end as a clock time (HH:MM) on the day of
+the route start. Arriving before window_start means waiting, arriving after window_end is a violation.
+Times are hours since midnight of the start day, an open side is -inf / +inf.
+The tour is a list of distance matrix indices from the depot (0) back to the depot. schedule() computes, in a
+few numpy passes, per position: arrival, begin (arrival or window start after waiting), wait, late and the
+forward time slack (Savelsbergh): how much the begin at a position can be pushed back without any later stop
+getting later than its window end. Stops that are already late are held to their current arrival, so a move
+that passes the slack check never makes any violation worse.
+With the slack, inserting stop x between positions p and p+1 is checked in O(1): x is on time if
+begin[p] + t(p, x) <= end[x], and the rest of the route stays feasible if the begin at p+1 moves back by no more
+than slack[p+1]. insertion() evaluates that for every position of a tour at once.
+'''
+
+EPS = 1e-9      # hours
+
+
+# "HH:MM" or "HH:MM:SS" -> hours since midnight, "" -> None
+def parse_clock(text: str):
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        parts = [int(p) for p in text.split(":")]
+    except ValueError:
+        parts = []
+    if not 2 <= len(parts) <= 3 or not (0 <= parts[0] <= 24 and all(0 <= p < 60 for p in parts[1:])):
+        raise ValueError(f"Invalid delivery window time (use HH:MM): {text}")
+    hours = parts[0] + parts[1] / 60 + (parts[2] / 3600 if len(parts) == 3 else 0)
+    if hours > 24:
+        raise ValueError(f"Invalid delivery window time (use HH:MM): {text}")
+    return hours
+
+
+def format_clock(hours: float) -> str:
+    if not np.isfinite(hours):
+        return ""
+    minutes = int(round(hours * 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def hour_of_day(t: datetime) -> float:
+    return t.hour + t.minute / 60 + t.second / 3600 + t.microsecond / 3.6e9
+
+
+# arrival, begin, wait, late and slack per tour position; early/late are per matrix index (depot open)
+def schedule(D, tour, speed, start_h, early, late) -> dict:
+    t = np.asarray(tour, dtype=np.intp)
+    travel = np.asarray(D.gather(t[:-1], t[1:]), dtype=np.float64) / speed
+    T = np.concatenate(([0.0], np.cumsum(travel)))
+    E = early[t]
+    E[0] = start_h
+    # begin[p] = T[p] + max over q <= p of (E[q] - T[q]): the latest window start that held the route up
+    begin = T + np.maximum.accumulate(E - T)
+    arrival = np.concatenate(([start_h], begin[:-1] + travel))
+    wait = begin - arrival
+    L = np.maximum(late[t], arrival)
+    W = np.cumsum(wait)
+    # slack[p] = min over q >= p of (L[q] - begin[q] + waits between p and q)
+    slack = np.minimum.accumulate((L - begin + W)[::-1])[::-1] - W
+    return {"arrival": arrival, "begin": begin, "wait": wait, "late": np.maximum(arrival - late[t], 0.0),
+            "slack": slack}
+
+
+'''
+Inserting x between every pair of neighbouring positions of tour (s = schedule(tour)): cost increase with the
+arrival weights c (leg a -> b costs D[a, b] * c[b]), whether every other stop stays within its slack, and how
+late x itself would be. Arrays of length len(tour) - 1, entry p is the insertion after position p.
+'''
+def insertion(D, tour, x, s, speed, early, late, c):
+    t = np.asarray(tour, dtype=np.intp)
+    a, b = t[:-1], t[1:]
+    d_ax = np.asarray(D.gather(a, np.full(len(a), x)), dtype=np.float64)
+    d_xb = np.asarray(D.take(x, b), dtype=np.float64)
+    d_ab = np.asarray(D.gather(a, b), dtype=np.float64)
+
+    arrive_x = s["begin"][:-1] + d_ax / speed
+    arrive_b = np.maximum(arrive_x, early[x]) + d_xb / speed
+    push = np.maximum(arrive_b, early[b]) - s["begin"][1:]
+    others_ok = push <= s["slack"][1:] + EPS
+    own_late = np.maximum(arrive_x - late[x], 0.0)
+    cost = d_ax * c[x] + (d_xb - d_ab) * c[b]
+    return cost, others_ok, own_late
+
+
+'''
+Construction step: stops that arrive after their window end are taken out (which never delays the others) and
+put back one by one, tightest window end first, at the cheapest position where they are on time and nobody else
+gets later. A stop that fits nowhere goes where it is least late without delaying the others. When that leaves
+more total lateness than the input tour had, the input tour is kept.
+'''
+def fit_windows(D, c, tour, speed, start_h, early, late) -> list[int]:
+    s = schedule(D, tour, speed, start_h, early, late)
+    pending = [node for node, lateness in zip(tour[1:-1], s["late"][1:-1].tolist()) if lateness > EPS]
+    if not pending:
+        return list(tour)
+
+    original, total_late = list(tour), float(s["late"].sum())
+    removed = set(pending)
+    tour = [node for node in tour if node not in removed]
+    pending.sort(key=lambda x: (late[x], early[x]))
+    for x in pending:
+        s = schedule(D, tour, speed, start_h, early, late)
+        cost, ok, own = insertion(D, tour, x, s, speed, early, late, c)
+        on_time = ok & (own <= EPS)
+        if on_time.any():
+            p = int(np.argmin(np.where(on_time, cost, np.inf)))
+        else:
+            p = int(np.lexsort((cost, np.where(ok, own, np.inf)))[0])
+        tour.insert(p + 1, x)
+    if schedule(D, tour, speed, start_h, early, late)["late"].sum() > total_late + EPS:
+        return original
+    return tour
+
+
+'''
+Improvement: relocates single stops. For each stop the schedule of the route without it gives the slack, then
+every position is checked in O(1) with insertion(). A move is taken when the stop gets less late, or when the
+objective improves and the stop gets no later; nobody else gets later in either case. Repeats until no stop
+moves or time_budget seconds have passed.
+'''
+def relocate_windows(D, c, tour, speed, start_h, early, late, time_budget) -> list[int]:
+    deadline = time.perf_counter() + time_budget
+    tour = list(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for x in tour[1:-1]:
+            if time.perf_counter() >= deadline:
+                break
+            p = tour.index(x)
+            rest = tour[:p] + tour[p + 1:]
+            s = schedule(D, rest, speed, start_h, early, late)
+            cost, ok, own = insertion(D, rest, x, s, speed, early, late, c)
+            here_cost, here_late = cost[p - 1], own[p - 1]
+            eps = 1e-12 * max(abs(here_cost), 1.0)
+            better = ok & ((own < here_late - EPS) | ((own <= here_late + EPS) & (cost < here_cost - eps)))
+            if better.any():
+                q = int(np.lexsort((np.where(better, cost, np.inf), np.where(better, own, np.inf)))[0])
+                tour = rest[:q + 1] + [x] + rest[q + 1:]
+                improved = True
+    return tour
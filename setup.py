@@ -11,10 +11,13 @@ setup(
     python_requires=">=3.9",
     install_requires=[
         "matplotlib>=3.6",
+        "numpy>=1.23",
     ],
     entry_points={
         "console_scripts": [
             "smart-courier=SMART_COURIER.main:main",
+            "smart-courier-batch=SMART_COURIER.batch:main",
+            "smart-courier-serve=SMART_COURIER.serve:main",
         ],
     },
     include_package_data=True,
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from courier_route_optimization.distance import PlanarProjection
+from courier_route_optimization.utils import haversine_np
+
+
+# random boxes from the equator to near the poles, pairs between random points and the box corners
+@pytest.mark.parametrize("seed", range(5))
+def test_planar_error_within_bound(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(200):
+        lat_c = rng.uniform(-88, 88)
+        half_lat, half_lon = 10 ** rng.uniform(-3, 0.5), 10 ** rng.uniform(-3, 1)
+        lat_min, lat_max = max(lat_c - half_lat, -88.9), min(lat_c + half_lat, 88.9)
+        corners_lat = np.array([lat_min, lat_min, lat_max, lat_max, (lat_min + lat_max) / 2])
+        corners_lon = np.array([-half_lon, half_lon, -half_lon, half_lon, 0.0])
+        lat = np.concatenate((corners_lat, rng.uniform(lat_min, lat_max, 200)))
+        lon = np.concatenate((corners_lon, rng.uniform(-half_lon, half_lon, 200)))
+        projection = PlanarProjection(lat, lon)
+
+        a, b = rng.integers(0, len(lat), 5000), rng.integers(0, len(lat), 5000)
+        a = np.concatenate((a, np.repeat(np.arange(5), 5)))
+        b = np.concatenate((b, np.tile(np.arange(5), 5)))
+        exact = haversine_np(lat[a], lon[a], lat[b], lon[b])
+        planar = projection.distance_np(lat[a], lon[a], lat[b], lon[b])
+        apart = exact > 1e-6
+        assert np.abs(planar[apart] / exact[apart] - 1).max() <= projection.error_bound
+
+
+# the server calls one optimizer from several threads, a small row cache makes them evict each other's rows
+def test_lazy_matrix_rows_from_threads():
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    from courier_route_optimization.distance import LazyDistanceMatrix
+
+    rng = np.random.default_rng(0)
+    lat, lon = rng.uniform(59.8, 60.0, 200), rng.uniform(10.6, 10.9, 200)
+    matrix = LazyDistanceMatrix(lat, lon, dtype=np.float64, cache_bytes=3 * 200 * 8)
+    expected = haversine_np(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+    def work(seed):
+        rows = np.random.default_rng(seed).integers(0, 6, 3000)
+        for i in rows:
+            assert np.array_equal(matrix.row(i), expected[i])
+            assert np.array_equal(matrix.take(i, [0, 5]), expected[i, [0, 5]])
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(work, range(8)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert len(matrix._rows) <= matrix.max_rows
@@ -0,0 +1,68 @@
+import numpy as np
+from courier_route_optimization.distance_cache import DistanceCache
+from courier_route_optimization.utils import haversine_np
+
+
+def locations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 59.91 + rng.uniform(-0.1, 0.1, n), 10.75 + rng.uniform(-0.2, 0.2, n)
+
+
+def reference(lat_a, lon_a, lat_b, lon_b):
+    return haversine_np(lat_a[:, None], lon_a[:, None], lat_b[None, :], lon_b[None, :])
+
+
+def test_block_of_matches_haversine_with_repeats_and_gaps(tmp_path):
+    lat, lon = locations(40)
+    rng = np.random.default_rng(1)
+    with DistanceCache(tmp_path, block=8) as cache:
+        slots = cache.slots(lat, lon)
+        # [0, 0, 2] has as many slots as the range 0..2 but is not that range
+        for a in ([0, 0, 2], [2, 0, 0], [1, 3, 5, 7], [8, 9, 10], list(range(40))):
+            a = np.array(a)
+            b = rng.integers(0, 40, 25)
+            block = cache.block_of(slots[a], slots[b])
+            assert np.allclose(block, reference(lat[a], lon[a], lat[b], lon[b]), rtol=1e-6, atol=1e-6)
+        for _ in range(20):
+            a, b = rng.integers(0, 40, rng.integers(1, 30)), rng.integers(0, 40, rng.integers(1, 30))
+            block = cache.block_of(slots[a], slots[b])
+            assert np.allclose(block, reference(lat[a], lon[a], lat[b], lon[b]), rtol=1e-6, atol=1e-6)
+            assert np.allclose(cache.read(slots[a[:1]], slots[b[:1]]), block[0, 0])
+
+
+def test_matrix_of_warm_cache_for_a_smaller_manifest(tmp_path):
+    lat, lon = locations(30)
+    with DistanceCache(tmp_path, block=8) as cache:
+        cache.matrix(lat, lon)
+    keep = np.delete(np.arange(30), 3)
+    with DistanceCache(tmp_path, block=8) as cache:
+        M = cache.matrix(lat[keep], lon[keep])
+    assert np.allclose(M.data, reference(lat[keep], lon[keep], lat[keep], lon[keep]), rtol=1e-6, atol=1e-6)
+
+
+def test_compact_keeps_the_distances(tmp_path):
+    lat, lon = locations(50)
+    with DistanceCache(tmp_path, block=8) as cache:
+        cache.matrix(lat, lon)
+        cache.last_used[:] = 0
+        cache.slots(lat[:20], lon[:20])
+        cache.max_age_days = 1
+        cache.compact()
+        assert len(cache) == 20
+        M = cache.matrix(lat[:20], lon[:20])
+    assert np.allclose(M.data, reference(lat[:20], lon[:20], lat[:20], lon[:20]), rtol=1e-6, atol=1e-6)
+
+
+def test_two_runs_share_the_directory(tmp_path):
+    lat, lon = locations(30)
+    first = DistanceCache(tmp_path, block=8)
+    second = DistanceCache(tmp_path, block=8)      # the lock is not held between calls, so this does not block
+    first.matrix(lat[:20], lon[:20])
+    M = second.matrix(lat[10:], lon[10:])          # reloads the index the first run wrote, then adds its own
+    assert np.allclose(M.data, reference(lat[10:], lon[10:], lat[10:], lon[10:]), rtol=1e-6, atol=1e-6)
+    first.close()
+    second.close()
+    with DistanceCache(tmp_path, block=8) as cache:
+        assert len(cache) == 30
+        M = cache.matrix(lat, lon)
+    assert np.allclose(M.data, reference(lat, lon, lat, lon), rtol=1e-6, atol=1e-6)
@@ -0,0 +1,59 @@
+import itertools
+import numpy as np
+import pytest
+from courier_route_optimization.exact import held_karp, held_karp_bytes
+
+
+def tour_cost(W, c, order):
+    tour = [0] + [k + 1 for k in order] + [0]
+    return sum(W[a][b] * c[b] for a, b in zip(tour[:-1], tour[1:]))
+
+
+def brute_force(W, c):
+    n = len(W) - 1
+    return min(tour_cost(W, c, p) for p in itertools.permutations(range(n)))
+
+
+@pytest.mark.parametrize("n", range(0, 8))
+@pytest.mark.parametrize("symmetric", [True, False])
+def test_held_karp_matches_brute_force(n, symmetric):
+    rng = np.random.default_rng(n)
+    for _ in range(5):
+        W = rng.uniform(0.1, 10.0, (n + 1, n + 1))
+        if symmetric:
+            W = (W + W.T) / 2
+        np.fill_diagonal(W, 0.0)
+        c = rng.uniform(0.5, 3.0, n + 1)
+        order = held_karp(W, c, 2**30)
+        assert sorted(order) == list(range(n))
+        assert tour_cost(W, c, order) == pytest.approx(brute_force(W, c), rel=1e-12, abs=1e-12)
+
+
+def test_held_karp_refuses_over_memory():
+    W = np.ones((13, 13))
+    c = np.ones(13)
+    assert held_karp(W, c, held_karp_bytes(12) - 1) is None
+    assert held_karp(W, c, held_karp_bytes(12)) is not None
+
+
+def test_optimizer_exact_orders_are_optimal():
+    from courier_route_optimization.route_optimizer import RouteOptimizer
+    rng = np.random.default_rng(3)
+    depot = {"lat": 59.91, "lon": 10.75}
+    deliveries = [{"customer": f"C{i}", "lat": 59.91 + rng.uniform(-0.05, 0.05),
+                   "lon": 10.75 + rng.uniform(-0.1, 0.1), "priority": ["high", "medium", "low"][i % 3],
+                   "weight_kg": 1.0} for i in range(6)]
+    weights = {"time": 0.5, "cost": 0.3, "co2": 0.2}
+    optimizer = RouteOptimizer(depot, deliveries, "car", "multi", weights)
+    orders = dict(zip(("time", "co2", "cost", "multi"), optimizer.closest_route_order(multiobj=True)))
+    refs = optimizer._star_refs()
+
+    def objective(kind, order):
+        totals = optimizer.route_totals(list(order))
+        if kind == "multi":
+            return sum(weights[k] * totals[k] / refs[k] for k in weights)
+        return totals[kind]
+
+    for kind, order in orders.items():
+        best = min(objective(kind, p) for p in itertools.permutations(range(6)))
+        assert objective(kind, order) == pytest.approx(best, rel=1e-9)
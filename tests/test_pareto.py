@@ -0,0 +1,133 @@
+import csv
+import io
+import numpy as np
+import pytest
+from courier_route_optimization.pareto import ParetoArchive, is_dominated, pareto_index, pareto_ranks
+
+
+def random_points(rng, n):
+    # small integer grid so ties and identical points are common
+    return [tuple(float(v) for v in p) for p in rng.integers(0, 6, (n, 3))]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_pareto_index_matches_brute_force(seed):
+    points = random_points(np.random.default_rng(seed), 60)
+    expected = [i for i, p in enumerate(points) if not is_dominated(p, points)]
+    assert sorted(pareto_index(points)) == expected
+    ranks = pareto_ranks(points)
+    assert all(ranks[i] == 0 for i in expected)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_archive_keeps_the_front_and_writes_every_candidate(seed):
+    rng = np.random.default_rng(seed)
+    points = random_points(rng, 80)
+    # route k has point k, so distinct routes may share a point but never a route with another point
+    f = io.StringIO()
+    archive = ParetoArchive(csv.writer(f), timestamp="t")
+    for k, p in enumerate(points):
+        archive.add(p, 0.6, (k, 0.0, 0.0), [k])
+    archive.close()
+
+    expected = [k for k, p in enumerate(points) if not is_dominated(p, points)]
+    result = archive.result()
+    assert [int(r[0]) for r in result["routes"]] == expected
+    assert result["candidates"] == len(points)
+    rows = list(csv.reader(io.StringIO(f.getvalue())))
+    assert len(rows) == len(points)
+    assert sorted(int(float(r[2])) for r in rows if r[-1] == "yes") == expected
+
+
+def test_archive_skips_duplicate_route_and_gamma():
+    archive = ParetoArchive()
+    assert archive.add((1.0, 2.0, 3.0), 0.2, (1.0, 0.0, 0.0), [0, 1, 2])
+    assert not archive.add((1.0, 2.0, 3.0), 0.2, (0.5, 0.5, 0.0), [0, 1, 2])
+    assert archive.add((1.0, 2.0, 3.0), 0.6, (0.5, 0.5, 0.0), [0, 1, 2])
+    assert archive.add((1.0, 2.0, 3.0), 0.2, (0.5, 0.5, 0.0), [0, 2, 1])
+    result = archive.result()
+    assert len(result["routes"]) == 3 and result["candidates"] == 4
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_archive_output_does_not_depend_on_arrival_order(seed):
+    rng = np.random.default_rng(seed)
+    # 15 distinct routes, each arriving several times (with other weights) and with two gammas
+    points = random_points(rng, 15)
+    candidates = [(points[r], gamma, (float(k), 0.0, 0.0), [r]) for k in range(4) for r in range(15)
+                  for gamma in (0.2, 0.6)]
+
+    outputs = []
+    for _ in range(5):
+        f = io.StringIO()
+        archive = ParetoArchive(csv.writer(f), timestamp="t")
+        for k in rng.permutation(len(candidates)).tolist():
+            archive.add(*candidates[k])
+        archive.close()
+        rows = sorted((r[1], *r[5:]) for r in csv.reader(io.StringIO(f.getvalue())))
+        result = archive.result()
+        front = sorted((tuple(p), g, int(r[0])) for p, g, r in zip(result["performance"], result["gammas"],
+                                                                   result["routes"]))
+        outputs.append((rows, front, result["candidates"]))
+
+    assert all(out == outputs[0] for out in outputs[1:])
+    rows, front, n = outputs[0]
+    assert n == len(candidates) and len(rows) == 30
+    expected = {(p, g, r) for r, p in enumerate(points) for g in (0.2, 0.6) if not is_dominated(p, points)}
+    assert set(front) == expected
+
+
+def sweep_optimizer(n=30, seed=0):
+    from courier_route_optimization.route_optimizer import RouteOptimizer
+
+    rng = np.random.default_rng(seed)
+    depot = {"name": "Depot", "lat": 59.91, "lon": 10.75}
+    deliveries = [{"customer": f"Customer {chr(65 + i % 26)}", "lat": 59.91 + rng.uniform(-0.05, 0.05),
+                   "lon": 10.75 + rng.uniform(-0.1, 0.1), "priority": ("low", "medium", "high")[i % 3],
+                   "weight_kg": 1.0} for i in range(n)]
+    return RouteOptimizer(depot, deliveries, "car", "multi", {"time": 1.0, "cost": 0.0, "co2": 0.0})
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+def test_sweep_needs_at_least_one_step(adaptive):
+    from courier_route_optimization.pareto import evaluate_pareto_routes
+
+    with pytest.raises(ValueError):
+        evaluate_pareto_routes(sweep_optimizer(), n_steps=0, save_csv=False, adaptive=adaptive)
+
+
+# every refinement level goes to the same worker pool, and the front is the one of a serial run
+def test_adaptive_sweep_starts_one_pool(monkeypatch):
+    from courier_route_optimization import pareto
+
+    pools = []
+    class CountingPool(pareto.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(pareto, "ProcessPoolExecutor", CountingPool)
+    serial = pareto.evaluate_pareto_routes(sweep_optimizer(), n_steps=8, save_csv=False, adaptive=True, workers=1)
+    parallel = pareto.evaluate_pareto_routes(sweep_optimizer(), n_steps=8, save_csv=False, adaptive=True, workers=2)
+    assert len(pools) == 1
+    assert parallel["performance"] == serial["performance"]
+    assert parallel["candidates"] == serial["candidates"]
+
+
+# a pool worker's optimizer has the parent's road network, not a haversine or planar stand-in
+def test_pareto_workers_get_the_road_network(tmp_path, monkeypatch):
+    from courier_route_optimization import pareto
+    from courier_route_optimization.road import RoadNetwork
+    from tests.test_road import write_graph
+
+    write_graph(tmp_path, 6, 0)
+    road = RoadNetwork(tmp_path)
+    optimizer = sweep_optimizer()
+    optimizer = type(optimizer)(optimizer.depot, optimizer.deliveries, "car", "multi", optimizer.multi_weights,
+                                distance="auto", road_network=road)
+    monkeypatch.setattr(pareto, "_worker", {})
+    pareto._init_worker(*pareto._worker_args(optimizer, None))
+    worker = pareto._worker["optimizer"]
+    assert worker.road_network is road
+    assert worker.projection is None and worker.spatial_index is False
+    assert worker.distance_np.__func__ is RoadNetwork.distance_np
@@ -0,0 +1,77 @@
+import csv
+import pytest
+from courier_route_optimization.IO.reader import load_deliveries_streaming, validate_rows
+
+
+# multi-line quoted fields with "" escapes, stray quotes in unquoted fields and empty lines
+MANIFEST = (
+    'customer,latitude,longitude,priority,weight_kg\r\n'
+    'Anna Berg,59.91,10.75,high,2\r\n'
+    'Ann"a,59.92,10.76,low,1\r\n'
+    '"Bob\r\nSmith",59.93,10.77,medium,3\r\n'
+    '\r\n'
+    '"Cora ""C"" Lund",59.94,10.78,low,4\r\n'
+    '"Dag\r\n""the\r\nsecond""",59.95,10.79,high,5\r\n'
+    'Eva,91,10.8,high,1\r\n'
+    'Finn,"59,96",10.81,"me\r\ndium",1\r\n'
+    'Gro"",59.97,10.82,low,0\r\n'
+    'Hans,59.98,10.83,low,"1,5"\r\n'
+)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("chunk_size", range(1, 8))
+def test_chunks_end_between_csv_records(tmp_path, chunk_size, workers):
+    path = tmp_path / "deliveries.csv"
+    path.write_text(MANIFEST, newline="")
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        fieldnames = next(reader)
+        expected, expected_rejected = validate_rows([row for row in reader if row], fieldnames)
+
+    table, n_rejected = load_deliveries_streaming(path, tmp_path / "rejected.csv", chunk_size=chunk_size,
+                                                   workers=workers)
+    with open(tmp_path / "rejected.csv", newline="") as f:
+        rejected = [(int(r["row"]), r["cause"], r["customer"]) for r in csv.DictReader(f)]
+
+    assert table.customer == expected.customer == ["Anna Berg", "Bob\r\nSmith", "Hans"]
+    assert table.weight_kg.tolist() == [2.0, 3.0, 1.5]
+    assert n_rejected == len(rejected) == 6
+    assert rejected == [(r["row"] + 2, r["cause"], r["customer"]) for r in expected_rejected]
+    assert [(row, customer) for row, _, customer in rejected] == [
+        (3, 'Ann"a'), (5, 'Cora "C" Lund'), (6, 'Dag\r\n"the\r\nsecond"'), (7, "Eva"), (8, "Finn"), (9, 'Gro""')]
+
+
+# a row is rejected with the message of its first failing check, in the order the checks always ran
+def test_first_failing_check_gives_the_cause():
+    fieldnames = ["customer", "latitude", "longitude", "priority", "weight_kg", "window_start", "window_end"]
+    rows = [
+        ["", "abc", "10", "x", "0", "99:00", ""],
+        ["R2D2", "abc", "10", "x", "0", "", ""],
+        ["Ann", "abc", "1e999", "x", "0", "", ""],
+        ["Ann", "59.9", "abc", "x", "0", "", ""],
+        ["Ann", "nan", "10", "x", "0", "", ""],
+        ["Ann", "59.9", "10", "x", "zero", "", ""],
+        ["Ann", "59.9", "10", "low", "zero", "", ""],
+        ["Ann", "59.9", "10", "low", "-1", "7:00", "6:00"],
+        ["Ann", "59.9", "10", "low", "1", "7:61", "6:00"],
+        ["Ann", "59.9", "10", "low", "1", "7:00", "6:00"],
+        ["Ann", "59,9", "10", " LOW ", "nan", "7:00", ""],
+        ["Ann", "59.9", "10"],
+    ]
+    table, rejected = validate_rows(rows, fieldnames)
+    assert [(r["row"], r["cause"]) for r in rejected] == [
+        (0, "No customer name"),
+        (1, "Invalid customer name (contains digits or illegal characters)"),
+        (2, "could not convert string to float: 'abc'"),
+        (3, "could not convert string to float: 'abc'"),
+        (4, "Coordinates are out of valid range"),
+        (5, "The priority value is not valid (high/medium/low)"),
+        (6, "could not convert string to float: 'zero'"),
+        (7, "The package weight is zero or negative value"),
+        (8, "Invalid delivery window time (use HH:MM): 7:61"),
+        (9, "The delivery window ends before it starts"),
+        (11, "The priority value is not valid (high/medium/low)"),
+    ]
+    assert rejected[-1]["priority"] is None and rejected[-1]["window_end"] is None
+    assert table.customer == ["Ann"] and table.lat.tolist() == [59.9] and table.window_start.tolist() == [7.0]
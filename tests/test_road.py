@@ -0,0 +1,82 @@
+import csv
+import numpy as np
+import pytest
+from courier_route_optimization.road import RoadNetwork, read_road_graph
+
+
+# random street grid: nodes on a jittered grid, random lengths, some one-way streets and a few missing streets
+def write_graph(path, side, seed):
+    rng = np.random.default_rng(seed)
+    ids = rng.permutation(side * side) + 100
+    with open(path / "nodes.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["id", "latitude", "longitude"])
+        for k, node in enumerate(ids.tolist()):
+            w.writerow([node, 59.9 + (k // side) * 0.002 + rng.uniform(0, 5e-4), 10.7 + (k % side) * 0.004])
+    with open(path / "edges.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["u", "v", "length", "oneway"])
+        for k in range(side * side):
+            for nb in ((k + 1) if (k + 1) % side else None, k + side if k + side < side * side else None):
+                if nb is None or rng.random() < 0.1:
+                    continue
+                u, v = (ids[k], ids[nb]) if rng.random() < 0.5 else (ids[nb], ids[k])
+                w.writerow([u, v, round(rng.uniform(150, 600), 1), "yes" if rng.random() < 0.25 else ""])
+
+
+# all-pairs shortest paths (Floyd-Warshall) over the graph as read from the csv files
+def reference(path):
+    ids, _, _, tail, head, km = read_road_graph(path)
+    n = len(ids)
+    d = np.full((n, n), np.inf)
+    np.fill_diagonal(d, 0.0)
+    np.minimum.at(d, (tail, head), km)
+    for k in range(n):
+        d = np.minimum(d, d[:, k, None] + d[None, k, :])
+    return d
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_ch_queries_match_all_pairs_shortest_paths(tmp_path, seed):
+    write_graph(tmp_path, 7, seed)
+    expected = reference(tmp_path)
+    road = RoadNetwork(tmp_path)
+    nodes = np.arange(len(road))
+    got = road.node_matrix(nodes, nodes)
+    assert np.array_equal(np.isinf(got), np.isinf(expected))
+    finite = np.isfinite(expected)
+    assert np.allclose(got[finite], expected[finite], rtol=1e-9)
+
+    # the cached hierarchy gives the same answers
+    cached = RoadNetwork(tmp_path)
+    assert np.allclose(cached.node_matrix(nodes[:10], nodes), got[:10], equal_nan=True)
+
+
+# duplicates and near neighbours share a graph node, matrix and distance_np give every pair the same distance
+@pytest.mark.parametrize("seed", range(3))
+def test_matrix_and_distance_np_agree_on_shared_nodes(tmp_path, seed):
+    from courier_route_optimization.utils import haversine_np
+
+    write_graph(tmp_path, 6, seed)
+    road = RoadNetwork(tmp_path)
+    # stops next to nodes that all reach each other (some streets are missing or one-way)
+    reach = np.isfinite(reference(tmp_path))
+    hub = reach.sum(axis=1).argmax()
+    rng = np.random.default_rng(seed)
+    nodes = rng.choice(np.flatnonzero(reach[hub] & reach[:, hub]), 12)
+    lat = road.lat[nodes] + rng.uniform(-1e-5, 1e-5, 12)
+    lon = road.lon[nodes] + rng.uniform(-1e-5, 1e-5, 12)
+    lat = np.concatenate((lat, lat[:3], lat[:3] + 1e-5))
+    lon = np.concatenate((lon, lon[:3], lon[:3] - 1e-5))
+
+    d = road.matrix(lat, lon).row
+    a, b = np.meshgrid(np.arange(len(lat)), np.arange(len(lat)), indexing="ij")
+    pairs = road.distance_np(lat[a.ravel()], lon[a.ravel()], lat[b.ravel()], lon[b.ravel()]).reshape(a.shape)
+    matrix = np.array([d(i) for i in range(len(lat))])
+    assert np.allclose(matrix, pairs, rtol=1e-12, atol=0)
+    assert (matrix[np.arange(3), np.arange(12, 15)] == 0).all()
+
+    nodes, _ = road.snap(lat, lon)
+    same = nodes[:, None] == nodes[None, :]
+    straight = haversine_np(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    assert np.allclose(matrix[same], straight[same], rtol=1e-12, atol=0)
@@ -0,0 +1,25 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from courier_route_optimization.route_optimizer import RouteOptimizer
+
+
+def test_route_rows_cover_every_delivery_and_match_route_totals():
+    rng = np.random.default_rng(0)
+    depot = {"name": "Depot", "lat": 59.91, "lon": 10.75}
+    deliveries = [{"customer": f"Customer {chr(65 + i)}", "lat": 59.91 + rng.uniform(-0.05, 0.05),
+                   "lon": 10.75 + rng.uniform(-0.1, 0.1), "priority": "medium", "weight_kg": 1.0}
+                  for i in range(25)]
+    optimizer = RouteOptimizer(depot, deliveries, "car", "time", {"time": 1.0, "cost": 0.0, "co2": 0.0})
+    order = optimizer.closest_route_order(orders=("time",))[0]
+    route = optimizer.route_builder(order, datetime(2025, 1, 1, 8))
+
+    assert len(route) == len(order) + 2
+    assert route.customer[1:-1] == [deliveries[k]["customer"] for k in order]
+    totals = optimizer.route_totals(order, prio_on_time=False)
+    assert route.totals()["distance_km"] == pytest.approx(
+        sum(optimizer.distance_matrix.gather(np.array([0] + [k + 1 for k in order]),
+                                             np.array([k + 1 for k in order] + [0]))))
+    assert route.totals()["cost_nok"] == pytest.approx(totals["cost"])
+    assert route.totals()["co2_g"] == pytest.approx(totals["co2"])
+    assert route.totals()["time_h"] == pytest.approx(totals["t_actual"])
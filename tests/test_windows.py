@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from courier_route_optimization.distance import DistanceMatrix
+from courier_route_optimization.windows import schedule, insertion, fit_windows, EPS
+
+SPEED = 30.0
+START = 8.0
+
+
+# stop by stop reference of schedule(): arrival, begin after waiting and lateness per position
+def simulate(D, tour, early, late):
+    arrival, begin, now = [START], [START], START
+    for a, b in zip(tour[:-1], tour[1:]):
+        now += D[a, b] / SPEED
+        arrival.append(now)
+        now = max(now, early[b])
+        begin.append(now)
+    arrival, begin = np.array(arrival), np.array(begin)
+    return arrival, begin, np.maximum(arrival - late[np.asarray(tour)], 0.0)
+
+
+def instance(n, seed):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 20, (n + 1, 2))
+    D = np.sqrt(((xy[:, None] - xy[None, :]) ** 2).sum(-1))
+    # windows as the loader accepts them (the end is not before the start), open on one or both sides
+    opens = START + rng.uniform(0, 2, n)
+    closes = opens + rng.uniform(0.1, 1.5, n)
+    early = np.concatenate(([-np.inf], np.where(rng.random(n) < 0.5, opens, -np.inf)))
+    late = np.concatenate(([np.inf], np.where(rng.random(n) < 0.7, closes, np.inf)))
+    tour = [0] + (rng.permutation(n) + 1).tolist() + [0]
+    return D, early, late, tour
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_schedule_matches_simulation(seed):
+    D, early, late, tour = instance(8, seed)
+    s = schedule(DistanceMatrix(D), tour, SPEED, START, early, late)
+    arrival, begin, lateness = simulate(D, tour, early, late)
+    assert np.allclose(s["arrival"], arrival)
+    assert np.allclose(s["begin"], begin)
+    assert np.allclose(s["late"], lateness)
+    assert np.allclose(s["wait"], begin - arrival)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_insertion_matches_simulation(seed):
+    D, early, late, full = instance(9, seed)
+    x = full[1 + seed % 9]
+    tour = [node for node in full if node != x]
+    c = np.random.default_rng(seed).uniform(0.5, 2.0, len(D))
+    s = schedule(DistanceMatrix(D), tour, SPEED, START, early, late)
+    cost, others_ok, own_late = insertion(DistanceMatrix(D), tour, x, s, SPEED, early, late, c)
+
+    arrival, _, _ = simulate(D, tour, early, late)
+    # a stop that is already late may keep its lateness, no stop may get later than that
+    limit = np.maximum(late[np.asarray(tour)], arrival)
+    base = sum(D[a, b] * c[b] for a, b in zip(tour[:-1], tour[1:]))
+    for p in range(len(tour) - 1):
+        new = tour[:p + 1] + [x] + tour[p + 1:]
+        new_arrival, _, new_late = simulate(D, new, early, late)
+        others = np.delete(new_arrival, p + 1)
+        assert others_ok[p] == bool((others <= limit + EPS).all())
+        assert own_late[p] == pytest.approx(new_late[p + 1], abs=1e-9)
+        assert cost[p] == pytest.approx(sum(D[a, b] * c[b] for a, b in zip(new[:-1], new[1:])) - base)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_fit_windows_never_adds_lateness(seed):
+    D, early, late, tour = instance(10, seed)
+    c = np.ones(len(D))
+    fitted = fit_windows(DistanceMatrix(D), c, tour, SPEED, START, early, late)
+    assert sorted(fitted) == sorted(tour) and fitted[0] == fitted[-1] == 0
+    assert simulate(D, fitted, early, late)[2].sum() <= simulate(D, tour, early, late)[2].sum() + EPS